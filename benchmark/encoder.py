@@ -0,0 +1,87 @@
+'''
+Compare the JSON backends of sugar_api.JSON on a collection response and
+on WebSocket frames.
+
+    python benchmark/encoder.py [resources] [repeat]
+'''
+
+import sys
+from datetime import datetime, timedelta
+from timeit import repeat
+
+from bson import ObjectId
+
+from sugar_api.encoder import __backends__
+
+
+def collection(size):
+    now = datetime(2020, 1, 1)
+    return {
+        'data': [
+            {
+                'type': 'users',
+                'id': str(ObjectId()),
+                'attributes': {
+                    'username': f'user{index}',
+                    'email': f'user{index}@example.com',
+                    'groups': [ 'users', 'editors' ],
+                    'score': index * 0.25,
+                    'active': index % 2 == 0,
+                    'created': now + timedelta(seconds=index),
+                    'updated': now + timedelta(minutes=index),
+                    'profile': {
+                        'name': f'User {index}',
+                        'location': None
+                    }
+                }
+            }
+            for index in range(size)
+        ],
+        'meta': {
+            'offset': 0,
+            'limit': size
+        }
+    }
+
+def frames(size):
+    return [
+        {
+            'action': 'update',
+            'id': str(ObjectId()),
+            'time': datetime(2020, 1, 1)
+        }
+        for index in range(size)
+    ]
+
+def measure(name, function, number, count):
+    best = min(repeat(function, number=number, repeat=count)) / number
+    print(f'  {name:<10} {best * 1000:10.3f} ms')
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    document = collection(size)
+    messages = frames(size)
+
+    backends = { name: Backend() for (name, Backend) in __backends__.items() }
+
+    reference = backends['json'].dumpb(document)
+
+    print(f'collection of {size} resources, {len(reference)} bytes')
+    for (name, backend) in backends.items():
+        if not backend.dumpb(document) == reference:
+            print(f'  {name:<10} output differs from json')
+        measure(name, lambda: backend.dumpb(document), 10, count)
+
+    print(f'{size} websocket frames')
+    for (name, backend) in backends.items():
+        measure(name, lambda: [ backend.dumps(message) for message in messages ], 10, count)
+
+    print(f'decode collection of {size} resources')
+    for (name, backend) in backends.items():
+        measure(name, lambda: backend.loads(reference), 10, count)
+
+
+if __name__ == '__main__':
+    main()
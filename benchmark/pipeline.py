@@ -0,0 +1,124 @@
+'''
+Compare the per-request overhead of nested decorators with the flat
+pipelines built by JSONAPIMixin.resource(), for a model without rate
+limit, ACL or set restrictions. The handler does nothing, so the numbers
+are the cost of the checks themselves.
+
+    python benchmark/pipeline.py [requests] [repeat]
+'''
+
+import asyncio
+import sys
+from time import perf_counter
+from types import SimpleNamespace
+
+from sanic.response import HTTPResponse
+
+from sugar_api import accept, acl, content_type, etag, objectid, rate, set, \
+    validate, webtoken
+from sugar_api.acl import _acl
+from sugar_api.header import _accept, _content_type, _etag
+from sugar_api.objectid import _objectid
+from sugar_api.pipeline import pipeline
+from sugar_api.rate import _rate
+from sugar_api.restrictions import _set
+from sugar_api.validate import _validate
+from sugar_api.webtoken import _webtoken
+
+
+ID = '5f0000000000000000000000'
+
+HEADERS = {
+    'Accept': 'application/vnd.api+json',
+    'Content-Type': 'application/vnd.api+json'
+}
+
+BODY = {
+    'data': {
+        'type': 'items',
+        'id': ID,
+        'attributes': {
+            'field': 'value'
+        }
+    }
+}
+
+RESPONSE = HTTPResponse(body=b'{}', status=204)
+
+
+async def handler(request, *args, **kargs):
+    return RESPONSE
+
+def nested():
+
+    @etag
+    @objectid('id')
+    @accept
+    @webtoken
+    @rate(0, 'none')
+    @acl('read', None)
+    async def read(*args, **kargs):
+        return await handler(*args, **kargs)
+
+    @objectid('id')
+    @content_type
+    @accept
+    @validate
+    @webtoken
+    @rate(0, 'none')
+    @acl('update', None)
+    @set(None)
+    async def update(*args, **kargs):
+        return await handler(*args, **kargs)
+
+    return (read, update)
+
+def flat():
+
+    read = pipeline(handler, [
+        _objectid('id'),
+        _accept,
+        _webtoken,
+        _rate(0, 'none'),
+        _acl('read', None)
+    ], after=[ _etag ])
+
+    update = pipeline(handler, [
+        _objectid('id'),
+        _content_type,
+        _accept,
+        _validate,
+        _webtoken,
+        _rate(0, 'none'),
+        _acl('update', None),
+        _set(None)
+    ])
+
+    return (read, update)
+
+async def measure(route, count):
+    start = perf_counter()
+    for index in range(count):
+        request = SimpleNamespace(headers=HEADERS, json=BODY,
+            ctx=SimpleNamespace())
+        await route(request, id=ID)
+    return (perf_counter() - start) / count
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    routes = {
+        'nested': nested(),
+        'flat': flat()
+    }
+
+    for (index, name) in enumerate([ 'GET /items/<id>', 'PATCH /items/<id>' ]):
+        print(name)
+        for (kind, route) in routes.items():
+            best = min([ await measure(route[index], count) for _ in range(repeat) ])
+            print(f'  {kind:<8} {best * 1000000:8.2f} us/request')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -21,5 +21,8 @@ setup(
         'pyjwt',
         'aioredis',
         'aioredis-lock'
-    ]
+    ],
+    extras_require={
+        'orjson': [ 'orjson' ]
+    }
 )
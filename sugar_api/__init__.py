@@ -4,8 +4,10 @@ This is a docstring.
 
 from . acl import acl, socketacl
 from . cors import CORS
+from . encoder import JSON
 from . error import Error
-from . header import accept, content_type, jsonapi
+from . header import accept, content_type, etag, jsonapi, jsonapi_body, \
+    jsonapi_stream
 from . lock import acquire, release
 from . mixin import TimestampMixin, JSONAPIMixin
 from . objectid import objectid
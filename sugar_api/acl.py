@@ -1,7 +1,11 @@
-import json
+from . context import context
+from . encoder import JSON
+from . header import jsonapi_body
+from . error import encode_error
+from . pipeline import wrap
 
-from . header import jsonapi
-from . error import Error
+
+__acl_error__ = encode_error('ACL Error', 'Insufficient priviliges.', 403)
 
 
 def acl(action, acl, Model=None):
@@ -13,20 +17,29 @@ def acl(action, acl, Model=None):
     :param acl: The ACL to check against.
     :param Model: The Model to apply the ACL to.
     '''
-    def wrapper(handler):
-        async def decorator(request, *args, **kargs):
-            token = kargs.get('token')
-            id = kargs.get('id')
-            if not await _check_acl(action, acl, token, id, Model):
-                error = Error(
-                    title = 'ACL Error',
-                    detail = 'Insufficient priviliges.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
-            return await handler(request, *args, **kargs)
-        return decorator
-    return wrapper
+    return wrap(_acl(action, acl, Model))
+
+def _acl(action, acl, Model=None, query=None):
+
+    acl = compile_acl(acl)
+
+    # XXX: Every action is allowed without an ACL.
+
+    if acl is None:
+        return None
+
+    async def stage(request, kargs):
+        token = kargs.get('token')
+        id = kargs.get('id')
+        ctx = context(request)
+        if not await _check_acl(action, acl, token, id, Model, context=ctx):
+            # XXX: A denied collection action is allowed for the documents
+            # XXX: that the field rules for `query` grant to the user.
+            ctx.query = query and _acl_query(query, acl, token)
+            if not ctx.query:
+                return jsonapi_body(__acl_error__, status=403)
+        return None
+    return stage
 
 def socketacl(action, acl, Model=None):
     '''
@@ -37,11 +50,13 @@ def socketacl(action, acl, Model=None):
     :param acl: The ACL to check against.
     :param Model: The Model to apply the ACL to.
     '''
+    acl = compile_acl(acl)
     def wrapper(handler):
         async def decorator(state, doc, *args, **kargs):
             id = kargs.get('id')
-            if not await _check_acl(action, acl, state.token, id, Model):
-                await state.socket.send(json.dumps({
+            if not await _check_acl(action, acl, state.token, id, Model,
+                context=context(state)):
+                await state.socket.send(JSON.dumps({
                     'action': 'acl-restricted'
                 }))
             else:
@@ -49,118 +64,161 @@ def socketacl(action, acl, Model=None):
         return decorator
     return wrapper
 
-def _check_action(action, actions):
-    if action in actions:
-        return True
-    if 'all' in actions:
-        return True
-    return False
-
-async def _check_acl(action, acl, token, id, Model):
-
-    valid = True
+class ACL(object):
 
-    if acl:
+    '''
+    An ACL compiled once, see :func:`compile_acl`. The special entries are
+    split out and every list of actions is a frozenset.
+    '''
 
-        valid = False
+    __slots__ = ( 'acl', 'unauthorized', 'self', 'other', 'groups',
+        'specific', 'grouped', 'fields' )
+
+    def __init__(self, acl):
+        self.acl = acl
+        self.unauthorized = frozenset(acl.get('unauthorized', ( )))
+        self.self = frozenset(acl.get('self', ( )))
+        self.other = frozenset(acl.get('other', ( )))
+        self.groups = { }
+        specific = [ ]
+        grouped = [ ]
+        for (key, actions) in acl.items():
+            if key in ('unauthorized', 'self', 'other'):
+                continue
+            if key.startswith('$'):
+                specific.append((tuple(key.lstrip('$').split('.')), frozenset(actions or ( ))))
+            elif key.startswith('#'):
+                grouped.append((tuple(key.lstrip('#').split('.')), frozenset(actions or ( ))))
+            else:
+                self.groups[key] = frozenset(actions or ( ))
+        self.specific = tuple(specific)
+        self.grouped = tuple(grouped)
+        self.fields = frozenset.union(frozenset(),
+            *map(lambda rule: rule[1], specific + grouped))
 
-        acl_copy = acl.copy()
+def compile_acl(acl):
+    '''
+    Compile `acl`, a model's `__acl__`, into an :class:`ACL`. The stages
+    and models compile their ACL once, an ACL must not be modified once
+    it is in use.
 
-        try:
-            del acl_copy['unauthorized']
-        except:
-            pass
+    :return: An :class:`ACL` or `None` if `acl` is empty.
+    '''
+    if not acl:
+        return None
+    if isinstance(acl, ACL):
+        return acl
+    return ACL(acl)
 
-        try:
-            del acl_copy['self']
-        except:
-            pass
+def _allowed(action, actions):
+    return action in actions or 'all' in actions
 
-        try:
-            del acl_copy['other']
-        except:
-            pass
+async def _check_acl(action, acl, token, id, Model, model=None, context=None):
 
-        specific = list(filter(lambda field: \
-            field.startswith('$'), acl.keys()))
+    acl = compile_acl(acl)
 
-        for field in specific:
-            del acl_copy[field]
+    if acl is None:
+        return True
 
-        grouped = list(filter(lambda field: \
-            field.startswith('#'), acl.keys()))
+    valid = False
 
-        for field in grouped:
-            del acl_copy[field]
+    skip_user_group_field = False
+    skip_other = False
 
-        skip_user_group_field = False
-        skip_other = False
+    data = (token or { }).get('data')
 
-        data = (token or { }).get('data')
+    token_id = (data or { }).get('id')
+    token_groups = (data or { }).get('groups', [ ])
 
-        token_id = (data or { }).get('id')
-        token_groups = (data or { }).get('groups', [ ])
+    # Check for unauthorized actions.
+    if not isinstance(data, dict):
+        skip_user_group_field = True
+        skip_other = True
+        if _allowed(action, acl.unauthorized):
+            valid = True
 
-        # Check for unauthorized actions.
-        if not isinstance(data, dict):
+    if not skip_user_group_field and (token_id or token_groups):
+        # Check for self actions.
+        if id == token_id:
+            # Skip checking fields if the document is self.
             skip_user_group_field = True
+            # Skip checking other if document is self.
             skip_other = True
-            if _check_action(action, acl.get('unauthorized', { })):
+            if _allowed(action, acl.self):
                 valid = True
 
-        if not skip_user_group_field and (token_id or token_groups):
-            # Check for self actions.
-            if id == token_id:
-                # Skip checking fields if the document is self.
-                skip_user_group_field = True
-                # Skip checking other if document is self.
+        # Check for group actions.
+        groups = acl.groups
+        for group in token_groups:
+            actions = groups.get(group)
+            if actions is not None:
                 skip_other = True
-                if _check_action(action, acl.get('self', { })):
+                if _allowed(action, actions):
                     valid = True
 
-            # Check for group actions.
-            for group in token_groups:
-                if group in acl_copy:
-                    skip_other = True
-                    if _check_action(action, acl_copy.get(group, { })):
-                        valid = True
+    # Check for other actions.
+    if not skip_other and _allowed(action, acl.other):
+        valid = True
 
-        # Check for field actions.
-        if not skip_user_group_field and token_id and id:
+    # Check for field actions, the document is only loaded when a field
+    # rule could allow the action.
+    if not valid and not skip_user_group_field and token_id and id \
+        and _allowed(action, acl.fields):
 
-            if Model and await Model.exists(id):
+        if model is None and Model:
+            if context:
+                model = await context.load(Model, id)
+            elif await Model.exists(id):
                 model = await Model.find_by_id(id)
 
-                specific_fields = _get_fields(model, specific, '$')
-                for name, value in specific_fields.items():
-                    if token_id == value:
-                        if _check_action(action, acl.get(name)):
-                            valid = True
-
-                grouped_fields = _get_fields(model, grouped, '#')
-                for name, value in grouped_fields.items():
-                    if token_id in value:
-                        if _check_action(action, acl.get(name)):
-                            valid = True
-
-        # Check for other actions.
-        if not skip_other:
-            if _check_action(action, acl.get('other', { })):
-                    valid = True
+        if model is not None:
+
+            for (path, actions) in acl.specific:
+                if _allowed(action, actions) \
+                    and token_id == _get_path(model, path):
+                    return True
+
+            for (path, actions) in acl.grouped:
+                if _allowed(action, actions):
+                    value = _get_path(model, path)
+                    if value and token_id in value:
+                        return True
 
     return valid
 
-def _get_field(model, field, prefix):
+def _acl_query(action, acl, token):
+    '''
+    Build a query matching the documents that the `$` and `#` field rules
+    of `acl` allow `action` on for `token`.
+
+    :return: The query or `None` if no field rule applies.
+    '''
+    acl = compile_acl(acl)
+
+    if acl is None or not _allowed(action, acl.fields):
+        return None
+
+    data = (token or { }).get('data')
+
+    if not isinstance(data, dict) or not data.get('id'):
+        return None
+
+    token_id = data['id']
+
+    rules = filter(lambda rule: _allowed(action, rule[1]),
+        acl.specific + acl.grouped)
+
+    query = list(map(lambda rule: { '.'.join(rule[0]): token_id }, rules))
+
+    if len(query) == 1:
+        return query[0]
+
+    return { '$or': query }
+
+def _get_path(model, path):
     data = model
-    field = field.lstrip(prefix)
-    for key in field.split('.'):
+    for key in path:
         data = data.get(key)
         if not data:
             return None
     return data
-
-def _get_fields(model, fields, prefix):
-    model_fields = { }
-    for field in fields:
-        model_fields[field] = _get_field(model, field, prefix)
-    return model_fields
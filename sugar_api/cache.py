@@ -0,0 +1,94 @@
+import json
+from hashlib import sha1
+from uuid import uuid4
+
+from . redis import Redis
+
+
+def _entry_key(table, id, audience):
+    return f'cache:{table}:{id}:{audience}'
+
+def _generation_key(table, id):
+    return f'cache:{table}:{id}:generation'
+
+def _count_key(table, query):
+    query = json.dumps(query, separators=(',', ':'), sort_keys=True, default=str)
+    return f'count:{table}:{sha1(query.encode()).hexdigest()}'
+
+async def get(table, id, audience):
+    '''
+    Look up a cached response body for document `id` in `table` as seen by
+    `audience`.
+
+    :param table: The table the document belongs to.
+    :param id: The document id.
+    :param audience: The audience key of the caller.
+    :return: A tuple of `(body, tag, generation)`, `body` is `None` on a
+             miss and `tag` is the ETag stored with the body, if any.
+             `generation` must be passed to :func:`put`.
+    '''
+    redis = await Redis.connect()
+    entry, generation = await redis.mget(
+        _entry_key(table, id, audience),
+        _generation_key(table, id)
+    )
+    generation = generation or b'0'
+    if entry:
+        _generation, _, entry = entry.partition(b':')
+        if _generation == generation:
+            tag, _, body = entry.partition(b':')
+            return (body, tag.decode() or None, generation)
+    return (None, None, generation)
+
+async def put(table, id, audience, generation, body, expire, tag=None):
+    '''
+    Cache a response `body` for document `id` in `table` as seen by
+    `audience`. The entry is only served while the document's generation
+    is still `generation`, so a write that happens while the response is
+    being built is never hidden by the cache.
+
+    :param expire: The number of seconds to keep the entry.
+    :param tag: The ETag of the response, served with the body.
+    '''
+    redis = await Redis.connect()
+    transaction = redis.multi_exec()
+    transaction.set(_entry_key(table, id, audience),
+        generation + b':' + (tag or '').encode() + b':' + body, expire=expire)
+    # The generation has to outlive every entry tagged with it.
+    transaction.expire(_generation_key(table, id), expire * 2)
+    await transaction.execute()
+
+def invalidate(pipeline, table, id, expire):
+    '''
+    Queue the invalidation of every cached response for document `id`
+    in `table` on a Redis `pipeline`.
+
+    :param expire: The longest expiry of the cached entries, in seconds.
+    '''
+    # Generations are unique rather than counted, so a generation key
+    # that expired and is set again never matches an older entry.
+    pipeline.set(_generation_key(table, id), uuid4().hex.encode(),
+        expire=expire * 2)
+
+async def get_count(table, query):
+    '''
+    Look up the cached document count of `query` in `table`.
+
+    :return: The `meta` members of the count, see :func:`put_count`, or
+             `None`.
+    '''
+    redis = await Redis.connect()
+    value = await redis.get(_count_key(table, query))
+    if value is None:
+        return None
+    return json.loads(value)
+
+async def put_count(table, query, count, expire):
+    '''
+    Cache the document `count` of `query` in `table` for `expire` seconds.
+
+    :param count: The `meta` members reporting the count, a dictionary.
+    '''
+    redis = await Redis.connect()
+    await redis.set(_count_key(table, query),
+        json.dumps(count, separators=(',', ':')), expire=expire)
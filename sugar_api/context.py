@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+
+
+class Context(object):
+
+    '''
+    Request scoped state shared by the decorators and the handler of a
+    request or WebSocket command. The request body is walked once and
+    models are loaded once.
+    '''
+
+    __slots__ = ( 'request', 'query', 'rate', '_data', '_models' )
+
+    def __init__(self, request):
+        self.request = request
+        self.query = None
+        self.rate = None
+        self._data = ( )
+        self._models = { }
+
+    @property
+    def body(self):
+        '''
+        The parsed JSON body of the request.
+        '''
+        return self.request.json
+
+    @property
+    def data(self):
+        '''
+        The JSONAPI `data` of the request body or `None`.
+        '''
+        if self._data == ( ):
+            body = self.body
+            self._data = body.get('data') if isinstance(body, dict) else None
+        return self._data
+
+    @property
+    def attributes(self):
+        '''
+        The JSONAPI `data.attributes` of the request body or `None`.
+        '''
+        data = self.data
+        if not isinstance(data, dict):
+            return None
+        return data.get('attributes')
+
+    async def load(self, Model, id):
+        '''
+        Load `Model` `id`, at most once per request.
+
+        :return: The model or `None`.
+        '''
+        key = (Model, id)
+        if not key in self._models:
+            self._models[key] = await Model.find_by_id(id)
+        return self._models[key]
+
+
+def context(request):
+    '''
+    Return the :class:`Context` of `request`, creating it on first use.
+    '''
+    ctx = getattr(request, 'ctx', None)
+    if ctx is None:
+        # XXX: Requests without a Sanic context, such as those built in
+        # XXX: tests, get a context that is not shared.
+        return Context(request)
+    _context = getattr(ctx, 'sugar_api', None)
+    if _context is None:
+        _context = ctx.sugar_api = Context(request)
+    return _context
+
+def command_context(state):
+    '''
+    Start a new :class:`Context` for a WebSocket command on the connection
+    `state`. Models are not shared between commands.
+    '''
+    state.ctx = SimpleNamespace()
+    return context(state)
@@ -0,0 +1,109 @@
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+
+from bson import ObjectId
+
+from . objectid import _primary_value
+
+
+def encode(values):
+    '''
+    Encode a list of sort key `values` into an opaque `page[after]` cursor.
+
+    :param values: The sort key values of the last document in a page, the
+                   last value being the document's ID.
+    :return: A URL safe cursor string.
+    '''
+    data = json.dumps(values, separators=(',', ':'), default=_encode_value)
+    return urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+def decode(cursor):
+    '''
+    Decode a cursor created by :func:`encode`.
+
+    :param cursor: The cursor string.
+    :return: A list of sort key values.
+    '''
+    padding = '=' * (-len(cursor) % 4)
+    data = urlsafe_b64decode((cursor + padding).encode())
+    values = json.loads(data.decode(), object_hook=_decode_value)
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor.')
+    # XXX: Values end up in the query, anything else than a plain value
+    # XXX: could inject operators.
+    for value in values:
+        if not value is None \
+            and not isinstance(value, (str, int, float, datetime, ObjectId)):
+            raise ValueError('Invalid cursor.')
+    return values
+
+def keyset(sort, primary):
+    '''
+    Append `primary` to `sort` as a tie breaker so that every document has a
+    unique position in the ordering.
+
+    :param sort: A list of `[ key, direction ]` pairs or `None`.
+    :param primary: The model's primary key.
+    :return: A new list of `[ key, direction ]` pairs.
+    '''
+    sort = list(sort or [ ])
+    if not any(map(lambda item: item[0] == primary, sort)):
+        direction = sort[-1][1] if sort else 1
+        sort.append([ primary, direction ])
+    return sort
+
+def values(model, sort, primary):
+    '''
+    Collect the values of `model` for each key in `sort`.
+    '''
+    data = model.serialize()
+    result = [ ]
+    for (key, direction) in sort:
+        if key == primary:
+            result.append(model.id)
+        else:
+            result.append(_get_value(key, data))
+    return result
+
+def predicate(sort, values, primary):
+    '''
+    Build a query matching every document positioned after `values` in
+    `sort`. For `[[ 'a', 1 ], [ 'b', -1 ]]` this is
+    `{ '$or': [ { 'a': { '$gt': a } }, { 'a': a, 'b': { '$lt': b } } ] }`.
+    '''
+    if not len(values) == len(sort):
+        raise ValueError('Cursor does not match sort.')
+    clauses = [ ]
+    for index, (key, direction) in enumerate(sort):
+        clause = { }
+        for (_key, _), value in zip(sort[:index], values[:index]):
+            clause[_key] = _convert(_key, value, primary)
+        operator = '$gt' if direction > 0 else '$lt'
+        clause[key] = { operator: _convert(key, values[index], primary) }
+        clauses.append(clause)
+    if len(clauses) == 1:
+        return clauses[0]
+    return { '$or': clauses }
+
+def _convert(key, value, primary):
+    if key == primary:
+        return _primary_value(value, primary)
+    return value
+
+def _get_value(path, data):
+    for key in path.split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return { '$date': value.isoformat() }
+    return str(value)
+
+def _decode_value(value):
+    if len(value) == 1 and isinstance(value.get('$date'), str):
+        return datetime.fromisoformat(value['$date'])
+    return value
@@ -0,0 +1,138 @@
+import json
+import re
+from datetime import date, datetime, time
+from uuid import UUID
+
+from bson import ObjectId
+
+try:
+    import orjson
+except ImportError: # pragma: no cover
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, (ObjectId, UUID)):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def _dumps(data):
+    return json.dumps(data, separators=(',', ':'), default=_default)
+
+
+class StandardBackend(object):
+
+    '''
+    Encode and decode JSON with the standard library. This is the reference
+    output, compact and ASCII only.
+    '''
+
+    name = 'json'
+
+    def dumps(self, data):
+        return _dumps(data)
+
+    def dumpb(self, data):
+        return _dumps(data).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonBackend(StandardBackend):
+
+    '''
+    Encode and decode JSON with `orjson`. `datetime`, `date`, `time` and
+    `UUID` values are encoded natively. Documents that `orjson` would encode
+    differently from :class:`StandardBackend`, non ASCII strings, floats in
+    exponent notation and integers beyond 64 bits, are encoded again with
+    the standard library, so the output is the same byte for byte.
+
+    `NaN` and `Infinity`, which are not valid JSON, are encoded as `null`.
+    '''
+
+    name = 'orjson'
+
+    # XXX: A number written in exponent notation, numbers below 1e-4 are
+    # XXX: written in exponent notation by the standard library only.
+    # XXX: Matches inside strings only cause an unneeded fallback.
+
+    _exponent = re.compile(rb'e-?\d+[,\]}]')
+
+    def dumpb(self, data):
+        try:
+            body = orjson.dumps(data, default=_default)
+        except TypeError:
+            return _dumps(data).encode()
+        if not body.isascii() or b'\x7f' in body or b'0.0000' in body \
+            or self._exponent.search(body):
+            return _dumps(data).encode()
+        return body
+
+    def dumps(self, data):
+        return self.dumpb(data).decode()
+
+    def loads(self, data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # Raise the standard library's error, or decode what orjson
+            # rejects, such as NaN.
+            return json.loads(data)
+
+
+__backends__ = {
+    'json': StandardBackend
+}
+
+if orjson:
+    __backends__['orjson'] = OrjsonBackend
+
+
+class JSON(object):
+
+    '''
+    JSON encoding management object. Every response and WebSocket frame is
+    encoded with the selected backend, `orjson` when it is installed.
+    '''
+
+    backend = __backends__.get('orjson', StandardBackend)()
+
+    @classmethod
+    def set_backend(cls, backend):
+        '''
+        Set the shared JSON backend.
+
+        :param backend: `'json'`, `'orjson'` or an object implementing
+                        `dumps`, `dumpb` and `loads`.
+        '''
+        if isinstance(backend, str):
+            if not backend in __backends__:
+                raise Exception(
+                    f'JSON.set_backend: {backend} not in {list(__backends__.keys())}'
+                )
+            backend = __backends__[backend]()
+        cls.backend = backend
+
+    @classmethod
+    def dumps(cls, data):
+        '''
+        Encode `data` to a compact JSON string.
+        '''
+        return cls.backend.dumps(data)
+
+    @classmethod
+    def dumpb(cls, data):
+        '''
+        Encode `data` to compact JSON bytes.
+        '''
+        return cls.backend.dumpb(data)
+
+    @classmethod
+    def loads(cls, data):
+        '''
+        Decode a JSON string or bytes.
+        '''
+        return cls.backend.loads(data)
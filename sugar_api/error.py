@@ -1,5 +1,7 @@
 from sugar_odm import Model, Field
 
+from . encoder import JSON
+
 
 class Links(Model):
     '''
@@ -64,3 +66,33 @@ class Error(Model, Exception):
     meta = Field(type=dict)
     '''
     '''
+
+
+def error_document(title, detail, status, **kargs):
+    '''
+    Build a JSONAPI error document without creating an :class:`Error`
+    model. The document is the same as `error.serialize()` wrapped in an
+    `errors` list.
+
+    :param title: The error title.
+    :param detail: The error detail.
+    :param status: The HTTP status.
+    :param kargs: Other error members, such as `links`.
+    '''
+    data = { 'title': title, 'detail': detail }
+    data.update(kargs)
+    data['status'] = status
+    return { 'errors': [ data ] }
+
+def encode_error(title, detail, status, **kargs):
+    '''
+    Encode an error document once, for errors whose title and detail never
+    change. The result is served with :func:`sugar_api.jsonapi_body`.
+
+    .. code-block:: python
+
+        __error__ = encode_error('Scope Error', 'Invalid scope.', 403)
+
+        return jsonapi_body(__error__, status=403)
+    '''
+    return JSON.dumpb(error_document(title, detail, status, **kargs))
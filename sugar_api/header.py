@@ -1,64 +1,153 @@
-from sanic.response import json
+from hashlib import sha1
+
+from sanic.response import raw, stream, empty
 
 from . cors import CORS
-from . error import Error
+from . encoder import JSON
+from . error import error_document
+from . pipeline import wrap, wrap_after
 
 
 __content_type__ = 'application/vnd.api+json'
 
-def jsonapi(*args, **kargs):
+__negotiation__ = {
+    'about': 'http://jsonapi.org/format/#content-negotiation'
+}
+
+def jsonapi(body, **kargs):
     '''
-    Returns a Sanic JSON response with the Access-Control-Allow-Origin
-    and Content-Type headers set.
+    Returns a Sanic JSON response, encoded with :class:`sugar_api.JSON`,
+    with the Access-Control-Allow-Origin and Content-Type headers set.
 
     :return: Returns a Sanic JSON response.
     '''
+    return jsonapi_body(JSON.dumpb(body), **kargs)
+
+def jsonapi_body(body, **kargs):
+    '''
+    Returns a Sanic response for an already encoded JSON `body` with the
+    Access-Control-Allow-Origin and Content-Type headers set.
+
+    :return: Returns a Sanic response.
+    '''
     headers = kargs.get('headers', { })
     headers.update({
-        'Access-Control-Allow-Origin': CORS.get_origins(),
-        'Content-Type': __content_type__
+        'Access-Control-Allow-Origin': CORS.get_origins()
+    })
+    kargs['headers'] = headers
+    kargs['content_type'] = __content_type__
+    return raw(body, **kargs)
+
+def jsonapi_stream(streaming_fn, **kargs):
+    '''
+    Returns a Sanic streaming response with the Access-Control-Allow-Origin
+    and Content-Type headers set. `streaming_fn` writes the body in chunks,
+    see :func:`encode`.
+
+    :return: Returns a Sanic streaming response.
+    '''
+    headers = kargs.get('headers', { })
+    headers.update({
+        'Access-Control-Allow-Origin': CORS.get_origins()
     })
     kargs['headers'] = headers
-    kargs['default'] = lambda date: date.isoformat()
-    kargs['separators'] = (',', ':')
-    return json(*args, **kargs)
+    kargs['content_type'] = __content_type__
+    return stream(streaming_fn, **kargs)
+
+def encode(data):
+    '''
+    Encode `data` to a compact JSON string, the same way :func:`jsonapi` does.
+    '''
+    return JSON.dumps(data)
+
+def etag(handler):
+    '''
+    Set a strong ETag header, computed from the response body, on successful
+    responses that do not have one. Respond with `304 Not Modified` when the
+    request's If-None-Match header matches the ETag.
+    '''
+    return wrap_after(_etag)(handler)
+
+def _etag(request, kargs, response):
+    if not response.status == 200:
+        return response
+    tag = response.headers.get('ETag')
+    if not tag:
+        body = getattr(response, 'body', None)
+        if not body:
+            return response
+        tag = response.headers['ETag'] = compute_etag(body)
+    if etag_matches(request.headers.get('If-None-Match'), tag):
+        return not_modified(tag)
+    return response
+
+def compute_etag(data):
+    '''
+    Compute a strong ETag for `data`.
+
+    :param data: A string or bytes.
+    '''
+    if isinstance(data, str):
+        data = data.encode()
+    return '"{digest}"'.format(digest=sha1(data).hexdigest())
+
+def etag_matches(header, tag):
+    '''
+    Check an If-None-Match `header` against `tag` using weak comparison.
+    '''
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == tag:
+            return True
+    return False
+
+def not_modified(tag):
+    '''
+    Returns an empty `304 Not Modified` response for `tag`.
+    '''
+    return empty(status=304, headers={
+        'Access-Control-Allow-Origin': CORS.get_origins(),
+        'ETag': tag
+    })
 
 def content_type(handler):
     '''
     Verify that the client's request has a Content-Type header
     of `applicantion/vnd.api+json`.
     '''
-    async def decorator(request, *args, **kargs):
-        content_type = request.headers.get('Content-Type')
-        if not content_type or not content_type == __content_type__:
-            error = Error(
-                title = 'Invalid Content-Type Header',
-                detail = 'The Content-Type header provided is of an invalid type: {content_type}.'.format(content_type=content_type),
-                links = {
-                    'about': 'http://jsonapi.org/format/#content-negotiation'
-                },
-                status = 403
-            )
-            return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
-        return await handler(request, *args, **kargs)
-    return decorator
+    return wrap(_content_type)(handler)
+
+def _content_type(request, kargs):
+    content_type = request.headers.get('Content-Type')
+    if not content_type or not content_type == __content_type__:
+        return jsonapi(error_document(
+            'Invalid Content-Type Header',
+            'The Content-Type header provided is of an invalid type: {content_type}.'.format(content_type=content_type),
+            403,
+            links = __negotiation__
+        ), status=403)
+    return None
 
 def accept(handler):
     '''
     Verify that the client's request has an Accept header
     of `applicantion/vnd.api+json`.
     '''
-    async def decorator(request, *args, **kargs):
-        accept = request.headers.get('Accept')
-        if not accept or not accept == __content_type__:
-            error = Error(
-                title = 'Invalid Accept Header',
-                detail = 'The Accept header provided is of an invalid type: {accept}.'.format(accept=accept),
-                links = {
-                    'about': 'http://jsonapi.org/format/#content-negotiation'
-                },
-                status = 403
-            )
-            return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
-        return await handler(request, *args, **kargs)
-    return decorator
+    return wrap(_accept)(handler)
+
+def _accept(request, kargs):
+    accept = request.headers.get('Accept')
+    if not accept or not accept == __content_type__:
+        return jsonapi(error_document(
+            'Invalid Accept Header',
+            'The Accept header provided is of an invalid type: {accept}.'.format(accept=accept),
+            403,
+            links = __negotiation__
+        ), status=403)
+    return None
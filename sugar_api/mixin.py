@@ -1,6 +1,6 @@
 import json, asyncio
-from copy import copy
 from datetime import datetime
+from urllib.parse import urlencode
 from uuid import uuid4
 
 import jwt
@@ -13,27 +13,66 @@ from websockets.exceptions import ConnectionClosedError
 from sugar_document import Document
 from sugar_router import Router
 
-from . acl import acl, socketacl, _check_acl
-from . error import Error
-from . header import content_type, accept, jsonapi
+from . import cache, cursor
+from . acl import socketacl, compile_acl, _acl, _check_acl
+from . context import command_context, context
+from . encoder import JSON
+from . error import Error, encode_error
+from . header import jsonapi, jsonapi_body, jsonapi_stream, encode, \
+    compute_etag, etag_matches, not_modified, _accept, _content_type, _etag
 from . lock import acquire, release
-from . objectid import objectid
+from . objectid import _objectid, _primary_value
+from . pipeline import pipeline, wrap
 from . preflight import preflight
-from . publish import publish
-from . rate import rate, socketrate
+from . publish import publish_many, _publish
+from . query import _check_query, _check_sort, _check_index
+from . rate import socketrate, _rate, _rate_headers, _rate_options
 from . redis import Redis
-from . restrictions import set, _apply_restrictions
-from . validate import validate
+from . restrictions import _set, _compile_plan, _evaluate_plan, _apply_plan, \
+    _projection, _compile_restrictions, _apply_rules, _token_error
+from . validate import _validate
 from . websocket import authenticate, deauthenticate, status, exists
-from . webtoken import WebToken, webtoken
+from . webtoken import WebToken, _webtoken
+
+
+__create_type_error__ = encode_error('Create Error',
+    'Type is missing.', 403)
+__create_mismatch_error__ = encode_error('Create Error',
+    'Provided type does not match resource type.', 403)
+__update_type_error__ = encode_error('Update Error',
+    'Type is missing.', 403)
+__update_mismatch_error__ = encode_error('Update Error',
+    'Type in payload does not match collection type.', 403)
+__update_id_error__ = encode_error('Update Error',
+    'ID is missing.', 403)
+__update_id_mismatch_error__ = encode_error('Update Error',
+    'ID provided does not match ID in the URL.', 403)
+
+
+def _token_data(token):
+    if not token:
+        token = {
+            'data': {
+                'id': 'unauthorized',
+                'groups': ['unauthorized']
+            }
+        }
+    token_data = token.get('data', { })
+    return (token_data.get('id'), token_data.get('groups', [ ]))
 
 
 class TimestampMixin(object):
 
     '''
     A mixin to manage timestamps.
+
+    Set `__version__` to the name of a timestamp field that changes on every
+    update, such as `updated`, and :class:`JSONAPIMixin` resources will
+    answer conditional GET requests without rendering the document.
     '''
 
+    __version__ = None
+
     def timestamp(self, value):
         '''
         Manage conversions to and from `datetime` objects.
@@ -58,52 +97,342 @@ class JSONAPIMixin(object):
     __acl__ = None
     __get__ = None
     __set__ = None
-
-    def to_jsonapi(self):
+    __query__ = None
+    __relationships__ = None
+    __cache__ = None
+    __count__ = None
+    __stream__ = False
+    __read_batch__ = 100
+    __read_concurrency__ = 10
+    __bulk_limit__ = 1000
+    __bulk_concurrency__ = 10
+
+    def to_jsonapi(self, attributes=None):
         data = { }
 
         data['type'] = self._table
         data['id'] = self.id
-        data['attributes'] = self.serialize()
+        data['attributes'] = self.serialize() if attributes is None else attributes
 
         del data['attributes'][self._primary]
 
         return data
 
-    def render(self, token):
-        data = self.to_jsonapi()
+    def render(self, token, fields=None):
+        attributes = self.serialize()
 
-        if hasattr(self, 'on_render'):
-            self.on_render(data, token)
+        plan = None
 
         if self.__get__:
 
-            if not token:
+            token_id, token_groups = _token_data(token)
 
-                token = {
-                    'data': {
-                        'id': 'unauthorized',
-                        'groups': ['unauthorized']
-                    }
-                }
+            plan = self._render_plan(token_groups, self.id == token_id)
 
-            token_data = token.get('data', { })
-            token_id = token_data.get('id')
-            token_groups = token_data.get('groups', [ ])
+            # XXX: The field checks are evaluated before the attributes
+            # XXX: are modified by on_render or the plan itself.
 
-            attributes = data.get('attributes')
+            results = _evaluate_plan(plan, attributes, token_id)
 
-            groups = copy(token_groups)
+        data = self.to_jsonapi(attributes)
 
-            if self.id == token_id:
-                groups.append('self')
+        if hasattr(self, 'on_render'):
+            self.on_render(data, token)
+
+        if plan:
+            _apply_plan(data.get('attributes'), plan, results)
 
-            model_data = self.serialize()
+        if self.__relationships__:
+            relationships = self._render_relationships(data.get('attributes'))
+            if relationships:
+                data['relationships'] = relationships
 
-            _apply_restrictions(attributes, self.__get__, groups, [ ], [ ], model_data, token_id)
+        if fields:
+            attributes = data.get('attributes')
+            data['attributes'] = {
+                key: attributes[key] for key in fields if key in attributes
+            }
 
         return data
 
+    @classmethod
+    def _render_relationships(cls, attributes):
+        relationships = { }
+        for (name, relationship) in cls.__relationships__.items():
+            value = attributes.get(relationship['field'])
+            if value is None:
+                continue
+            type = cls._related_model(name)._table
+            if isinstance(value, list):
+                linkage = list(map(lambda id: \
+                    { 'type': type, 'id': str(id) }, value))
+            else:
+                linkage = { 'type': type, 'id': str(value) }
+            relationships[name] = { 'data': linkage }
+        return relationships
+
+    @classmethod
+    def _related_model(cls, name):
+        Model = cls.__relationships__[name]['model']
+        if not isinstance(Model, type):
+            # Allows referencing models that are defined later.
+            Model = Model()
+        return Model
+
+    @classmethod
+    def _include_keys(cls, names):
+        return list(map(lambda name: \
+            cls.__relationships__[name]['field'], names))
+
+    @classmethod
+    def _include_names(cls, request):
+        value = (request.args or { }).get('include')
+        if not value:
+            return [ ]
+        names = list(filter(lambda name: name != '', value.split(',')))
+        for name in names:
+            if not name in (cls.__relationships__ or { }):
+                raise ValueError(f'Invalid include: {name}.')
+        return names
+
+    @classmethod
+    async def _included(cls, request, names, resources, token, errors):
+
+        # XXX: Related ids are gathered from the rendered resources, so
+        # XXX: relationships hidden by __get__ are never included.
+
+        included = [ ]
+
+        seen = { (resource['type'], resource['id']) for resource in resources }
+
+        for name in names:
+
+            ids = [ ]
+
+            for resource in resources:
+                linkage = resource.get('relationships', { }) \
+                    .get(name, { }).get('data')
+                if not linkage:
+                    continue
+                if not isinstance(linkage, list):
+                    linkage = [ linkage ]
+                for item in linkage:
+                    key = (item['type'], item['id'])
+                    if not key in seen:
+                        seen.add(key)
+                        ids.append(item['id'])
+
+            if not ids:
+                continue
+
+            Model = cls._related_model(name)
+
+            try:
+                included.extend(await Model._read_included(request, ids, token, errors))
+            except Exception as e:
+                logger.info(str(e), exc_info=True)
+                error = Error(
+                    title = 'Include Error',
+                    detail = str(e),
+                    status = 500
+                )
+                errors.append(error)
+
+        return included
+
+    @classmethod
+    async def _read_included(cls, request, ids, token, errors):
+
+        sparse = cls._sparse_fields(request)
+
+        # XXX: The fields used by the ACL are always fetched.
+
+        keys = map(lambda field: field[1:],
+            filter(lambda field: field[:1] in ('$', '#'), cls.__acl__ or { }))
+
+        projection = cls._read_projection(sparse and dict.fromkeys(sparse, 1),
+            token, keys=keys)
+
+        ids = list(map(lambda id: _primary_value(id, cls._primary), ids))
+
+        models = [ ]
+
+        async for model in cls.find({ cls._primary: { '$in': ids } },
+            projection=projection
+        ):
+            if await _check_acl('read', cls._acl_rules(), token, model.id, cls, model):
+                models.append(model)
+
+        models = await cls._on_read(models, token, errors)
+
+        return list(map(lambda model: model.render(token, sparse), models))
+
+    @classmethod
+    def _sparse_fields(cls, request):
+        value = (request.args or { }).get(f'fields[{cls._table}]')
+        if not value:
+            return None
+        fields = tuple(filter(lambda field: field != '', value.split(',')))
+        names = cls._field_names()
+        for field in fields:
+            if not field in names:
+                raise ValueError(f'Invalid field: {field}.')
+        return fields
+
+    @classmethod
+    def _check_sparse_fields(cls, request):
+
+        # XXX: Every fields[...] parameter is validated before reading, so
+        # XXX: an invalid one for an included type is a client error too.
+
+        models = { cls._table: cls }
+
+        for name in (cls.__relationships__ or { }):
+            Model = cls._related_model(name)
+            models[Model._table] = Model
+
+        for key in (request.args or { }):
+            if not (key.startswith('fields[') and key.endswith(']')):
+                continue
+            Model = models.get(key[7:-1])
+            if not Model:
+                raise ValueError(f'Invalid fields type: {key[7:-1]}.')
+            Model._sparse_fields(request)
+
+    @classmethod
+    def _projection_fields(cls, fields):
+        names = tuple(map(lambda item: item[0].split('.')[0],
+            filter(lambda item: item[1] and not item[0] == cls._primary,
+                fields.items())))
+        return names or None
+
+    @classmethod
+    def _acl_rules(cls):
+        compiled = cls.__dict__.get('_compiled_acl')
+        if compiled is None or not compiled[0] is cls.__acl__:
+            compiled = cls._compiled_acl = (cls.__acl__, compile_acl(cls.__acl__))
+        return compiled[1]
+
+    @classmethod
+    def _set_rules(cls):
+        compiled = cls.__dict__.get('_compiled_set')
+        if compiled is None or not compiled[0] is cls.__set__:
+            compiled = cls._compiled_set = (cls.__set__,
+                _compile_restrictions(cls.__set__))
+        return compiled[1]
+
+    @classmethod
+    def _field_names(cls):
+        names = cls.__dict__.get('_field_name_set')
+        if names is None:
+            names = cls._field_name_set = frozenset(map(lambda field: \
+                getattr(field, 'name', field), cls._fields))
+        return names
+
+    @classmethod
+    def _cacheable(cls):
+
+        # XXX: Read hooks and custom rendering may deny the read or change
+        # XXX: the response per caller, which a shared entry can not honour.
+
+        return bool(cls.__cache__) and cls.render is JSONAPIMixin.render \
+            and not any(map(lambda hook: hasattr(cls, hook),
+                ( 'on_read', 'on_read_many', 'on_render' )))
+
+    @classmethod
+    async def invalidate(cls, *ids):
+        '''
+        Invalidate the cached responses of the documents `ids`. Writes made
+        through the resource's routes invalidate them already, call this
+        after writing to the table in any other way.
+        '''
+        if not cls.__cache__ or not ids:
+            return
+
+        redis = await Redis.connect()
+
+        pipeline = redis.multi_exec()
+
+        for id in ids:
+            cache.invalidate(pipeline, cls._table, id,
+                cls.__cache__.get('expire', 60))
+
+        await pipeline.execute()
+
+    @classmethod
+    def _cache_audience(cls, token, id):
+
+        # XXX: Responses only differ between callers through __get__, so
+        # XXX: callers share entries by groups unless the caller's plan
+        # XXX: has field checks, which depend on the caller's ID.
+
+        token_id, token_groups = _token_data(token)
+
+        is_self = id == token_id
+
+        audience = ','.join(sorted(token_groups))
+
+        if is_self:
+            audience += ':self'
+        elif cls.__get__ and cls._render_plan(token_groups, is_self)[1]:
+            audience += f':{token_id}'
+
+        return audience
+
+    @classmethod
+    def _version_etag(cls, request, model, version, token):
+        return compute_etag('{id}:{version}:{audience}:{query}'.format(
+            id = model.id,
+            version = getattr(model, version),
+            audience = cls._cache_audience(token, model.id),
+            query = request.query_string or ''
+        ))
+
+    @classmethod
+    def _read_projection(cls, fields, token, id=None, keys=( )):
+
+        denied = frozenset( )
+        needed = frozenset(keys)
+
+        if cls.__get__:
+
+            token_id, token_groups = _token_data(token)
+
+            if id:
+                plans = [ cls._render_plan(token_groups, id == token_id) ]
+            else:
+                plans = [
+                    cls._render_plan(token_groups, False),
+                    cls._render_plan(token_groups, True)
+                ]
+
+            needed = needed.union(path for plan in plans \
+                for checks in plan[1] for (prefix, path) in checks)
+
+            # XXX: Hooks may rely on any field of the document, so nothing
+            # XXX: is left out of the projection for models defining them.
+
+            if not any(map(lambda hook: hasattr(cls, hook),
+                ('on_read', 'on_read_many', 'on_render'))):
+                denied = frozenset.intersection(*map(lambda plan: \
+                    frozenset(plan[2]), plans))
+
+        return _projection(fields, denied, needed, cls._primary)
+
+    @classmethod
+    def _render_plan(cls, groups, is_self):
+        plans = cls.__dict__.get('_render_plans')
+        if plans is None:
+            plans = cls._render_plans = { }
+        key = (tuple(groups), is_self)
+        plan = plans.get(key)
+        if not plan:
+            groups = list(groups)
+            if is_self:
+                groups.append('self')
+            plan = plans[key] = _compile_plan(cls.__get__, frozenset(groups))
+        return plan
+
     @classmethod
     def from_jsonapi(cls, data):
         id = data.get('id')
@@ -117,7 +446,7 @@ class JSONAPIMixin(object):
         return model
 
     @classmethod
-    def resource(cls, *args, pubsub=False, changes=False, **kargs):
+    def resource(cls, *args, pubsub=False, changes=False, bulk=False, **kargs):
         '''
         Generate and return a Sanic blueprint containing CRUD and WebSocket
         endpoints.
@@ -128,6 +457,8 @@ class JSONAPIMixin(object):
 
         bp = Blueprint(*args, **kargs)
 
+        cls._render_plans = { }
+
         url = '/{path}'.format(path=cls._table)
 
         if pubsub:
@@ -144,6 +475,27 @@ class JSONAPIMixin(object):
             async def changes(request, socket):
                 return await cls._changes(request, socket)
 
+        # XXX: Each route runs its checks in a single flat pipeline,
+        # XXX: checks disabled by the model are left out here.
+
+        rate = _rate(**_rate_options(cls.__rate__), namespace=cls._table)
+        rate_headers = rate and _rate_headers
+
+        acl = cls._acl_rules()
+
+        if bulk:
+
+            @bp.options(url + '/operations')
+            async def options(*args, **kargs):
+                return preflight(methods=[ 'POST' ])
+
+            bp.post(url + '/operations', name='bulk')(pipeline(cls._bulk, [
+                _content_type,
+                _accept,
+                _webtoken,
+                rate
+            ], after=[ rate_headers ]))
+
         @bp.options(url)
         async def options(*args, **kargs):
             return preflight(methods=[ 'GET', 'POST' ])
@@ -152,142 +504,106 @@ class JSONAPIMixin(object):
         async def options(*args, **kargs):
             return preflight(methods=[ 'GET', 'PATCH', 'DELETE' ])
 
-        @bp.get(url)
-        @accept
-        @webtoken
-        @rate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
-        @acl('read_all', cls.__acl__, cls)
-        async def read(*args, **kargs):
-            return await cls._read(*args, **kargs)
-
-        @bp.post(url)
-        @content_type
-        @accept
-        @validate
-        @cls._check_create
-        @webtoken
-        @rate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
-        @acl('create', cls.__acl__, cls)
-        @set(cls.__set__, cls)
-        @publish('create', cls._table)
-        async def create(*args, **kargs):
-            return await cls._create(*args, **kargs)
-
-        @bp.get(url + '/<id>')
-        @objectid('id')
-        @accept
-        @webtoken
-        @rate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
-        @acl('read', cls.__acl__, cls)
-        async def read(*args, **kargs):
-            return await cls._read(*args, **kargs)
-
-        @bp.patch(url + '/<id>')
-        @objectid('id')
-        @content_type
-        @accept
-        @validate
-        @cls._check_update
-        @webtoken
-        @rate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
-        @acl('update', cls.__acl__, cls)
-        @set(cls.__set__, cls)
-        @publish('update', cls._table)
-        async def update(*args, **kargs):
-            return await cls._update(*args, **kargs)
-
-        @bp.delete(url + '/<id>')
-        @objectid('id')
-        @accept
-        @webtoken
-        @rate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
-        @acl('delete', cls.__acl__, cls)
-        @publish('delete', cls._table)
-        async def delete(*args, **kargs):
-            return await cls._delete(*args, **kargs)
+        bp.get(url, name='read')(pipeline(cls._read, [
+            _accept,
+            _webtoken,
+            rate,
+            _acl('read_all', acl, cls, query='read')
+        ], after=[ _etag, rate_headers ]))
+
+        bp.post(url, name='create')(pipeline(cls._create, [
+            _content_type,
+            _accept,
+            _validate,
+            cls._create_check,
+            _webtoken,
+            rate,
+            _acl('create', acl, cls),
+            _set(cls.__set__, cls)
+        ], after=[ _publish('create', cls._table), rate_headers ]))
+
+        bp.get(url + '/<id>', name='read')(pipeline(cls._read, [
+            _objectid('id'),
+            _accept,
+            _webtoken,
+            rate,
+            _acl('read', acl, cls)
+        ], after=[ _etag, rate_headers ]))
+
+        bp.patch(url + '/<id>', name='update')(pipeline(cls._update, [
+            _objectid('id'),
+            _content_type,
+            _accept,
+            _validate,
+            cls._update_check,
+            _webtoken,
+            rate,
+            _acl('update', acl, cls),
+            _set(cls.__set__, cls)
+        ], after=[ _publish('update', cls._table, cls.__cache__), rate_headers ]))
+
+        bp.delete(url + '/<id>', name='delete')(pipeline(cls._delete, [
+            _objectid('id'),
+            _accept,
+            _webtoken,
+            rate,
+            _acl('delete', acl, cls)
+        ], after=[ _publish('delete', cls._table, cls.__cache__), rate_headers ]))
 
         return bp
 
     @classmethod
     def _check_create(cls, handler):
-        async def decorator(request, *args, **kargs):
+        return wrap(cls._create_check)(handler)
 
-            # XXX: The request data has already been validated
-            # XXX: with the @validate decorator.
+    @classmethod
+    def _create_check(cls, request, kargs):
 
-            data = request.json.get('data')
+        # XXX: The request data has already been validated
+        # XXX: with the @validate decorator.
 
-            type = data.get('type')
+        data = context(request).data
 
-            if not type:
-                error = Error(
-                    title = 'Create Error',
-                    detail = 'Type is missing.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+        type = data.get('type')
 
-            if not type == cls._table:
-                error = Error(
-                    title = 'Create Error',
-                    detail = 'Provided type does not match resource type.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+        if not type:
+            return jsonapi_body(__create_type_error__, status=403)
 
-            return await handler(request, *args, **kargs)
+        if not type == cls._table:
+            return jsonapi_body(__create_mismatch_error__, status=403)
 
-        return decorator
+        return None
 
     @classmethod
     def _check_update(cls, handler):
-        async def decorator(request, *args, **kargs):
+        return wrap(cls._update_check)(handler)
 
-            # XXX: The request data has already been validated
-            # XXX: with the @validate decorator.
+    @classmethod
+    def _update_check(cls, request, kargs):
 
-            data = request.json.get('data')
+        # XXX: The request data has already been validated
+        # XXX: with the @validate decorator.
 
-            type = data.get('type')
+        data = context(request).data
 
-            if not type:
-                error = Error(
-                    title = 'Update Error',
-                    detail = 'Type is missing.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+        type = data.get('type')
 
-            if not type == cls._table:
-                error = Error(
-                    title = 'Update Error',
-                    detail = 'Type in payload does not match collection type.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+        if not type:
+            return jsonapi_body(__update_type_error__, status=403)
 
-            id = kargs.get('id')
-            _id = data.get('id')
+        if not type == cls._table:
+            return jsonapi_body(__update_mismatch_error__, status=403)
 
-            if not _id:
-                error = Error(
-                    title = 'Update Error',
-                    detail = 'ID is missing.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+        id = kargs.get('id')
+        _id = data.get('id')
 
-            if not id == _id:
-                error = Error(
-                    title = 'Update Error',
-                    detail = 'ID provided does not match ID in the URL.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+        if not _id:
+            return jsonapi_body(__update_id_error__, status=403)
 
-            return await handler(request, *args, **kargs)
+        if not id == _id:
+            return jsonapi_body(__update_id_mismatch_error__, status=403)
 
-        return decorator
+        return None
 
     @classmethod
     async def _create(cls, request, token=None, errors=[ ]):
@@ -298,7 +614,17 @@ class JSONAPIMixin(object):
         # XXX: The request has already been verified
         # XXX: in the decorator cls._check_create.
 
-        data = request.json.get('data')
+        try:
+            sparse = cls._sparse_fields(request)
+        except ValueError as e:
+            error = Error(
+                title = 'Create Error',
+                detail = str(e),
+                status = 400
+            )
+            return jsonapi({ 'errors': [ error.serialize() ] }, status=400)
+
+        data = context(request).data
 
         try:
             model = cls.from_jsonapi(data)
@@ -356,7 +682,7 @@ class JSONAPIMixin(object):
             return jsonapi({ 'errors': [ error.serialize() ] }, status=500)
 
         response = {
-            'data': model.render(token)
+            'data': model.render(token, sparse)
         }
 
         if errors:
@@ -368,6 +694,8 @@ class JSONAPIMixin(object):
     @classmethod
     async def _read(cls, request, id=None, token=None, errors=[ ]):
 
+        errors = list(errors)
+
         fields = None
         fields_json = request.args.get('fields', None)
 
@@ -385,10 +713,63 @@ class JSONAPIMixin(object):
                 'errors': [ error.serialize() ]
             }, status=403)
 
+        try:
+            cls._check_sparse_fields(request)
+            sparse = cls._sparse_fields(request)
+        except ValueError as e:
+            error = Error(
+                title = 'Read Error',
+                detail = str(e),
+                status = 400
+            )
+            return jsonapi({ 'errors': [ error.serialize() ] }, status=400)
+
+        if sparse:
+            fields = dict.fromkeys(sparse, 1)
+        elif isinstance(fields, dict):
+            # XXX: Keys added to the projection for the ACL, __get__, sort
+            # XXX: or include checks are not rendered.
+            sparse = cls._projection_fields(fields)
+
+        try:
+            include = cls._include_names(request)
+        except ValueError as e:
+            error = Error(
+                title = 'Read Error',
+                detail = str(e),
+                status = 400
+            )
+            return jsonapi({ 'errors': [ error.serialize() ] }, status=400)
+
         if id:
 
+            # XXX: Only plain reads of models without read hooks are cached.
+
+            cached = cls._cacheable() and not request.args
+
+            if cached:
+                audience = cls._cache_audience(token, id)
+                try:
+                    body, tag, generation = await cache.get(cls._table, id, audience)
+                except Exception as e:
+                    logger.info(str(e), exc_info=True)
+                    cached = False
+                else:
+
+                    # XXX: Cached models have no read hooks, so the
+                    # XXX: ACL stage has already done the read check.
+
+                    if body and tag:
+                        if etag_matches(request.headers.get('If-None-Match'), tag):
+                            return not_modified(tag)
+                        return jsonapi_body(body, status=200, headers={ 'ETag': tag })
+                    elif body:
+                        return jsonapi_body(body, status=200)
+
             try:
-                model = await cls.find_by_id(id, projection=fields)
+                projection = cls._read_projection(fields, token, id,
+                    keys=cls._include_keys(include))
+                model = await cls.find_by_id(id, projection=projection)
             except Exception as e:
                 logger.info(str(e), exc_info=True)
                 error = Error(
@@ -409,34 +790,58 @@ class JSONAPIMixin(object):
                     'errors': [ error.serialize() ]
                 }, status=404)
 
-            if hasattr(model, 'on_read'):
-                try:
-                    await model.on_read(token)
-                except Exception as e:
-                    logger.info(str(e), exc_info=True)
-                    error = Error(
-                        title = 'Read Error',
-                        detail = str(e),
-                        status = 403
-                    )
-                    return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+            tag = None
+
+            version = getattr(cls, '__version__', None)
+
+            # XXX: The version does not cover included resources, those
+            # XXX: responses are tagged from their body.
+
+            if version and not include and getattr(model, version, None):
+
+                tag = cls._version_etag(request, model, version, token)
+
+            read_errors = [ ]
+
+            if not await cls._on_read([ model ], token, read_errors):
+                error = read_errors[0]
+                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+
+            if tag and etag_matches(request.headers.get('If-None-Match'), tag):
+                return not_modified(tag)
 
             response = {
-                'data': model.render(token)
+                'data': model.render(token, sparse)
             }
 
+            if include:
+                response['included'] = await cls._included(request, include,
+                    [ response['data'] ], token, errors)
+
             if errors:
                 response['errors'] = list(map(lambda error: \
                     error.serialize(), errors))
 
-            return jsonapi(response, status=200)
+            headers = { }
+
+            if tag:
+                headers['ETag'] = tag
+
+            response = jsonapi(response, status=200, headers=headers)
+
+            if cached and not errors:
+                try:
+                    await cache.put(cls._table, id, audience, generation,
+                        response.body, cls.__cache__.get('expire', 60), tag)
+                except Exception as e:
+                    logger.info(str(e), exc_info=True)
+
+            return response
 
         else:
 
             try:
 
-                models = [ ]
-
                 query_json = request.args.get('query', '{ }')
 
                 try:
@@ -484,31 +889,124 @@ class JSONAPIMixin(object):
 
                     sort = list(map(prepare, sort))
 
-                offset = int(request.args.get('page[offset]', 0))
-                limit = int(request.args.get('page[limit]', 100))
+                if cls.__query__:
 
-                if limit > 1000:
-                    limit = 1000
+                    message = _check_query(query, cls.__query__) \
+                        or _check_sort(sort, cls.__query__)
+
+                    indexes = cls.__query__.get('indexes')
+
+                    if not message and indexes \
+                        and not _check_index(query, sort, indexes):
+                        message = 'Query does not use an index.'
+
+                    if message:
+                        error = Error(
+                            title = 'Query Error',
+                            detail = message,
+                            status = 400
+                        )
+                        return jsonapi({
+                            'errors': [ error.serialize() ]
+                        }, status=400)
+
+                # XXX: Users allowed to read some documents only, by the
+                # XXX: field rules of the ACL, only query those.
+
+                acl_query = context(request).query
+
+                if acl_query:
+                    if query:
+                        query = { '$and': [ query, acl_query ] }
+                    else:
+                        query = acl_query
+
+                # XXX: The total counts every document matching the
+                # XXX: client's query, not just the remaining pages.
+
+                total = None
+
+                if cls.__count__:
+                    total = await cls._count(query)
+
+                after = request.args.get('page[after]')
+                size = request.args.get('page[size]')
+
+                keyset = bool(after or size)
+
+                if keyset:
+
+                    offset = 0
+                    limit = int(size or request.args.get('page[limit]', 100))
+
+                    sort = cursor.keyset(sort, cls._primary)
+
+                    if after:
 
-                async for model in cls.find(query,
-                    sort=sort,
-                    skip=offset,
-                    limit=limit,
-                    projection=fields
-                ):
-                    if hasattr(model, 'on_read'):
                         try:
-                            await model.on_read(token)
+                            values = cursor.decode(after)
+                            predicate = cursor.predicate(sort, values, cls._primary)
                         except Exception as e:
                             logger.info(str(e), exc_info=True)
                             error = Error(
                                 title = 'Read Error',
-                                detail = str(e),
-                                status = 403
+                                detail = 'Invalid cursor.',
+                                status = 400
                             )
-                            errors.append(error)
-                            continue
-                    models.append(model)
+                            return jsonapi({
+                                'errors': [ error.serialize() ]
+                            }, status=400)
+
+                        if query:
+                            query = { '$and': [ query, predicate ] }
+                        else:
+                            query = predicate
+
+                else:
+
+                    offset = int(request.args.get('page[offset]', 0))
+                    limit = int(request.args.get('page[limit]', 100))
+
+                if limit > 1000:
+                    limit = 1000
+
+                if keyset:
+                    meta = {
+                        'limit': limit
+                    }
+                else:
+                    meta = {
+                        'offset': offset,
+                        'limit': limit,
+                    }
+
+                if total:
+                    meta.update(total)
+
+                page = {
+                    'last': None,
+                    'count': 0
+                }
+
+                # XXX: Streamed pages run the on_read hooks in batches of
+                # XXX: __read_batch__ to keep memory usage flat.
+
+                batch = cls.__read_batch__ if cls.__stream__ else None
+
+                keys = list(map(lambda item: item[0], sort or [ ])) if keyset else [ ]
+
+                keys.extend(cls._include_keys(include))
+
+                projection = cls._read_projection(fields, token, keys=keys)
+
+                models = cls._read_models(query, sort, offset, limit,
+                    projection, token, errors, page, batch)
+
+                if cls.__stream__:
+                    return cls._read_stream(request, models, token, sparse,
+                        include, errors, meta, sort, limit, keyset, page)
+
+                models = [ model async for model in models ]
 
             except Exception as e:
                 logger.info(str(e), exc_info=True)
@@ -520,19 +1018,227 @@ class JSONAPIMixin(object):
                 return jsonapi({ 'errors': [ error.serialize() ] }, status=500)
 
             response = {
-                'data': list(map(lambda model: model.render(token), models)),
-                'meta': {
-                    'offset': offset,
-                    'limit': limit,
-                }
+                'data': list(map(lambda model: model.render(token, sparse), models))
             }
 
+            if include:
+                response['included'] = await cls._included(request, include,
+                    response['data'], token, errors)
+
+            response['meta'] = meta
+
+            links = cls._read_links(request, sort, limit, keyset, page)
+
+            if links:
+                response['links'] = links
+
             if errors:
                 response['errors'] = list(map(lambda error: \
                     error.serialize(), errors))
 
             return jsonapi(response, status=200)
 
+    @classmethod
+    async def _count(cls, query):
+
+        threshold = cls.__count__.get('threshold', 1000)
+        expire = cls.__count__.get('expire', 30)
+
+        try:
+            count = await cache.get_count(cls._table, query)
+        except Exception as e:
+            logger.info(str(e), exc_info=True)
+            count = None
+
+        if count is not None:
+            return count
+
+        try:
+            total = None
+            if not query:
+                total = await cls.count_estimate()
+            if total is not None:
+                count = { 'total': total, 'estimated': True }
+            else:
+                # XXX: Counting stops past the threshold, larger results
+                # XXX: only report a lower bound.
+                total = await cls.count(query, limit=threshold + 1)
+                if total > threshold:
+                    count = { 'minimum': total }
+                else:
+                    count = { 'total': total, 'estimated': False }
+        except Exception as e:
+            logger.info(str(e), exc_info=True)
+            return None
+
+        try:
+            await cache.put_count(cls._table, query, count, expire)
+        except Exception as e:
+            logger.info(str(e), exc_info=True)
+
+        return count
+
+    @classmethod
+    async def count_estimate(cls):
+        '''
+        Return an estimate of the number of documents in the table, used
+        for `meta.total` of unfiltered reads when `__count__` is set. By
+        default the ODM's metadata based `estimated_document_count` is
+        used when the model has one, otherwise `None` is returned and the
+        table is counted up to the threshold. Override for other backends.
+        '''
+        estimate = getattr(cls, 'estimated_document_count', None)
+        if estimate is None:
+            return None
+        return await estimate()
+
+    @classmethod
+    async def _read_models(cls, query, sort, offset, limit, projection, token, errors, page, batch=None):
+        hooked = hasattr(cls, 'on_read_many') or hasattr(cls, 'on_read')
+        models = [ ]
+        async for model in cls.find(query,
+            sort=sort,
+            skip=offset,
+            limit=limit,
+            projection=projection
+        ):
+            page['last'] = model
+            page['count'] += 1
+            if not hooked:
+                yield model
+                continue
+            models.append(model)
+            if batch and len(models) >= batch:
+                for model in await cls._on_read(models, token, errors):
+                    yield model
+                models = [ ]
+        for model in await cls._on_read(models, token, errors):
+            yield model
+
+    @classmethod
+    async def _on_read(cls, models, token, errors):
+
+        if not models:
+            return models
+
+        if hasattr(cls, 'on_read_many'):
+            try:
+                results = await cls.on_read_many(models, token)
+            except Exception as e:
+                results = [ e ] * len(models)
+        elif hasattr(cls, 'on_read'):
+            semaphore = asyncio.Semaphore(cls.__read_concurrency__)
+            async def on_read(model):
+                async with semaphore:
+                    await model.on_read(token)
+            results = await asyncio.gather(*map(on_read, models),
+                return_exceptions=True)
+        else:
+            return models
+
+        if results is None:
+            return models
+
+        # XXX: Models without a result are not known to be readable.
+
+        if not len(results) == len(models):
+            results = [ Exception(
+                f'on_read_many returned {len(results)} results for {len(models)} models.'
+            ) ] * len(models)
+
+        allowed = [ ]
+
+        for (model, result) in zip(models, results):
+            if isinstance(result, BaseException):
+                logger.info(str(result), exc_info=result)
+                error = Error(
+                    title = 'Read Error',
+                    detail = str(result),
+                    status = 403
+                )
+                errors.append(error)
+            else:
+                allowed.append(model)
+
+        return allowed
+
+    @classmethod
+    def _read_stream(cls, request, models, token, sparse, include, errors, meta, sort, limit, keyset, page):
+
+        # XXX: The status and headers are sent before the first document
+        # XXX: is read, so database errors are reported in the trailing
+        # XXX: errors member instead of the status code.
+
+        async def streaming(response):
+            await response.write('{"data":[')
+
+            separator = ''
+
+            # XXX: Only the linkage of each resource is kept for include.
+
+            linkages = [ ]
+
+            try:
+                async for model in models:
+                    data = model.render(token, sparse)
+                    if include:
+                        linkages.append({
+                            'type': data['type'],
+                            'id': data['id'],
+                            'relationships': data.get('relationships', { })
+                        })
+                    await response.write(separator + encode(data))
+                    separator = ','
+            except Exception as e:
+                logger.info(str(e), exc_info=True)
+                error = Error(
+                    title = 'Read Error',
+                    detail = str(e),
+                    status = 500
+                )
+                errors.append(error)
+
+            trailer = { }
+
+            if include:
+                trailer['included'] = await cls._included(request, include,
+                    linkages, token, errors)
+
+            trailer['meta'] = meta
+
+            links = cls._read_links(request, sort, limit, keyset, page)
+
+            if links:
+                trailer['links'] = links
+
+            if errors:
+                trailer['errors'] = list(map(lambda error: \
+                    error.serialize(), errors))
+
+            await response.write('],' + encode(trailer)[1:])
+
+        return jsonapi_stream(streaming, status=200)
+
+    @classmethod
+    def _read_links(cls, request, sort, limit, keyset, page):
+        last = page['last']
+        if keyset and last and page['count'] == limit:
+            values = cursor.values(last, sort, cls._primary)
+            return {
+                'next': cls._link(request, {
+                    'page[after]': cursor.encode(values),
+                    'page[size]': limit
+                })
+            }
+        return None
+
+    @classmethod
+    def _link(cls, request, args):
+        query = list(filter(lambda item: item[0] not in args,
+            request.query_args or [ ]))
+        query.extend(args.items())
+        return '{path}?{query}'.format(path=request.path, query=urlencode(query))
+
     @classmethod
     async def _update(cls, request, id=None, token=None, errors=[ ]):
 
@@ -542,12 +1248,24 @@ class JSONAPIMixin(object):
         # XXX: The request has already been verified
         # XXX: with the decorator @cls._check_update.
 
-        data = request.json.get('data')
+        try:
+            sparse = cls._sparse_fields(request)
+        except ValueError as e:
+            error = Error(
+                title = 'Update Error',
+                detail = str(e),
+                status = 400
+            )
+            return jsonapi({ 'errors': [ error.serialize() ] }, status=400)
+
+        ctx = context(request)
 
-        attributes = data.get('attributes')
+        attributes = ctx.attributes
+
+        # XXX: The model may already have been loaded by @acl or @set.
 
         try:
-            model = await cls.find_by_id(id)
+            model = await ctx.load(cls, id)
         except Exception as e:
             error = Error(
                 title = 'Update Error',
@@ -607,7 +1325,7 @@ class JSONAPIMixin(object):
             return jsonapi({ 'errors': [ error.serialize() ] }, status=500)
 
         response = {
-            'data': model.render(token)
+            'data': model.render(token, sparse)
         }
 
         if errors:
@@ -620,7 +1338,7 @@ class JSONAPIMixin(object):
     async def _delete(cls, request, id, token=None, errors=[ ]):
 
         try:
-            model = await cls.find_by_id(id)
+            model = await context(request).load(cls, id)
         except Exception as e:
             logger.info(str(e), exc_info=True)
             error = Error(
@@ -673,6 +1391,262 @@ class JSONAPIMixin(object):
 
         return jsonapi(response, status=200)
 
+    @classmethod
+    async def _bulk(cls, request, token=None, errors=[ ]):
+
+        # XXX: Operations are checked and applied independently, the
+        # XXX: response holds one result for each operation, in order.
+
+        if cls.__set__:
+            error = _token_error(token)
+            if error:
+                return jsonapi_body(error, status=403)
+
+        try:
+            sparse = cls._sparse_fields(request)
+        except ValueError as e:
+            error = Error(
+                title = 'Bulk Error',
+                detail = str(e),
+                status = 400
+            )
+            return jsonapi({ 'errors': [ error.serialize() ] }, status=400)
+
+        operations = (context(request).body or { }).get('atomic:operations')
+
+        if not operations or not isinstance(operations, list):
+            error = Error(
+                title = 'Bulk Error',
+                detail = 'No operations supplied.',
+                status = 403
+            )
+            return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+
+        if len(operations) > cls.__bulk_limit__:
+            error = Error(
+                title = 'Bulk Error',
+                detail = f'Too many operations, the limit is {cls.__bulk_limit__}.',
+                status = 413
+            )
+            return jsonapi({ 'errors': [ error.serialize() ] }, status=413)
+
+        results = [ None ] * len(operations)
+
+        def fail(index, detail, status):
+            results[index] = {
+                'errors': [
+                    Error(
+                        title = 'Bulk Error',
+                        detail = detail,
+                        status = status,
+                        source = {
+                            'pointer': f'/atomic:operations/{index}'
+                        }
+                    ).serialize()
+                ]
+            }
+
+        pending = [ ]
+        ids = [ ]
+
+        for (index, operation) in enumerate(operations):
+            try:
+                op, id, data = cls._bulk_operation(operation)
+            except ValueError as e:
+                fail(index, str(e), 403)
+                continue
+            if id:
+                if id in ids:
+                    fail(index, f'Duplicate operation on ID {id}.', 409)
+                    continue
+                ids.append(id)
+            pending.append((index, op, id, data))
+
+        # XXX: Every document targeted by the operations is loaded
+        # XXX: with a single query and shared with the ACL checks.
+
+        existing = { }
+
+        if ids:
+            try:
+                primary = list(map(lambda id: \
+                    _primary_value(id, cls._primary), ids))
+                async for model in cls.find({ cls._primary: { '$in': primary } }):
+                    existing[str(model.id)] = model
+            except Exception as e:
+                logger.info(str(e), exc_info=True)
+                error = Error(
+                    title = 'Bulk Error',
+                    detail = str(e),
+                    status = 500
+                )
+                return jsonapi({ 'errors': [ error.serialize() ] }, status=500)
+
+        semaphore = asyncio.Semaphore(cls.__bulk_concurrency__)
+
+        async def apply(index, op, id, data):
+            async with semaphore:
+                return await cls._bulk_apply(index, op, id, data,
+                    existing.get(id), token, sparse)
+
+        applied = await asyncio.gather(*map(lambda item: apply(*item), pending),
+            return_exceptions=True)
+
+        events = [ ]
+
+        for ((index, op, id, data), result) in zip(pending, applied):
+            if isinstance(result, Error):
+                result.source = { 'pointer': f'/atomic:operations/{index}' }
+                results[index] = { 'errors': [ result.serialize() ] }
+            elif isinstance(result, Exception):
+                logger.info(str(result), exc_info=result)
+                fail(index, str(result), 500)
+            else:
+                action, result = result
+                events.append((action, result['data']['id']))
+                results[index] = result
+
+        try:
+            await publish_many(events, cls._table, cls.__cache__)
+        except Exception as e:
+            logger.info(str(e), exc_info=True)
+
+        response = {
+            'atomic:results': results
+        }
+
+        if errors:
+            response['errors'] = list(map(lambda error: \
+                error.serialize(), errors))
+
+        return jsonapi(response, status=200)
+
+    @classmethod
+    def _bulk_operation(cls, operation):
+
+        if not isinstance(operation, dict):
+            raise ValueError('Operation is not a JSON object.')
+
+        op = operation.get('op')
+
+        if not op in ('add', 'update', 'remove'):
+            raise ValueError(f'Invalid operation: {op}.')
+
+        if op == 'remove':
+            data = operation.get('ref')
+        else:
+            data = operation.get('data')
+
+        if not data or not isinstance(data, dict):
+            raise ValueError('No data supplied.')
+
+        if not data.get('type') == cls._table:
+            raise ValueError('Provided type does not match resource type.')
+
+        id = data.get('id')
+
+        if op == 'remove':
+            if not id:
+                raise ValueError('ID is missing.')
+            return (op, id, data)
+
+        if op == 'update' and not id:
+            raise ValueError('ID is missing.')
+
+        attributes = data.get('attributes')
+
+        if not attributes or not isinstance(attributes, dict):
+            raise ValueError('No attributes supplied.')
+
+        return (op, id, data)
+
+    @classmethod
+    async def _bulk_apply(cls, index, op, id, data, model, token, sparse):
+
+        # XXX: Mirrors the @acl, @set and handler chain of the single
+        # XXX: document endpoints, failures are raised as an Error.
+
+        action = { 'add': 'create', 'update': 'update', 'remove': 'delete' }[op]
+
+        if op == 'add':
+            if model:
+                raise Error(
+                    title = 'Bulk Error',
+                    detail = f'{cls.__name__} {id} already exists.',
+                    status = 409
+                )
+        elif not model:
+            raise Error(
+                title = 'Bulk Error',
+                detail = 'Model not found.',
+                status = 404
+            )
+
+        if not await _check_acl(action, cls._acl_rules(), token,
+            None if op == 'add' else id, cls, model):
+            raise Error(
+                title = 'ACL Error',
+                detail = 'Insufficient priviliges.',
+                status = 403
+            )
+
+        async def hook(name, *args):
+            if hasattr(model, name):
+                try:
+                    await getattr(model, name)(*args)
+                except Exception as e:
+                    logger.info(str(e), exc_info=True)
+                    raise Error(
+                        title = 'Bulk Error',
+                        detail = str(e),
+                        status = 403
+                    )
+
+        if op == 'remove':
+            await hook('on_delete', token)
+            await model.delete()
+            return ('delete', { 'data': { 'id': id } })
+
+        attributes = data.get('attributes')
+
+        restricted = [ ]
+
+        if cls.__set__:
+            token_id, token_groups = _token_data(token)
+            groups = frozenset(token_groups)
+            if op == 'update' and id == token_id:
+                groups = groups | { 'self' }
+            model_data = model.serialize() if model else None
+            _apply_rules(attributes, cls._set_rules(), groups, restricted,
+                model_data, token_id)
+
+        if op == 'add':
+            model = cls.from_jsonapi(data)
+            await hook('on_create', token)
+        else:
+            await hook('on_update', token, attributes)
+            model.update(attributes)
+            if not model.id == id:
+                raise Error(
+                    title = 'Bulk Error',
+                    detail = 'The Model\'s ID does not match the operation\'s ID.',
+                    status = 403
+                )
+
+        await model.save()
+
+        result = {
+            'data': model.render(token, sparse)
+        }
+
+        if restricted:
+            for error in restricted:
+                error.source = { 'pointer': f'/atomic:operations/{index}' }
+            result['errors'] = list(map(lambda error: \
+                error.serialize(), restricted))
+
+        return ('create' if op == 'add' else 'update', result)
+
     @classmethod
     async def _pubsub(cls, request, socket):
 
@@ -688,13 +1662,16 @@ class JSONAPIMixin(object):
         state.socket = socket
         state.uuid = str(uuid4())
         state.index = { }
+        state.buckets = { }
         state.token = None
 
-        await state.socket.send(json.dumps({
+        await state.socket.send(JSON.dumps({
             'action': 'client-id',
             'id': state.uuid
         }))
 
+        acl = cls._acl_rules()
+
         router = Router(methods=[
             'authenticate',
             'deauthenticate',
@@ -706,28 +1683,28 @@ class JSONAPIMixin(object):
         ])
 
         @router.authenticate(f'/{cls._table}')
-        @socketrate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
+        @socketrate(**_rate_options(cls.__rate__, socket=True), namespace=cls._table)
         async def _authenticate(state, doc):
             await authenticate(state, doc)
 
         @router.deauthenticate(f'/{cls._table}')
-        @socketrate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
+        @socketrate(**_rate_options(cls.__rate__, socket=True), namespace=cls._table)
         async def _deauthenticate(state, doc):
             await deauthenticate(state, doc)
 
         @router.status(f'/{cls._table}')
-        @socketrate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
+        @socketrate(**_rate_options(cls.__rate__, socket=True), namespace=cls._table)
         async def _status(state, doc):
             await status(state, doc)
 
         @router.subscribe(f'/{cls._table}/<id>')
         @exists(cls)
-        @socketacl('subscribe', cls.__acl__, cls)
-        @socketrate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
+        @socketacl('subscribe', acl, cls)
+        @socketrate(**_rate_options(cls.__rate__, socket=True), namespace=cls._table)
         async def _subscribe(state, doc, id):
-            if await cls.exists(id):
+            if await context(state).load(cls, id):
                 state.index[id] = True
-                await state.socket.send(json.dumps({
+                await state.socket.send(JSON.dumps({
                     'action': 'subscribed',
                     'type': cls._table,
                     'id': id
@@ -735,13 +1712,13 @@ class JSONAPIMixin(object):
 
         @router.unsubscribe(f'/{cls._table}/<id>')
         @exists(cls)
-        @socketacl('subscribe', cls.__acl__, cls)
-        @socketrate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
+        @socketacl('subscribe', acl, cls)
+        @socketrate(**_rate_options(cls.__rate__, socket=True), namespace=cls._table)
         async def _unsubscribe(state, doc, id):
             ids = list(state.index.keys())
             if id in ids:
                 del state.index[id]
-                await state.socket.send(json.dumps({
+                await state.socket.send(JSON.dumps({
                     'action': 'unsubscribed',
                     'type': cls._table,
                     'id': id
@@ -749,8 +1726,8 @@ class JSONAPIMixin(object):
 
         @router.acquire(f'/{cls._table}/<id>')
         @exists(cls)
-        @socketacl('acquire', cls.__acl__, cls)
-        @socketrate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
+        @socketacl('acquire', acl, cls)
+        @socketrate(**_rate_options(cls.__rate__, socket=True), namespace=cls._table)
         async def _acquire(state, doc, id):
             expire = 5
             delay = 1
@@ -762,18 +1739,18 @@ class JSONAPIMixin(object):
             if doc.attempts:
                 attempts = doc.attempts
             if not await acquire(id, state.uuid, cls, expire, delay, attempts):
-                await state.socket.send(json.dumps({
+                await state.socket.send(JSON.dumps({
                     'action': 'acquire-failed',
                     'id': id
                 }))
 
         @router.release(f'/{cls._table}/<id>')
         @exists(cls)
-        @socketacl('acquire', cls.__acl__, cls)
-        @socketrate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
+        @socketacl('acquire', acl, cls)
+        @socketrate(**_rate_options(cls.__rate__, socket=True), namespace=cls._table)
         async def _release(state, doc, id):
             if not await release(id, state.uuid, cls):
-                await state.socket.send(json.dumps({
+                await state.socket.send(JSON.dumps({
                     'action': 'release-failed',
                     'id': id
                 }))
@@ -781,7 +1758,7 @@ class JSONAPIMixin(object):
         async def socket_reader(state):
             while True:
                 try:
-                    data = json.loads(await socket.recv())
+                    data = JSON.loads(await socket.recv())
                 except json.JSONDecodeError as e:
                     logger.info(str(e), exc_info=True)
                     continue
@@ -791,6 +1768,8 @@ class JSONAPIMixin(object):
 
                 doc = Document(data)
 
+                command_context(state)
+
                 await router.emit(doc.action, doc.path, state, doc)
 
         async def socket_writer(state):
@@ -815,7 +1794,7 @@ class JSONAPIMixin(object):
                     action, id = components
                 else:
                     # TODO: Maybe remove these three lines later?
-                    await state.socket.send(json.dumps({
+                    await state.socket.send(JSON.dumps({
                         'action': 'invalid-message'
                     }))
                     continue
@@ -828,7 +1807,7 @@ class JSONAPIMixin(object):
                         data.update({ 'type': type })
                     if expire:
                         data.update({ 'expire': expire })
-                    await state.socket.send(json.dumps(data))
+                    await state.socket.send(JSON.dumps(data))
 
         await asyncio.gather(socket_reader(state), socket_writer(state))
 
@@ -840,36 +1819,38 @@ class JSONAPIMixin(object):
         state.socket = socket
         state.uuid = str(uuid4())
         state.index = { }
+        state.buckets = { }
         state.token = None
 
-        await state.socket.send(json.dumps({
+        await state.socket.send(JSON.dumps({
             'action': 'client-id',
             'id': state.uuid
         }))
 
+        acl = cls._acl_rules()
+
         async def watch_changes(state, model):
 
-            if not await _check_acl('changes', cls.__acl__, state.token, model.id, cls):
-                await state.socket.send(json.dumps({
+            if not await _check_acl('changes', cls._acl_rules(), state.token, model.id, cls, model):
+                await state.socket.send(JSON.dumps({
                     'action': 'acl-restricted'
                 }))
                 return None
 
             token_data = state.token.get('data', { })
             token_id = token_data.get('id')
-            token_groups = token_data.get('groups')
-
-            groups = copy(token_groups)
+            token_groups = token_data.get('groups', [ ])
 
-            if model.id == token_id:
-                groups.append('self')
+            plan = None
 
-            model_data = model.serialize()
+            if cls.__get__:
+                plan = cls._render_plan(token_groups, model.id == token_id)
+                results = _evaluate_plan(plan, model.serialize(), token_id)
 
             async for change in await model.changes():
 
                 if change['new_val'] is None:
-                    await state.socket.send(json.dumps({
+                    await state.socket.send(JSON.dumps({
                         'action': 'delete',
                         'id': model.id,
                         'type': model._table
@@ -879,11 +1860,12 @@ class JSONAPIMixin(object):
                 attributes = change['new_val']
                 del attributes['id']
 
-                _apply_restrictions(attributes, cls.__get__, groups, [ ], [ ], model_data, token_id)
+                if plan:
+                    _apply_plan(attributes, plan, results)
 
                 if attributes:
                     model.update(attributes)
-                    await state.socket.send(json.dumps({
+                    await state.socket.send(JSON.dumps({
                         'action': 'change',
                         'id': model.id,
                         'type': model._table,
@@ -901,33 +1883,32 @@ class JSONAPIMixin(object):
         ])
 
         @router.authenticate(f'/{cls._table}')
-        @socketrate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
+        @socketrate(**_rate_options(cls.__rate__, socket=True), namespace=cls._table)
         async def _authenticate(state, doc):
             await authenticate(state, doc)
 
         @router.deauthenticate(f'/{cls._table}')
-        @socketrate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
+        @socketrate(**_rate_options(cls.__rate__, socket=True), namespace=cls._table)
         async def _deauthenticate(state, doc):
             await deauthenticate(state, doc)
 
         @router.status(f'/{cls._table}')
-        @socketrate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
+        @socketrate(**_rate_options(cls.__rate__, socket=True), namespace=cls._table)
         async def _status(state, doc):
             await status(state, doc)
 
         @router.watch(f'/{cls._table}/<id>')
         @exists(cls)
-        @socketacl('watch', cls.__acl__, cls)
-        @socketrate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
+        @socketacl('watch', acl, cls)
+        @socketrate(**_rate_options(cls.__rate__, socket=True), namespace=cls._table)
         async def _watch(state, doc, id):
-            model = cls({ 'id': id })
-            await model.load()
+            model = await context(state).load(cls, id)
             state.index[id] = asyncio.create_task(watch_changes(state, model))
 
         @router.unwatch(f'/{cls._table}/<id>')
         @exists(cls)
-        @socketacl('watch', cls.__acl__, cls)
-        @socketrate(*(cls.__rate__ or [ 0, 'none' ]), namespace=cls._table)
+        @socketacl('watch', acl, cls)
+        @socketrate(**_rate_options(cls.__rate__, socket=True), namespace=cls._table)
         async def _unwatch(state, doc, id):
             if id in state.index:
                 state.index[id].cancel()
@@ -936,7 +1917,7 @@ class JSONAPIMixin(object):
         async def socket_reader(state):
             while True:
                 try:
-                    data = json.loads(await socket.recv())
+                    data = JSON.loads(await socket.recv())
                 except json.JSONDecodeError as e:
                     logger.info(str(e), exc_info=True)
                     continue
@@ -946,6 +1927,8 @@ class JSONAPIMixin(object):
 
                 doc = Document(data)
 
+                command_context(state)
+
                 await router.emit(doc.action, doc.path, state, doc)
 
         await asyncio.gather(socket_reader(state))
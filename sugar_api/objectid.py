@@ -3,10 +3,24 @@ from uuid import UUID
 from bson import ObjectId
 from bson.objectid import InvalidId
 
-from . header import jsonapi
-from . error import Error
+from . pipeline import wrap
+from . header import jsonapi_body
+from . error import encode_error
 
 
+__objectid_error__ = encode_error('Object ID Error', 'Invalid object ID.', 403)
+
+
+def _primary_value(value, primary):
+    '''
+    Convert a document ID from a request or cursor to the type stored in
+    the `primary` key, ObjectIDs being stored as such in `_id`.
+    '''
+    if primary == '_id' and isinstance(value, str) \
+        and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
 def objectid(key):
     '''
     Looks in the requests `\*\*kargs` for `key`. If found, `key` must
@@ -14,34 +28,30 @@ def objectid(key):
 
     :param key: The key to look in `\*\*kargs` for.
     '''
-    def wrapper(handler):
-        async def decorator(request, *args, **kargs):
-            id = kargs.get(key)
-
-            if not id:
-                return await handler(request, *args, **kargs)
-
-            valid_uuid = True
-            valid_oid = True
-
-            try:
-                UUID(id)
-            except ValueError:
-                valid_uuid = False
-
-            try:
-                ObjectId(id)
-            except InvalidId:
-                valid_oid = False
-
-            if not (valid_uuid or valid_oid):
-                error = Error(
-                    title = 'Object ID Error',
-                    detail = 'Invalid object ID.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
-
-            return await handler(request, *args, **kargs)
-        return decorator
-    return wrapper
+    return wrap(_objectid(key))
+
+def _objectid(key):
+    def stage(request, kargs):
+        id = kargs.get(key)
+
+        if not id:
+            return None
+
+        valid_uuid = True
+        valid_oid = True
+
+        try:
+            UUID(id)
+        except ValueError:
+            valid_uuid = False
+
+        try:
+            ObjectId(id)
+        except InvalidId:
+            valid_oid = False
+
+        if not (valid_uuid or valid_oid):
+            return jsonapi_body(__objectid_error__, status=403)
+
+        return None
+    return stage
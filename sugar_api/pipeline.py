@@ -0,0 +1,78 @@
+from inspect import isawaitable, iscoroutinefunction
+
+
+def pipeline(handler, stages=( ), after=( )):
+    '''
+    Build a flat request handler. Each stage of `stages` is called in order
+    with `(request, kargs)` and may update `kargs` or return a response to
+    end the request early. `handler` is then awaited and each stage of
+    `after` is called with `(request, kargs, response)` and returns the
+    response. Stages that are `None` are disabled and left out, stages
+    that are not coroutine functions are called without an await.
+
+    .. code-block:: python
+
+        handler = pipeline(handler, [
+            _accept,
+            _webtoken,
+            _rate(1, 'secondly')
+        ])
+
+    :param handler: The route handler.
+    :param stages: The stages run before `handler`.
+    :param after: The stages run after `handler`.
+    '''
+    stages = tuple(map(lambda stage: \
+        (stage, iscoroutinefunction(stage)), filter(None, stages)))
+    after = tuple(map(lambda stage: \
+        (stage, iscoroutinefunction(stage)), filter(None, after)))
+
+    async def run(request, *args, **kargs):
+        for (stage, asynchronous) in stages:
+            if asynchronous:
+                response = await stage(request, kargs)
+            else:
+                response = stage(request, kargs)
+            if response is not None:
+                return response
+        response = await handler(request, *args, **kargs)
+        for (stage, asynchronous) in after:
+            if asynchronous:
+                response = await stage(request, kargs, response)
+            else:
+                response = stage(request, kargs, response)
+        return response
+
+    return run
+
+def wrap(stage):
+    '''
+    Turn a pipeline `stage` into a decorator. A disabled stage leaves the
+    handler unwrapped.
+    '''
+    def wrapper(handler):
+        if stage is None:
+            return handler
+        async def decorator(request, *args, **kargs):
+            response = stage(request, kargs)
+            if isawaitable(response):
+                response = await response
+            if response is not None:
+                return response
+            return await handler(request, *args, **kargs)
+        return decorator
+    return wrapper
+
+def wrap_after(stage):
+    '''
+    Turn a pipeline `stage` run after the handler into a decorator.
+    '''
+    def wrapper(handler):
+        async def decorator(request, *args, **kargs):
+            response = await handler(request, *args, **kargs)
+            response = stage(request, kargs, response)
+            if isawaitable(response):
+                response = await response
+            return response
+        return decorator
+    return wrapper
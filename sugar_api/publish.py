@@ -1,8 +1,9 @@
-from json import loads
-
+from . cache import invalidate
+from . encoder import JSON
+from . pipeline import wrap_after
 from . redis import Redis
 
-def publish(action, channel):
+def publish(action, channel, cache=None):
     '''
     Publish `action` to `channel` if the final response is a
     `sanic.response.json` object with an JSONAPI datastructure
@@ -10,24 +11,57 @@ def publish(action, channel):
 
     :param action: The action to publish.
     :param channel: The channel to publish `action` to.
+    :param cache: The `__cache__` options of the model stored in `channel`.
+                  If provided, `update` and `delete` actions invalidate the
+                  document's cached responses.
     '''
-    def wrapper(handler):
-        async def decorator(request, *args, **kargs):
-            response = await handler(request, *args, **kargs)
+    return wrap_after(_publish(action, channel, cache))
+
+def _publish(action, channel, cache=None):
+    async def stage(request, kargs, response):
 
-            redis = await Redis.connect()
+        redis = await Redis.connect()
 
-            json = loads(response.body)
+        json = JSON.loads(response.body)
 
-            if json.get('errors'):
-                return response
+        if json.get('errors'):
+            return response
 
-            data = json.get('data')
-            if data:
-                id = data.get('id')
-                if id:
+        data = json.get('data')
+        if data:
+            id = data.get('id')
+            if id:
+                if cache and action in ('update', 'delete'):
+                    pipeline = redis.multi_exec()
+                    _queue(pipeline, action, channel, id, cache)
+                    await pipeline.execute()
+                else:
                     await redis.publish(channel, f'{action}:{id}')
 
-            return response
-        return decorator
-    return wrapper
+        return response
+    return stage
+
+async def publish_many(events, channel, cache=None):
+    '''
+    Publish a list of `events` to `channel` in a single Redis round trip.
+
+    :param events: A list of `( action, id )` tuples.
+    :param channel: The channel to publish the events to.
+    :param cache: The `__cache__` options of the model stored in `channel`.
+    '''
+    if not events:
+        return
+
+    redis = await Redis.connect()
+
+    pipeline = redis.multi_exec()
+
+    for (action, id) in events:
+        _queue(pipeline, action, channel, id, cache)
+
+    await pipeline.execute()
+
+def _queue(pipeline, action, channel, id, cache):
+    if cache and action in ('update', 'delete'):
+        invalidate(pipeline, channel, id, cache.get('expire', 60))
+    pipeline.publish(channel, f'{action}:{id}')
@@ -0,0 +1,97 @@
+__logical__ = ( '$and', '$or', '$nor' )
+
+
+def _check_query(query, spec):
+    '''
+    Verify that `query` only filters on the fields allowed by `spec` with
+    the operators allowed for each field.
+
+    .. code-block:: python
+
+        spec = {
+            'filter': {
+                'name': [ '$eq', '$in' ],
+                'created': [ '$gt', '$lt' ]
+            },
+            'sort': [ 'created' ],
+            'indexes': [ [ 'created' ], [ 'name', 'created' ] ]
+        }
+
+    :param query: The query to verify.
+    :param spec: The model's `__query__` declaration.
+    :return: An error message or `None`.
+    '''
+    if not isinstance(query, dict):
+        return 'Query is not a JSON object.'
+    allowed = spec.get('filter', { })
+    for (key, value) in query.items():
+        if key in __logical__:
+            if not isinstance(value, list):
+                return f'Operator {key} requires a list.'
+            for clause in value:
+                message = _check_query(clause, spec)
+                if message:
+                    return message
+        elif key.startswith('$'):
+            return f'Operator {key} is not allowed.'
+        elif not key in allowed:
+            return f'Filtering on {key} is not allowed.'
+        else:
+            for operator in _operators(value):
+                if not operator in allowed[key]:
+                    return f'Operator {operator} is not allowed on {key}.'
+    return None
+
+def _check_sort(sort, spec):
+    '''
+    Verify that `sort` only sorts on the fields allowed by `spec`.
+
+    :param sort: A list of `[ key, direction ]` pairs or `None`.
+    :param spec: The model's `__query__` declaration.
+    :return: An error message or `None`.
+    '''
+    allowed = spec.get('sort', [ ])
+    for (key, direction) in sort or [ ]:
+        if not key in allowed:
+            return f'Sorting on {key} is not allowed.'
+    return None
+
+def _check_index(query, sort, indexes):
+    '''
+    Verify that `query` or `sort` can use one of the declared `indexes`,
+    that is, it filters or sorts on the first key of an index. Unfiltered
+    and unsorted queries are always allowed.
+
+    :param indexes: A list of lists of keys.
+    :return: `True` or `False`.
+    '''
+    prefixes = frozenset(map(lambda index: index[0], indexes))
+    if sort and sort[0][0] in prefixes:
+        return True
+    if not query:
+        return not sort
+    return _indexed(query, prefixes)
+
+def _indexed(query, prefixes):
+    for (key, value) in query.items():
+        if key == '$or':
+            if value and all(map(lambda clause: _indexed(clause, prefixes), value)):
+                return True
+        elif key == '$and':
+            if any(map(lambda clause: _indexed(clause, prefixes), value)):
+                return True
+        elif key in prefixes:
+            return True
+    return False
+
+def _operators(value):
+    if isinstance(value, dict) and value and \
+        all(map(lambda key: key.startswith('$'), value.keys())):
+        operators = [ ]
+        for operator in value.keys():
+            # $options only modifies $regex.
+            if operator == '$options':
+                operator = '$regex'
+            operators.append(operator)
+        return operators
+    return [ '$eq' ]
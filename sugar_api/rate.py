@@ -1,6 +1,12 @@
-from . header import jsonapi
-from . error import Error
-from . redis import Redis
+from math import ceil
+from time import monotonic
+
+from . context import context
+from . encoder import JSON
+from . header import jsonapi_body
+from . error import encode_error
+from . pipeline import wrap, wrap_after
+from . redis import Redis, Script
 
 
 __intervals__ = {
@@ -14,100 +20,435 @@ __intervals__ = {
     'yearly': 31449600
 }
 
+# XXX: Each script counts a hit on KEYS[1] in a single round trip and
+# XXX: returns whether it is allowed, the remaining hits and the
+# XXX: milliseconds until the limit resets, or until the next hit is
+# XXX: allowed when it is not. Times are taken from the Redis server so
+# XXX: that every worker shares the same clock.
+
+# XXX: Fixed windows starting on the first hit.
+
+__fixed_window__ = Script('''
+local count = redis.call('INCRBY', KEYS[1], tonumber(ARGV[3]) or 1)
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl < 0 then
+    ttl = tonumber(ARGV[1])
+    redis.call('PEXPIRE', KEYS[1], ttl)
+end
+local limit = tonumber(ARGV[2])
+if count > limit then
+    return { 0, 0, ttl }
+end
+return { 1, limit - count, ttl }
+''')
+
+# XXX: A sliding window counter, the count of the previous window is
+# XXX: weighted by how much of it the sliding window still covers.
+
+__sliding_window__ = Script('''
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local period = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local window = math.floor(now / period)
+local state = redis.call('HMGET', KEYS[1], 'window', 'current', 'previous')
+local current = tonumber(state[2]) or 0
+local previous = tonumber(state[3]) or 0
+local last = tonumber(state[1]) or window
+if last == window - 1 then
+    previous = current
+    current = 0
+elseif last ~= window then
+    previous = 0
+    current = 0
+end
+local elapsed = now - window * period
+local weighted = previous * (period - elapsed) / period + current
+if weighted + 1 > limit then
+    local retry = period - elapsed
+    if previous > 0 and current + 1 <= limit then
+        retry = math.ceil(period - (limit - current - 1) * period / previous) - elapsed
+    end
+    return { 0, 0, math.max(retry, 1) }
+end
+redis.call('HSET', KEYS[1], 'window', window, 'current', current + 1, 'previous', previous)
+redis.call('PEXPIRE', KEYS[1], period * 2)
+return { 1, math.floor(limit - weighted - 1), period - elapsed }
+''')
+
+# XXX: The generic cell rate algorithm, a token bucket storing only the
+# XXX: theoretical arrival time of the next hit.
+
+__gcra__ = Script('''
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local emission = tonumber(ARGV[1]) / tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then
+    tat = now
+end
+local arrival = tat + emission
+local allow = arrival - burst * emission
+if now < allow then
+    return { 0, 0, math.ceil(allow - now) }
+end
+redis.call('SET', KEYS[1], tostring(arrival), 'PX', math.ceil(arrival - now))
+return { 1, math.floor((now - allow) / emission), math.ceil(arrival - now) }
+''')
+
+__algorithms__ = {
+    'fixed': __fixed_window__,
+    'sliding': __sliding_window__,
+    'gcra': __gcra__
+}
+
+# XXX: The most keys a local limiter keeps.
+
+__local_keys__ = 10000
 
-def rate(limit, interval, namespace=None):
+
+def rate(limit, interval, namespace=None, algorithm='fixed', burst=None,
+    local=None, batch=10):
     '''
     Rate limit endpoint to `limit` requests per `interval`. If `nampescpace` is
-    provided, it will be used instead of the requests path.
+    provided, it will be used instead of the requests path. Requests over
+    the limit get a `429 Too Many Requests` response with a Retry-After
+    header, every response has the X-RateLimit-Limit, X-RateLimit-Remaining
+    and X-RateLimit-Reset headers.
+
+    The `algorithm` is one of:
+
+    * `fixed`: At most `limit` requests in windows of `interval` starting
+      on the first request. Up to twice the limit can pass at the edge of
+      two windows.
+    * `sliding`: A sliding window of `interval`, approximated from the
+      counts of the current and the previous fixed windows.
+    * `gcra`: A token bucket of `burst` requests, refilled at `limit`
+      requests per `interval`.
+
+    With `local`, the `fixed` algorithm counts requests in each worker
+    first and sends them to Redis in batches of up to `batch` requests,
+    or on every request once a caller has used `local` of its limit, such
+    as `0.5`. Each worker can let up to `batch` requests past the limit.
 
     :param limit: The number of requests to limit to.
-    :param interval: The interval over which `limit` is to be applied.
+    :param interval: The interval over which `limit` is to be applied, the
+                     name of an interval or a number of seconds.
     :param namespace: The namespace, defaults to the requests path.
+    :param algorithm: The rate limiting algorithm, defaults to `fixed`.
+    :param burst: The bucket size of `gcra`, defaults to `limit`.
+    :param local: The fraction of `limit` counted locally, above `0` and up
+                  to `1`, disabled by default.
+    :param batch: The most requests counted locally between two syncs.
 
     .. code-block:: python
 
         @server.get('/v1/endpoint')
-        @rate(1, 'secondly')
+        @rate(10, 60, algorithm='gcra', burst=20)
         async def handler(request):
             ...
     '''
-    if not interval in __intervals__:
+    stage = _rate(limit, interval, namespace, algorithm, burst, local, batch)
+    def wrapper(handler):
+        if stage is None:
+            return handler
+        return wrap(stage)(wrap_after(_rate_headers)(handler))
+    return wrapper
+
+def _rate(limit, interval, namespace=None, algorithm='fixed', burst=None,
+    local=None, batch=10):
+
+    hit = _limiter(limit, interval, algorithm, burst, local, batch)
+
+    if hit is None:
+        return None
+
+    exceeded = encode_error('Rate Limit Error',
+        f'Rate limit exceeded: {limit} {_describe(interval)}', 429)
+
+    async def stage(request, kargs):
+
+        token = kargs.get('token')
+
+        data = (token or { }).get('data', { })
+        id = data.get('id')
+
+        key = f'{id or request.ip}:{namespace or request.path}'
+
+        (allowed, remaining, reset) = await hit(key)
+
+        headers = _headers(limit, remaining, reset)
+
+        if not allowed:
+            headers['Retry-After'] = headers['X-RateLimit-Reset']
+            return jsonapi_body(exceeded, status=429, headers=headers)
+
+        context(request).rate = headers
+
+        return None
+    return stage
+
+def _rate_options(rate, socket=False):
+    '''
+    The keyword arguments of :func:`rate`, or of :func:`socketrate` with
+    `socket`, for a model's `__rate__`, either `(limit, interval)` or a
+    dictionary of keyword arguments.
+    '''
+    if not rate:
+        return { 'limit': 0, 'interval': 'none' }
+    if isinstance(rate, dict):
+        options = dict(rate)
+    else:
+        options = dict(zip(( 'limit', 'interval', 'algorithm', 'burst',
+            'local', 'batch' ), rate))
+    if not socket:
+        options.pop('ceiling', None)
+    return options
+
+def _rate_headers(request, kargs, response):
+    headers = context(request).rate
+    if headers:
+        response.headers.update(headers)
+    return response
+
+def _headers(limit, remaining, reset):
+    return {
+        'X-RateLimit-Limit': str(limit),
+        'X-RateLimit-Remaining': str(remaining),
+        'X-RateLimit-Reset': str(ceil(reset / 1000))
+    }
+
+def _describe(interval):
+    if isinstance(interval, str):
+        return interval
+    return f'per {interval} seconds'
+
+def _period(interval):
+    '''
+    The period of `interval` in seconds, `0` for `none`.
+    '''
+    if isinstance(interval, str):
+        if not interval in __intervals__:
+            raise Exception(
+                f'ratelimit: {interval} not in {list(__intervals__.keys())}'
+            )
+        return __intervals__[interval]
+    if isinstance(interval, (int, float)) and not isinstance(interval, bool) \
+        and interval > 0:
+        return interval
+    raise Exception(f'ratelimit: Invalid interval: {interval}')
+
+def _limiter(limit, interval, algorithm='fixed', burst=None, local=None,
+    batch=10):
+    '''
+    Build the function counting hits for a rate limit, see :func:`rate`.
+
+    :return: An async function of a key returning a tuple of
+             `(allowed, remaining, reset)`, `reset` being the milliseconds
+             until the limit resets or, when the hit is not allowed, until
+             the next hit is. `None` if the interval is `none`.
+    '''
+    period = _period(interval)
+
+    if not algorithm in __algorithms__:
         raise Exception(
-            f'ratelimit: {interval} not in {list(__intervals__.keys())}'
+            f'ratelimit: {algorithm} not in {list(__algorithms__.keys())}'
         )
-    def wrapper(handler):
-        async def decorator(request, *args, **kargs):
-            if interval is 'none':
-                return await handler(request, *args, **kargs)
 
-            token = kargs.get('token')
+    if local is not None and not 0 < local <= 1:
+        raise Exception(f'ratelimit: Invalid local: {local}')
 
-            data = (token or { }).get('data', { })
-            id = data.get('id')
+    if local and not algorithm == 'fixed':
+        raise Exception(f'ratelimit: local is not supported by {algorithm}')
 
-            redis = await Redis.connect()
+    if not period:
+        return None
 
-            key = f'{id or request.ip}:{namespace or request.path}'
+    script = __algorithms__[algorithm]
 
-            count = await redis.get(key) or 0
+    args = [ int(period * 1000), limit ]
 
-            if int(count) >= limit:
-                error = Error(
-                    title = 'Rate Limit Error',
-                    detail = f'Rate limit exceeded: {limit} {interval}',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+    if algorithm == 'gcra':
+        args.append(burst or limit)
 
-            if await redis.exists(key):
-                await redis.incr(key)
-            else:
-                await redis.set(key, 1, expire=__intervals__[interval])
+    # XXX: Each algorithm stores a different type of value, so their keys
+    # XXX: must not collide when a limit changes algorithm.
 
-            return await handler(request, *args, **kargs)
-        return decorator
-    return wrapper
+    async def hit(key, count=1):
+        redis = await Redis.connect()
+        (allowed, remaining, reset) = await script(redis,
+            keys=[ f'{algorithm}:{key}' ],
+            args=args + [ count ] if count > 1 else args)
+        return (bool(allowed), remaining, reset)
+
+    if local:
+        return _local(hit, limit, local, batch)
+
+    return hit
+
+def _local(hit, limit, local, batch):
+    '''
+    Count hits locally in front of a fixed window `hit` function. Each key
+    keeps the last count known from Redis, the hits not sent yet and the
+    local time at which the window ends. Hits are only sent to Redis when
+    `batch` of them are pending, when the caller is within `local` of its
+    limit or when the window has ended, along with the pending ones.
+    '''
+    counters = { }
+    threshold = limit * local
+
+    async def local_hit(key):
+        now = monotonic() * 1000
+        counter = counters.get(key)
+
+        pending = 0
+
+        if counter:
+            (count, pending, end) = counter
+            if end > now:
+                if count >= limit:
+                    return (False, 0, end - now)
+                if count + pending + 1 <= threshold and pending + 1 < batch:
+                    counter[1] += 1
+                    return (True, limit - count - counter[1], end - now)
+            # XXX: Hits counted while this one is sent stay pending.
+            counter[1] = 0
+
+        (allowed, remaining, reset) = await hit(key, pending + 1)
+
+        counter = counters.pop(key, None)
+
+        # XXX: Keys are kept in the order they were last sent, the keys
+        # XXX: sent the longest ago are dropped first.
+
+        while len(counters) >= __local_keys__:
+            (_key, _counter) = next(iter(counters.items()))
+            del counters[_key]
+            if _counter[1]:
+                await hit(_key, _counter[1])
+
+        counters[key] = [ limit - remaining, counter[1] if counter else 0,
+            now + reset ]
+
+        return (allowed, remaining, reset)
+    return local_hit
 
-def socketrate(limit, interval, namespace=None):
+class TokenBucket(object):
+
+    '''
+    An in memory token bucket of `capacity` tokens, refilled at `limit`
+    tokens per `period` milliseconds.
+    '''
+
+    __slots__ = ( 'rate', 'capacity', 'tokens', 'time' )
+
+    def __init__(self, limit, period, capacity):
+        self.rate = limit / period
+        self.capacity = capacity
+        self.tokens = capacity
+        self.time = monotonic() * 1000
+
+    def check(self):
+        '''
+        Check whether a token can be taken from the bucket, without taking it.
+
+        :return: A tuple of `(allowed, remaining, reset)`, see :func:`_limiter`.
+        '''
+        now = monotonic() * 1000
+        self.tokens = min(self.capacity,
+            self.tokens + (now - self.time) * self.rate)
+        self.time = now
+        if self.tokens < 1:
+            return (False, 0, ceil((1 - self.tokens) / self.rate))
+        return (True, int(self.tokens - 1),
+            ceil((self.capacity - self.tokens + 1) / self.rate))
+
+    def take(self):
+        '''
+        Take a token from the bucket.
+
+        :return: A tuple of `(allowed, remaining, reset)`, see :func:`_limiter`.
+        '''
+        (allowed, remaining, reset) = self.check()
+        if allowed:
+            self.tokens -= 1
+        return (allowed, remaining, reset)
+
+def socketrate(limit, interval, namespace=None, algorithm='fixed', burst=None,
+    local=None, batch=10, ceiling=False):
     '''
     Rate limit endpoint to `limit` requests per `interval`. If `nampescpace` is
     provided, it will be used instead of the requests path.
 
+    Each connection has its own token bucket of `burst` requests, refilled
+    at `limit` requests per `interval`, kept in memory, so a user opening
+    more connections gets more requests. With `ceiling`, the limit is also
+    applied to the user across connections and workers in Redis, see
+    :func:`rate` for `algorithm`, `local` and `batch`. Each command then
+    waits on Redis, unless `local` counts it in the worker.
+
     :param limit: The number of requests to limit to.
     :param interval: The interval over which `limit` is to be applied.
     :param namespace: The namespace, defaults to the requests path.
+    :param algorithm: The rate limiting algorithm of the ceiling.
+    :param burst: The bucket size, defaults to `limit`.
+    :param local: The fraction of `limit` counted locally by the ceiling.
+    :param batch: The most requests counted locally between two syncs.
+    :param ceiling: Whether to apply the limit per user in Redis, defaults
+                    to `False`.
     '''
-    if not interval in __intervals__:
-        raise Exception(
-            f'ratelimit: {interval} not in {list(__intervals__.keys())}'
-        )
+    period = _period(interval) * 1000
+
+    hit = _limiter(limit, interval, algorithm, burst, local, batch) \
+        if ceiling else None
+
     def wrapper(handler):
+        if not period:
+            return handler
         async def decorator(state, doc, *args, **kargs):
-            if interval is 'none':
-                return await handler(state, doc, *args, **kargs)
+            path = namespace or state.request.path
+
+            buckets = getattr(state, 'buckets', None)
 
-            data = (state.token or { }).get('data', { })
-            id = data.get('id')
+            if buckets is None:
+                buckets = state.buckets = { }
 
-            redis = await Redis.connect()
+            bucket = buckets.get(path)
 
-            key = f'{id or state.request.ip}:{namespace or state.request.path}'
+            if bucket is None:
+                bucket = buckets[path] = TokenBucket(limit, period,
+                    burst or limit)
 
-            count = await redis.get(key) or 0
+            (allowed, remaining, reset) = bucket.check()
 
-            if int(count) >= limit:
-                await state.socket.send(json.dumps({
+            # XXX: The bucket's token is only taken once the ceiling has
+            # XXX: allowed the command.
+
+            if allowed and hit:
+                data = (state.token or { }).get('data', { })
+                id = data.get('id')
+
+                (allowed, remaining, reset) = await hit(f'{id or state.request.ip}:{path}')
+
+            if allowed:
+                (allowed, remaining, reset) = bucket.take()
+
+            if not allowed:
+                await state.socket.send(JSON.dumps({
                     'action': 'rate-limit',
                     'interval': interval,
-                    'limit': limit
+                    'limit': limit,
+                    'reset': reset
                 }))
                 return None
 
-            if await redis.exists(key):
-                await redis.incr(key)
-            else:
-                await redis.set(key, 1, expire=__intervals__[interval])
-
             return await handler(state, doc, *args, **kargs)
         return decorator
     return wrapper
@@ -1,23 +1,57 @@
+import asyncio
 import json
+import random
+from hashlib import sha1
+
 import aioredis
+from sanic.log import logger
 
 
 def serialize(dict):
     return json.dumps(dict, separators=(',', ':'), sort_keys=True)
 
 
+__lowlevel__ = { 'lowlevel': True }
+
+__default_key__ = serialize({ })
+__lowlevel_key__ = serialize(__lowlevel__)
+
+
 class Redis(object):
     '''
-    The Redis connection cache.
+    The Redis connection registry. The default connection, from
+    `Redis.connect()`, and the lowlevel connection, from
+    `Redis.connect(lowlevel=True)`, are kept in `Redis.default` and
+    `Redis.lowlevel` and returned without building a cache key.
+
+    Connections that are closed are created again when requested, once
+    for concurrent requests. With :meth:`start_health_checks`, connections
+    are also pinged in the background and reconnected in their own task
+    with a jittered exponential backoff.
     '''
 
     connections = { }
+    options = { }
+    health = { }
+    locks = { }
+    reconnecting = { }
     loop = None
 
+    default = None
+    lowlevel = None
+
     default_host = None
     default_minsize = None
     default_maxsize = None
 
+    health_interval = 5
+    health_timeout = 1
+
+    backoff_base = 0.1
+    backoff_cap = 10
+
+    _health_task = None
+
     @classmethod
     def default_connection(cls, **kargs):
         '''
@@ -26,6 +60,7 @@ class Redis(object):
         cls.default_host = kargs.get('host', 'redis://localhost')
         cls.default_minsize = kargs.get('minsize', 5)
         cls.default_maxsize = kargs.get('maxsize', 10)
+        cls.options = { }
 
     @classmethod
     async def set_event_loop(cls, loop):
@@ -35,14 +70,41 @@ class Redis(object):
         cls.loop = loop
         await cls.close()
         cls.connections = { }
+        cls.options = { }
+        cls.locks = { }
 
     @classmethod
     async def connect(cls, **kargs):
         '''
         Connect to Redis using `\*\*kargs`.
         '''
+        if not kargs:
+            connection = cls.default
+            if connection is not None and not connection.closed:
+                return connection
+        elif kargs == __lowlevel__:
+            connection = cls.lowlevel
+            if connection is not None and not connection.closed:
+                return connection
+
         key = serialize(kargs)
 
+        connection = cls.connections.get(key)
+        if connection and not connection.closed:
+            return connection
+
+        if not key in cls.options:
+            cls.options[key] = cls._resolve(kargs)
+
+        if not cls.loop:
+            raise Exception('Redis.connect: Event loop not yet set.')
+
+        return await cls._create(key)
+
+    @classmethod
+    def _resolve(cls, kargs):
+        kargs = dict(kargs)
+
         try:
             host = kargs.pop('host')
         except KeyError:
@@ -60,28 +122,204 @@ class Redis(object):
                 raise Exception('Redis.connect: No maxsize key provided.')
             kargs['maxsize'] = cls.default_maxsize
 
-        if not cls.loop:
-            raise Exception('Redis.connect: Event loop not yet set.')
+        lowlevel = bool(kargs.pop('lowlevel', False))
+
+        return (host, kargs, lowlevel)
+
+    @classmethod
+    async def _create(cls, key):
+        lock = cls.locks.get(key)
+        if lock is None:
+            lock = cls.locks[key] = asyncio.Lock()
+
+        # XXX: Callers waiting on the lock get the connection created
+        # XXX: by the first one.
+
+        async with lock:
+
+            previous = cls.connections.get(key)
+            if previous and not previous.closed:
+                return previous
+
+            (host, kargs, lowlevel) = cls.options[key]
+
+            if lowlevel:
+                connection = await aioredis.create_pool(host, loop=cls.loop, **kargs)
+            else:
+                connection = await aioredis.create_redis_pool(host, loop=cls.loop, **kargs)
+
+            cls.connections[key] = connection
+
+            if key == __default_key__:
+                cls.default = connection
+            elif key == __lowlevel_key__:
+                cls.lowlevel = connection
+
+        if previous:
+            await cls._dispose(key, previous)
+
+        return connection
+
+    @classmethod
+    async def _dispose(cls, key, connection):
+        try:
+            if not connection.closed:
+                connection.close()
+            await connection.wait_closed()
+        except Exception as e:
+            logger.warning(f'Redis: {cls._name(key)}: {e!r}')
+
+    @classmethod
+    def start_health_checks(cls, interval=None):
+        '''
+        Ping every connection in the background each `interval` seconds,
+        defaults to `Redis.health_interval`, and reconnect the connections
+        that do not answer within `Redis.health_timeout` seconds.
+        '''
+        if cls._health_task is None or cls._health_task.done():
+            cls._health_task = asyncio.ensure_future(
+                cls._health_checks(interval or cls.health_interval),
+                loop=cls.loop
+            )
+        return cls._health_task
+
+    @classmethod
+    async def _health_checks(cls, interval):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.gather(*map(cls.check, list(cls.connections.keys())))
+
+    @classmethod
+    async def check(cls, key):
+        '''
+        Ping the connection `key`, reconnecting it in a task of
+        `Redis.reconnecting` if it does not answer.
 
-        kargs['loop'] = cls.loop
+        :return: Whether the connection answered.
+        '''
+        if key in cls.reconnecting:
+            return False
+        health = cls._health(key)
+        try:
+            await asyncio.wait_for(cls.connections[key].execute('PING'),
+                cls.health_timeout)
+        except Exception as e:
+            logger.warning(f'Redis: {cls._name(key)}: {e!r}')
+            health['healthy'] = False
+            health['failures'] += 1
+            cls.reconnecting[key] = asyncio.ensure_future(cls._reconnect(key))
+            return False
+        health['healthy'] = True
+        return True
+
+    @classmethod
+    async def _reconnect(cls, key):
+        health = cls._health(key)
 
         connection = cls.connections.get(key)
-        if connection:
-            return connection
+        if connection and not connection.closed:
+            connection.close()
+
+        attempt = 0
+
+        try:
+            while True:
+                # XXX: Full jitter, so that workers do not reconnect at once.
+                delay = min(cls.backoff_cap, cls.backoff_base * 2 ** attempt)
+                await asyncio.sleep(random.uniform(0, delay))
+                try:
+                    await cls._create(key)
+                except Exception as e:
+                    logger.warning(f'Redis: {cls._name(key)}: {e!r}')
+                    attempt += 1
+                else:
+                    health['healthy'] = True
+                    health['reconnects'] += 1
+                    return
+        finally:
+            cls.reconnecting.pop(key, None)
 
-        if kargs.get('lowlevel'):
-            del kargs['lowlevel']
-            cls.connections[key] = await aioredis.create_pool(host, **kargs)
-            return cls.connections[key]
-        else:
-            cls.connections[key] = await aioredis.create_redis_pool(host, **kargs)
-            return cls.connections[key]
+    @classmethod
+    def _health(cls, key):
+        health = cls.health.get(key)
+        if health is None:
+            health = cls.health[key] = {
+                'healthy': True,
+                'failures': 0,
+                'reconnects': 0
+            }
+        return health
+
+    @classmethod
+    def _name(cls, key):
+        if key == __default_key__:
+            return 'default'
+        if key == __lowlevel_key__:
+            return 'lowlevel'
+        return key
+
+    @classmethod
+    def stats(cls):
+        '''
+        The pool utilization and health of each connection, for metrics.
+
+        :return: A dictionary of connection names, `default`, `lowlevel` or
+                 the connection's options, to dictionaries of `size`,
+                 `free`, `maxsize`, `utilization`, `healthy`, `failures`
+                 and `reconnects`.
+        '''
+        stats = { }
+        for (key, connection) in cls.connections.items():
+            pool = getattr(connection, 'connection', connection)
+            size = getattr(pool, 'size', 0)
+            free = getattr(pool, 'freesize', 0)
+            maxsize = getattr(pool, 'maxsize', 0)
+            stats[cls._name(key)] = dict(cls._health(key), **{
+                'size': size,
+                'free': free,
+                'maxsize': maxsize,
+                'utilization': (size - free) / maxsize if maxsize else 0
+            })
+        return stats
 
     @classmethod
     async def close(cls):
         '''
         Close all existing Redis connections.
         '''
+        if cls._health_task:
+            cls._health_task.cancel()
+            cls._health_task = None
+        for task in list(cls.reconnecting.values()):
+            task.cancel()
+        cls.reconnecting = { }
         for connection in cls.connections:
             cls.connections[connection].close()
             await cls.connections[connection].wait_closed()
+        cls.default = None
+        cls.lowlevel = None
+
+
+class Script(object):
+    '''
+    A Lua script run on the Redis server with `EVALSHA`. The script is sent
+    with `EVAL` when the server does not have it cached yet.
+
+    .. code-block:: python
+
+        script = Script("return redis.call('INCR', KEYS[1])")
+
+        count = await script(await Redis.connect(), keys=[ 'key' ])
+    '''
+
+    def __init__(self, source):
+        self.source = source
+        self.digest = sha1(source.encode()).hexdigest()
+
+    async def __call__(self, redis, keys=[ ], args=[ ]):
+        try:
+            return await redis.evalsha(self.digest, keys=keys, args=args)
+        except aioredis.ReplyError as e:
+            if not str(e).startswith('NOSCRIPT'):
+                raise
+            return await redis.eval(self.source, keys=keys, args=args)
@@ -1,7 +1,25 @@
-from copy import copy
+from . context import context
+from . header import jsonapi_body
+from . error import Error, encode_error
+from . pipeline import wrap
+
+
+__unauthorized__ = {
+    'data': {
+        'id': 'unauthorized',
+        'groups': ['unauthorized']
+    }
+}
+
+__data_error__ = encode_error('Restriction Error',
+    'Token does not contain a data attribute.', 403)
+__id_error__ = encode_error('Restriction Error',
+    'Token data does not contain an ID attribute.', 403)
+__groups_error__ = encode_error('Restriction Error',
+    'Token data does not contain a groups attribute.', 403)
+__groups_type_error__ = encode_error('Restriction Error',
+    'Token data groups attribute is not a list.', 403)
 
-from . header import jsonapi
-from . error import Error
 
 def set(restrictions, Model=None):
     '''
@@ -17,123 +35,311 @@ def set(restrictions, Model=None):
         async def handler(request, id):
             ...
     '''
-    def wrapper(handler):
-        async def decorator(request, *args, **kargs):
-            if not restrictions:
-                return await handler(request, *args, **kargs)
+    return wrap(_set(restrictions, Model))
 
-            id = kargs.get('id')
+def _set(restrictions, Model=None):
 
-            token = kargs.get('token')
+    if not restrictions:
+        return None
 
-            if not token:
+    rules = _compile_restrictions(restrictions)
+    fields = _has_fields(rules)
 
-                token = {
-                    'data': {
-                        'id': 'unauthorized',
-                        'groups': ['unauthorized']
-                    }
-                }
+    async def stage(request, kargs):
+        id = kargs.get('id')
 
-            token_data = token.get('data')
+        token = kargs.get('token')
 
-            if not token_data:
-                error = Error(
-                    title = 'Restriction Error',
-                    detail = 'Token does not contain a data attribute.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+        error = _token_error(token)
 
-            token_id = token_data.get('id')
+        if error:
+            return jsonapi_body(error, status=403)
 
-            if not token_id:
-                error = Error(
-                    title = 'Restriction Error',
-                    detail = 'Token data does not contain an ID attribute.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+        token_data = (token or __unauthorized__)['data']
 
-            token_groups = token_data.get('groups')
+        token_id = token_data['id']
 
-            if not token_groups:
-                error = Error(
-                    title = 'Restriction Error',
-                    detail = 'Token data does not contain a groups attribute.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+        ctx = context(request)
 
-            if not isinstance(token_groups, list):
-                error = Error(
-                    title = 'Restriction Error',
-                    detail = 'Token data groups attribute is not a list.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+        attributes = ctx.attributes
 
-            data = request.json.get('data')
-            attributes = data.get('attributes')
+        groups = frozenset(token_data['groups'])
 
-            groups = copy(token_groups)
+        if id == token_id:
+            groups = groups | { 'self' }
 
-            if id == token_id:
-                groups.append('self')
+        errors = kargs['errors'] = [ ]
+        model_data = None
 
-            path = [ ]
-            errors = kargs['errors'] = [ ]
-            model = await Model.find_by_id(id)
-            model_data = None
+        # XXX: The document is only needed by `$` and `#` rules.
 
+        if fields and Model and id:
+            model = await ctx.load(Model, id)
             if model:
                 model_data = model.serialize()
 
-            _apply_restrictions(attributes, restrictions, groups, errors, path, model_data, token_id)
+        _apply_rules(attributes, rules, groups, errors, model_data, token_id)
 
-            return await handler(request, *args, **kargs)
-        return decorator
-    return wrapper
+        return None
+    return stage
 
-def _apply_restrictions(attributes, restrictions, groups, errors, path, model_data, token_id):
+def _token_error(token):
+    '''
+    Check that `token` holds the ID and groups restrictions rely on, a
+    missing token being unauthorized.
+
+    :return: An encoded error document or `None`.
+    '''
+    token_data = (token or __unauthorized__).get('data')
+
+    if not token_data:
+        return __data_error__
+
+    if not token_data.get('id'):
+        return __id_error__
+
+    token_groups = token_data.get('groups')
+
+    if not token_groups:
+        return __groups_error__
+
+    if not isinstance(token_groups, list):
+        return __groups_type_error__
+
+    return None
+
+def _compile_restrictions(restrictions):
+    '''
+    Compile `restrictions` into a trie of nodes, see :func:`_compile`.
+    Compile once, when the stage or model is built, not per request.
+    '''
+    return _compile(restrictions, ( ))
+
+def _compile(restrictions, path):
+    '''
+    Compile `restrictions` into a trie of nodes, each node being a tuple of
+    `(key, attribute, groups, fields, children)`. `attribute` is the dotted
+    name of the node, `groups` a frozenset of the allowed groups and
+    `fields` the `$` and `#` rules as `(prefix, path)` tuples. Nested
+    restrictions have `children` instead.
+    '''
+    nodes = [ ]
     for (key, allowed_groups) in restrictions.items():
+        attribute = '.'.join(path + (key, ))
         if isinstance(allowed_groups, dict):
-            if attributes.get(key):
-                _path = copy(path)
-                _path.append(key)
-                _apply_restrictions(attributes[key], restrictions[key], groups, errors, _path, model_data, token_id)
-        else:
-            if not _check_restrictions(groups, allowed_groups, model_data, token_id):
-                if attributes.get(key):
-                    del attributes[key]
-                    attribute = f'{key}'
-                    if path:
-                        attribute = f'{".".join(path)}.{attribute}'
-                    error = Error(
-                        title = 'Restriction Error',
-                        detail = f'Cannot set attribute: {attribute}',
-                        status = 403
-                    )
-                    errors.append(error)
-        if isinstance(attributes.get(key), dict):
-            if not attributes.get(key):
+            children = _compile(allowed_groups, path + (key, ))
+            nodes.append((key, attribute, None, None, children))
+            continue
+        fields = tuple(map(lambda group: (group[0], tuple(group[1:].split('.'))),
+            filter(lambda group: group[:1] in ('$', '#'), allowed_groups)))
+        groups = frozenset(filter(lambda group: \
+            not group[:1] in ('$', '#'), allowed_groups))
+        nodes.append((key, attribute, groups, fields, None))
+    return tuple(nodes)
+
+def _has_fields(nodes):
+    '''
+    Check whether the compiled `nodes` contain `$` or `#` rules.
+    '''
+    for (key, attribute, groups, fields, children) in nodes:
+        if fields or (children and _has_fields(children)):
+            return True
+    return False
+
+def _apply_rules(attributes, nodes, groups, errors, model_data, token_id):
+    '''
+    Remove the attributes that compiled `nodes` do not allow to be set in
+    place, appending an error to `errors` for each.
+
+    :param groups: A frozenset of the token's groups.
+    '''
+    for (key, attribute, allowed, fields, children) in nodes:
+        value = attributes.get(key)
+        if children is not None:
+            if isinstance(value, dict):
+                _apply_rules(value, children, groups, errors, model_data, token_id)
+            elif value:
+                # XXX: A value replacing restricted nested attributes.
                 del attributes[key]
+                errors.append(_set_error(attribute))
+                continue
+        elif value and not _check_rule(groups, allowed, fields, model_data, token_id):
+            del attributes[key]
+            errors.append(_set_error(attribute))
+            continue
+        if isinstance(value, dict) and not value:
+            del attributes[key]
 
-def _check_restrictions(groups, allowed_groups, model_data, token_id):
-    for group in allowed_groups:
-        if group.startswith('$'):
-            value = _get_value(group.strip('$'), model_data)
-            if token_id == value:
+def _check_rule(groups, allowed, fields, model_data, token_id):
+    if not allowed.isdisjoint(groups):
+        return True
+    for (prefix, path) in fields:
+        value = model_data
+        for key in path:
+            if not isinstance(value, dict):
+                value = None
+                break
+            value = value.get(key)
+        if prefix == '$':
+            if value is not None and token_id == value:
                 return True
-        elif group.startswith('#'):
-            value = _get_value(group.strip('#'), model_data)
-            if token_id in value:
-                return True
-        elif group in groups:
+        elif value and token_id in value:
             return True
     return False
 
+def _set_error(attribute):
+    return Error(
+        title = 'Restriction Error',
+        detail = f'Cannot set attribute: {attribute}',
+        status = 403
+    )
+
+def _apply_restrictions(attributes, restrictions, groups, errors, path, model_data, token_id):
+    '''
+    Apply `restrictions` to `attributes`, see :func:`_apply_rules`.
+    '''
+    _apply_rules(attributes, _compile(restrictions, tuple(path)),
+        frozenset(groups or ( )), errors, model_data, token_id)
+
 def _get_value(path, model_data):
     for key in path.split('.'):
         model_data = model_data[key]
     return model_data
+
+_ALLOW = 0
+_DENY = 1
+_CHECK = 2
+_NESTED = 3
+
+def _compile_plan(restrictions, groups):
+    '''
+    Compile `restrictions` for a fixed set of `groups` into a plan. Rules
+    decided by `groups` alone are resolved here, only `$` and `#` rules are
+    left to be checked against each document with :func:`_evaluate_plan`.
+
+    :return: A tuple of `(nodes, checks, denied)`, `denied` being the
+             dotted paths that are always removed.
+    '''
+    checks = [ ]
+    denied = [ ]
+    def compile(restrictions, path):
+        nodes = [ ]
+        for (key, allowed_groups) in restrictions.items():
+            if isinstance(allowed_groups, dict):
+                nodes.append((key, _NESTED, compile(allowed_groups, path + (key, ))))
+                continue
+            fields = [ ]
+            allowed = False
+            for group in allowed_groups:
+                if group.startswith('$') or group.startswith('#'):
+                    fields.append((group[0], group[1:]))
+                elif group in groups:
+                    allowed = True
+            if allowed:
+                nodes.append((key, _ALLOW, None))
+            elif fields:
+                nodes.append((key, _CHECK, len(checks)))
+                checks.append(tuple(fields))
+            else:
+                nodes.append((key, _DENY, None))
+                denied.append('.'.join(path + (key, )))
+        return nodes
+    return (compile(restrictions, ( )), checks, tuple(denied))
+
+def _projection(fields, denied, needed, primary):
+    '''
+    Merge the `denied` paths into the `fields` projection, keeping the
+    `needed` paths required by field checks and sorting.
+
+    :param fields: A projection dictionary or `None`.
+    :param denied: The dotted paths that will never be rendered.
+    :param needed: The dotted paths that must be fetched.
+    :param primary: The model's primary key.
+    :return: A projection dictionary or `None`.
+    '''
+    def overlaps(path, other):
+        return path == other or path.startswith(other + '.') \
+            or other.startswith(path + '.')
+
+    denied = list(filter(lambda path: \
+        not any(map(lambda other: overlaps(path, other), needed)), denied))
+
+    inclusive = fields and any(map(lambda item: \
+        item[1] and not item[0] == primary, fields.items()))
+
+    if not inclusive:
+        if not denied:
+            return fields
+        projection = dict(fields or { })
+        for path in denied:
+            projection[path] = 0
+        return projection
+
+    projection = { }
+
+    for (key, value) in fields.items():
+        if not any(map(lambda path: \
+            key == path or key.startswith(path + '.'), denied)):
+            projection[key] = value
+
+    for path in needed:
+        if any(map(lambda key: \
+            path == key or path.startswith(key + '.'), projection)):
+            continue
+        for key in list(projection.keys()):
+            if key.startswith(path + '.'):
+                del projection[key]
+        projection[path] = 1
+
+    if not any(map(lambda item: \
+        item[1] and not item[0] == primary, projection.items())):
+        projection = { primary: 1 }
+
+    return projection
+
+def _evaluate_plan(plan, model_data, token_id):
+    '''
+    Evaluate the `$` and `#` rules of `plan` against `model_data`. This must
+    happen before `model_data` is modified.
+
+    :return: A list of booleans, one for each check in `plan`.
+    '''
+    results = [ ]
+    for fields in plan[1]:
+        allowed = False
+        for (prefix, path) in fields:
+            value = _find_value(path, model_data)
+            if prefix == '$' and value is not None and token_id == value:
+                allowed = True
+                break
+            if prefix == '#' and value and token_id in value:
+                allowed = True
+                break
+        results.append(allowed)
+    return results
+
+def _apply_plan(attributes, plan, results):
+    '''
+    Remove the attributes denied by `plan` and `results` in place.
+    '''
+    _apply_nodes(attributes, plan[0], results)
+
+def _apply_nodes(attributes, nodes, results):
+    for (key, op, arg) in nodes:
+        value = attributes.get(key)
+        if op == _NESTED:
+            if value and isinstance(value, dict):
+                _apply_nodes(value, arg, results)
+        elif op == _DENY or (op == _CHECK and not results[arg]):
+            if value:
+                del attributes[key]
+                continue
+        if isinstance(value, dict) and not value:
+            del attributes[key]
+
+def _find_value(path, model_data):
+    for key in path.split('.'):
+        if not isinstance(model_data, dict):
+            return None
+        model_data = model_data.get(key)
+    return model_data
@@ -1,5 +1,12 @@
-from . error import Error
-from . header import jsonapi
+from . error import encode_error
+from . header import jsonapi_body
+
+
+__token_error__ = encode_error('Scope Error', 'No token provided.', 403)
+__data_error__ = encode_error('Scope Error', 'No data provided.', 403)
+__scope_error__ = encode_error('Scope Error', 'No scope provided.', 403)
+__invalid_error__ = encode_error('Scope Error', 'Invalid scope.', 403)
+
 
 def scope(scope):
     '''
@@ -19,40 +26,20 @@ def scope(scope):
             token = kargs.get('token')
 
             if not token:
-                error = Error(
-                    title = 'Scope Error',
-                    detail = 'No token provided.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+                return jsonapi_body(__token_error__, status=403)
 
             data = token.get('data')
 
             if not data:
-                error = Error(
-                    title = 'Scope Error',
-                    detail = 'No data provided.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+                return jsonapi_body(__data_error__, status=403)
 
             token_scope = data.get('scope')
 
             if not token_scope:
-                error = Error(
-                    title = 'Scope Error',
-                    detail = 'No scope provided.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+                return jsonapi_body(__scope_error__, status=403)
 
             if not _check_scope(scope, token_scope, kargs):
-                error = Error(
-                    title = 'Scope Error',
-                    detail = 'Invalid scope.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+                return jsonapi_body(__invalid_error__, status=403)
 
             return await handler(*args, **kargs)
         return decorator
@@ -1,50 +1,39 @@
-from . error import Error
-from . header import jsonapi
+from . context import context
+from . error import encode_error
+from . header import jsonapi_body
+from . pipeline import wrap
+
+
+__data_error__ = encode_error('JSON API Error', 'No data supplied.', 403)
+__data_type_error__ = encode_error('JSON API Error', 'Data is not a JSON object.', 403)
+__attributes_error__ = encode_error('JSON API Error', 'No attributes supplied.', 403)
+__attributes_type_error__ = encode_error('JSON API Error', 'Attributes is not a JSON object.', 403)
+
 
 def validate(handler):
     '''
     Validate the structure of a JSONAPI request.
     '''
-    async def decorator(request, *args, **kargs):
-
-        data = None
-
-        if request.json:
-            data = request.json.get('data')
-
-        if not data:
-            error = Error(
-                title = 'JSON API Error',
-                detail = 'No data supplied.',
-                status = 403
-            )
-            return jsonapi({ 'errors': [ error.serialize() ]}, status=403)
-
-        if not isinstance(data, dict):
-            error = Error(
-                title = 'JSON API Error',
-                detail = 'Data is not a JSON object.',
-                status = 403
-            )
-            return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
-
-        attributes = data.get('attributes')
-
-        if not attributes:
-            error = Error(
-                title = 'JSON API Error',
-                detail = 'No attributes supplied.',
-                status = 403
-            )
-            return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
-
-        if not isinstance(attributes, dict):
-            error = Error(
-                title = 'JSON API Error',
-                detail = 'Attributes is not a JSON object.',
-                status = 403
-            )
-            return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
-
-        return await handler(request, *args, **kargs)
-    return decorator
+    return wrap(_validate)(handler)
+
+def _validate(request, kargs):
+
+    ctx = context(request)
+
+    data = ctx.data
+
+    if not data:
+        return jsonapi_body(__data_error__, status=403)
+
+    if not isinstance(data, dict):
+        return jsonapi_body(__data_type_error__, status=403)
+
+    attributes = ctx.attributes
+
+    if not attributes:
+        return jsonapi_body(__attributes_error__, status=403)
+
+    if not isinstance(attributes, dict):
+        return jsonapi_body(__attributes_type_error__, status=403)
+
+    return None
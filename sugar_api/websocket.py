@@ -1,7 +1,7 @@
 import jwt
-import json
 
-from . acl import _check_acl
+from . context import context
+from . encoder import JSON
 from . webtoken import WebToken
 
 async def authenticate(state, doc):
@@ -14,19 +14,19 @@ async def authenticate(state, doc):
             options=WebToken.get_options()
         )
     except jwt.ExpiredSignatureError:
-        await state.socket.send(json.dumps({
+        await state.socket.send(JSON.dumps({
             'action': 'token-expired'
         }))
     except jwt.ImmatureSignatureError:
-        await state.socket.send(json.dumps({
+        await state.socket.send(JSON.dumps({
             'action': 'token-immature'
         }))
     except Exception as e:
-        await state.socket.send(json.dumps({
+        await state.socket.send(JSON.dumps({
             'action': 'token-error'
         }))
     else:
-        await state.socket.send(json.dumps({
+        await state.socket.send(JSON.dumps({
             'action': 'authenticated'
         }))
 
@@ -38,7 +38,7 @@ async def deauthenticate(state, doc):
     for id in ids:
         del state.index[id]
     state.token = None
-    await state.socket.send(json.dumps({
+    await state.socket.send(JSON.dumps({
         'action': 'deauthenticated'
     }))
 
@@ -46,7 +46,7 @@ async def status(state, doc):
     '''
     Trigger an `authenticated` or `deauthenticated` event.
     '''
-    await state.socket.send(json.dumps({
+    await state.socket.send(JSON.dumps({
         'action': 'authenticated' if state.token else 'deauthenticated'
     }))
 
@@ -57,8 +57,8 @@ def exists(Model):
     def wrapper(handler):
         async def decorator(state, doc, *args, **kargs):
             id = kargs.get('id')
-            if not id or not await Model.exists(id):
-                await state.socket.send(json.dumps({
+            if not id or not await context(state).load(Model, id):
+                await state.socket.send(JSON.dumps({
                     'action': 'document-not-found',
                     'type': Model._table,
                     'id': id
@@ -4,8 +4,10 @@ from abc import ABC, abstractmethod
 import jwt
 from sanic import Blueprint
 
-from . error import Error
-from . header import content_type, accept, jsonapi
+from . context import context
+from . error import Error, encode_error, error_document
+from . header import content_type, accept, jsonapi, jsonapi_body
+from . pipeline import wrap
 from . preflight import preflight
 from . validate import validate
 
@@ -16,61 +18,45 @@ __options__ = {
     'verify_nbf': True
 }
 
+__header_error__ = encode_error('Invalid Authorization Header',
+    'The authorization header is invalid.', 403)
+__expired_error__ = encode_error('Invalid Token Error',
+    'The token has expired.', 403)
+__immature_error__ = encode_error('Invalid Token Error',
+    'The token is not yet valid.', 403)
+
 def webtoken(handler):
     '''
     Decode the webtoken, if provided, and inject it into
     the request chain's `\*\*kargs` as `token`.
     '''
-    async def decorator(request, *args, **kargs):
-        authorization = request.headers.get('Authorization')
-        if authorization:
-            authorization = authorization.split(' ')
-            if not len(authorization) == 2:
-                error = Error(
-                    title = 'Invalid Authorization Header',
-                    detail = 'The authorization header is invalid.',
-                    status = 403
-                )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
-            if authorization[0].lower() == 'bearer':
-                token = authorization[1]
-                try:
-                    kargs['token'] = jwt.decode(token, __secret__,
-                        algorithms=[__algorithm__],
-                        options=__options__
-                    )
-                except jwt.ExpiredSignatureError:
-                    error = Error(
-                        title = 'Invalid Token Error',
-                        detail = 'The token has expired.',
-                        status = 403
-                    )
-                    return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
-                except jwt.ImmatureSignatureError:
-                    error = Error(
-                        title = 'Invalid Token Error',
-                        detail = 'The token is not yet valid.',
-                        status = 403
-                    )
-                    return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
-                except Exception as e:
-                    error = Error(
-                        title = 'Invalid Authorization Header',
-                        detail = str(e),
-                        status = 403
-                    )
-                    return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
-            else:
-                error = Error(
-                    title = 'Invalid Authorization Header',
-                    detail = 'The authorization header is invalid.',
-                    status = 403
+    return wrap(_webtoken)(handler)
+
+def _webtoken(request, kargs):
+    authorization = request.headers.get('Authorization')
+    if authorization:
+        authorization = authorization.split(' ')
+        if not len(authorization) == 2:
+            return jsonapi_body(__header_error__, status=403)
+        if authorization[0].lower() == 'bearer':
+            token = authorization[1]
+            try:
+                kargs['token'] = jwt.decode(token, __secret__,
+                    algorithms=[__algorithm__],
+                    options=__options__
                 )
-                return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
+            except jwt.ExpiredSignatureError:
+                return jsonapi_body(__expired_error__, status=403)
+            except jwt.ImmatureSignatureError:
+                return jsonapi_body(__immature_error__, status=403)
+            except Exception as e:
+                return jsonapi(error_document('Invalid Authorization Header',
+                    str(e), 403), status=403)
         else:
-            kargs['token'] = None
-        return await handler(request, *args, **kargs)
-    return decorator
+            return jsonapi_body(__header_error__, status=403)
+    else:
+        kargs['token'] = None
+    return None
 
 
 class WebToken(ABC):
@@ -174,8 +160,7 @@ class WebToken(ABC):
     @classmethod
     async def _post(cls, request):
 
-        data = request.json.get('data')
-        attributes = data.get('attributes')
+        attributes = context(request).attributes
 
         try:
             payload = await cls.create(attributes)
@@ -206,19 +191,7 @@ class WebToken(ABC):
             )
             return jsonapi({ 'errors': [ error.serialize() ] }, status=403)
 
-        attributes = None
-        if request.json and request.json.get('data'):
-            attributes = request.json.get('data').get('attributes')
-            if not attributes:
-                if not token:
-                    error = Error(
-                        title = 'Refresh Token Error',
-                        detail = 'No attributes provided.',
-                        status = 403
-                    )
-                    return jsonapi({
-                        'errors': [ error.serialize() ]
-                    }, status=403)
+        attributes = context(request).attributes
 
         try:
             payload = await cls.refresh(attributes, token)
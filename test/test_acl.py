@@ -1,27 +1,27 @@
 from sugar_asynctest import AsyncTestCase
 from sugar_odm import MemoryModel, Model, Field
 
-from sugar_api.acl import _check_acl, _check_action
+from sugar_api.acl import ACL, compile_acl, _acl_query, _check_acl, _allowed
 
 class ACLTest(AsyncTestCase):
 
     default_loop = True
 
-    async def test_check_action_invalid(self):
+    async def test_allowed_invalid(self):
 
-        result = _check_action('action', [ ])
+        result = _allowed('action', frozenset())
 
         self.assertFalse(result)
 
-    async def test_check_action_valid(self):
+    async def test_allowed_valid(self):
 
-        result = _check_action('action', [ 'action' ])
+        result = _allowed('action', frozenset([ 'action' ]))
 
         self.assertTrue(result)
 
-    async def test_check_action_all(self):
+    async def test_allowed_all(self):
 
-        result = _check_action('action', [ 'all' ])
+        result = _allowed('action', frozenset([ 'all' ]))
 
         self.assertTrue(result)
 
@@ -332,3 +332,95 @@ class ACLTest(AsyncTestCase):
         }, alpha.id, Alpha)
 
         self.assertFalse(result)
+
+    async def test_check_acl_grouped_missing(self):
+
+        class Beta(MemoryModel):
+            pass
+
+        class Alpha(MemoryModel):
+            owners = Field(type=list)
+
+        beta = Beta()
+        await beta.save()
+
+        alpha = Alpha()
+        await alpha.save()
+
+        result = await _check_acl('action', {
+            '#owners': ['action']
+        }, {
+            'data': { 'id': beta.id }
+        }, alpha.id, Alpha)
+
+        self.assertFalse(result)
+
+    async def test_compile_acl(self):
+
+        acl = {
+            'unauthorized': [ 'read' ],
+            'self': [ 'all' ],
+            'administrator': [ 'read', 'update' ],
+            '$owner': [ 'update' ],
+            '#gamma.owners': [ 'delete' ]
+        }
+
+        compiled = compile_acl(acl)
+
+        self.assertIsInstance(compiled, ACL)
+        self.assertIs(compile_acl(compiled), compiled)
+        self.assertEqual(compiled.unauthorized, frozenset([ 'read' ]))
+        self.assertEqual(compiled.other, frozenset())
+        self.assertEqual(compiled.groups, {
+            'administrator': frozenset([ 'read', 'update' ])
+        })
+        self.assertEqual(compiled.specific, ((('owner',), frozenset([ 'update' ])),))
+        self.assertEqual(compiled.grouped, ((('gamma', 'owners'), frozenset([ 'delete' ])),))
+        self.assertEqual(compiled.fields, frozenset([ 'update', 'delete' ]))
+
+    async def test_compile_acl_empty(self):
+
+        self.assertIsNone(compile_acl(None))
+        self.assertIsNone(compile_acl({ }))
+
+    async def test_check_acl_compiled(self):
+
+        acl = compile_acl({
+            'administrator': [ 'read' ],
+            'other': [ 'create' ]
+        })
+
+        token = { 'data': { 'id': 'aabbcc', 'groups': [ 'administrator' ] } }
+
+        self.assertTrue(await _check_acl('read', acl, token, None, None))
+        self.assertFalse(await _check_acl('create', acl, token, None, None))
+
+    async def test_acl_query(self):
+
+        acl = {
+            '$owner': [ 'read' ],
+            '#gamma.members': [ 'all' ],
+            '$editor': [ 'update' ]
+        }
+
+        token = { 'data': { 'id': 'aabbcc' } }
+
+        self.assertEqual(_acl_query('read', acl, token), {
+            '$or': [
+                { 'owner': 'aabbcc' },
+                { 'gamma.members': 'aabbcc' }
+            ]
+        })
+        self.assertEqual(_acl_query('update', { '$editor': [ 'update' ] }, token),
+            { 'editor': 'aabbcc' })
+
+    async def test_acl_query_none(self):
+
+        acl = {
+            'other': [ 'read' ],
+            '$owner': [ 'update' ]
+        }
+
+        self.assertIsNone(_acl_query('read', acl, { 'data': { 'id': 'aabbcc' } }))
+        self.assertIsNone(_acl_query('update', acl, None))
+        self.assertIsNone(_acl_query('update', acl, { 'data': { } }))
@@ -0,0 +1,147 @@
+from sugar_asynctest import AsyncTestCase
+
+from sugar_api import cache
+from sugar_api.redis import Redis
+
+
+class Store(object):
+
+    '''
+    Stands in for Redis, keeping values in a dictionary with expiry times
+    on a clock set by the test.
+    '''
+
+    def __init__(self):
+        self.values = { }
+        self.expiry = { }
+        self.clock = 0
+
+    def _get(self, key):
+        if key in self.expiry and self.expiry[key] <= self.clock:
+            self.values.pop(key, None)
+            del self.expiry[key]
+        return self.values.get(key)
+
+    async def mget(self, *keys):
+        return list(map(self._get, keys))
+
+    async def set(self, key, value, expire=None):
+        self.values[key] = value
+        self.expiry.pop(key, None)
+        if expire:
+            self.expiry[key] = self.clock + expire
+
+    async def expire(self, key, expire):
+        if self._get(key) is not None:
+            self.expiry[key] = self.clock + expire
+
+    def multi_exec(self):
+        return Transaction(self)
+
+
+class Transaction(object):
+
+    '''
+    Stands in for a Redis MULTI/EXEC block of :class:`Store`.
+    '''
+
+    def __init__(self, store):
+        self.store = store
+        self.commands = [ ]
+
+    def __getattr__(self, name):
+        return lambda *args, **kargs: \
+            self.commands.append((name, args, kargs))
+
+    async def execute(self):
+        for (name, args, kargs) in self.commands:
+            await getattr(self.store, name)(*args, **kargs)
+
+
+class CacheTest(AsyncTestCase):
+
+    default_loop = True
+
+    def setUp(self):
+        self.redis = Store()
+        self.connect = Redis.connect
+        async def connect(**kargs):
+            return self.redis
+        Redis.connect = connect
+
+    def tearDown(self):
+        Redis.connect = self.connect
+
+    async def test_get_miss(self):
+
+        self.assertEqual(await cache.get('table', 'id', 'user'),
+            (None, None, b'0'))
+
+    async def test_put_tag(self):
+
+        await cache.put('table', 'id', 'user', b'0', b'{"data":null}', 60, '"abcd"')
+
+        self.assertEqual(await cache.get('table', 'id', 'user'),
+            (b'{"data":null}', '"abcd"', b'0'))
+
+    async def test_put_no_tag(self):
+
+        await cache.put('table', 'id', 'user', b'0', b'{"a":"b:c"}', 60)
+
+        self.assertEqual(await cache.get('table', 'id', 'user'),
+            (b'{"a":"b:c"}', None, b'0'))
+
+    async def test_get_generation(self):
+
+        await cache.put('table', 'id', 'user', b'0', b'{ }', 60)
+
+        self.redis.values[cache._generation_key('table', 'id')] = b'1'
+
+        self.assertEqual(await cache.get('table', 'id', 'user'),
+            (None, None, b'1'))
+
+
+    async def invalidate(self):
+        transaction = self.redis.multi_exec()
+        cache.invalidate(transaction, 'table', 'id', 60)
+        await transaction.execute()
+
+    async def test_invalidate_generation_expired(self):
+
+        await self.invalidate()
+
+        self.redis.clock = 90
+
+        generation = (await cache.get('table', 'id', 'user'))[2]
+
+        await cache.put('table', 'id', 'user', generation, b'OLD', 60)
+
+        # XXX: The generation set at 0 would expire at 120, caching the
+        # XXX: entry keeps it until 210.
+
+        self.redis.clock = 125
+
+        self.assertEqual((await cache.get('table', 'id', 'user'))[0], b'OLD')
+
+        await self.invalidate()
+
+        self.assertIsNone((await cache.get('table', 'id', 'user'))[0])
+
+    async def test_invalidate_unique(self):
+
+        await self.invalidate()
+
+        generation = (await cache.get('table', 'id', 'user'))[2]
+
+        await cache.put('table', 'id', 'user', generation, b'OLD', 60)
+
+        # XXX: Once every key has expired, a new generation never matches
+        # XXX: the one of an older entry.
+
+        self.redis.values[cache._entry_key('table', 'id', 'user')] = \
+            generation + b'::OLD'
+        del self.redis.values[cache._generation_key('table', 'id')]
+
+        await self.invalidate()
+
+        self.assertIsNone((await cache.get('table', 'id', 'user'))[0])
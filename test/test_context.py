@@ -0,0 +1,99 @@
+from types import SimpleNamespace
+
+from sugar_asynctest import AsyncTestCase
+
+from sugar_api.context import Context, command_context, context
+from sugar_api.websocket import exists
+
+
+class Model(object):
+
+    _table = 'models'
+
+    loads = 0
+
+    @classmethod
+    async def find_by_id(cls, id):
+        cls.loads += 1
+        return { 'id': id }
+
+
+class ContextTest(AsyncTestCase):
+
+    default_loop = True
+
+    def test_context_shared(self):
+
+        request = SimpleNamespace(ctx=SimpleNamespace(), json={ })
+
+        self.assertIs(context(request), context(request))
+
+    def test_context_without_ctx(self):
+
+        request = SimpleNamespace(json={ })
+
+        self.assertIsInstance(context(request), Context)
+
+    def test_context_data(self):
+
+        request = SimpleNamespace(ctx=SimpleNamespace(), json={
+            'data': {
+                'type': 'models',
+                'attributes': { 'field': 'value' }
+            }
+        })
+
+        ctx = context(request)
+
+        self.assertEqual(ctx.data['type'], 'models')
+        self.assertEqual(ctx.attributes, { 'field': 'value' })
+
+    def test_context_no_data(self):
+
+        request = SimpleNamespace(ctx=SimpleNamespace(), json=None)
+
+        ctx = context(request)
+
+        self.assertIsNone(ctx.data)
+        self.assertIsNone(ctx.attributes)
+
+    async def test_context_load(self):
+
+        request = SimpleNamespace(ctx=SimpleNamespace(), json=None)
+
+        Model.loads = 0
+
+        model = await context(request).load(Model, 'alpha')
+
+        self.assertIs(await context(request).load(Model, 'alpha'), model)
+        self.assertEqual(Model.loads, 1)
+
+    def test_command_context(self):
+
+        state = SimpleNamespace()
+
+        ctx = command_context(state)
+
+        self.assertIs(context(state), ctx)
+        self.assertIsNot(command_context(state), ctx)
+
+    async def test_command_context_exists(self):
+
+        state = SimpleNamespace()
+
+        Model.loads = 0
+
+        @exists(Model)
+        async def handler(state, doc, id):
+            return await context(state).load(Model, id)
+
+        command_context(state)
+
+        self.assertEqual(await handler(state, None, id='alpha'), { 'id': 'alpha' })
+        self.assertEqual(Model.loads, 1)
+
+        command_context(state)
+
+        await handler(state, None, id='alpha')
+
+        self.assertEqual(Model.loads, 2)
@@ -0,0 +1,89 @@
+from datetime import datetime, timezone
+from json import dumps
+from unittest import TestCase, skipIf
+from uuid import UUID
+
+from bson import ObjectId
+
+from sugar_api import JSON
+from sugar_api.encoder import StandardBackend, OrjsonBackend, orjson
+
+
+document = {
+    'data': [
+        {
+            'type': 'mixins',
+            'id': '5f0000000000000000000000',
+            'attributes': {
+                'name': 'café  \x7f',
+                'path': '/a/b</script>',
+                'count': 2 ** 70,
+                'ratio': 0.1,
+                'small': 1e-05,
+                'large': 1e+16,
+                'created': datetime(2020, 1, 2, 3, 4, 5, 6),
+                'updated': datetime(2020, 1, 2, tzinfo=timezone.utc),
+                'flags': [ True, False, None ],
+                'nested': { 'empty': { }, 'list': [ ] }
+            }
+        }
+    ],
+    'meta': { 'offset': 0, 'limit': 100 }
+}
+
+
+class JSONTest(TestCase):
+
+    def tearDown(self):
+        JSON.set_backend('json')
+
+    def test_standard_output(self):
+
+        self.assertEqual(StandardBackend().dumps(document), dumps(document,
+            separators=(',', ':'), default=lambda date: date.isoformat()))
+
+    def test_standard_ids(self):
+
+        self.assertEqual(StandardBackend().dumps({
+            'oid': ObjectId('5f0000000000000000000000'),
+            'uuid': UUID('12345678123456781234567812345678')
+        }), '{"oid":"5f0000000000000000000000",' \
+            '"uuid":"12345678-1234-5678-1234-567812345678"}')
+
+    @skipIf(not orjson, 'orjson is not installed')
+    def test_orjson_output(self):
+
+        backend = OrjsonBackend()
+
+        self.assertEqual(backend.dumpb(document), StandardBackend().dumpb(document))
+
+        plain = { 'data': { 'id': '5f3e', 'attributes': { 'value': 1.5 } } }
+
+        self.assertEqual(backend.dumpb(plain), StandardBackend().dumpb(plain))
+
+    @skipIf(not orjson, 'orjson is not installed')
+    def test_orjson_ids(self):
+
+        data = {
+            'oid': ObjectId('5f0000000000000000000000'),
+            'uuid': UUID('12345678123456781234567812345678')
+        }
+
+        self.assertEqual(OrjsonBackend().dumps(data), StandardBackend().dumps(data))
+
+    @skipIf(not orjson, 'orjson is not installed')
+    def test_orjson_loads(self):
+
+        self.assertEqual(OrjsonBackend().loads(b'{"a":[1,"b"]}'), { 'a': [ 1, 'b' ] })
+
+        with self.assertRaises(ValueError):
+            OrjsonBackend().loads('{')
+
+    def test_set_backend(self):
+
+        JSON.set_backend('json')
+
+        self.assertIsInstance(JSON.backend, StandardBackend)
+
+        with self.assertRaises(Exception):
+            JSON.set_backend('undefined')
@@ -0,0 +1,43 @@
+import json
+from unittest import TestCase
+
+from sugar_api import Error
+from sugar_api.encoder import JSON
+from sugar_api.error import error_document, encode_error
+
+
+class ErrorTest(TestCase):
+
+    def test_error_document(self):
+
+        error = Error(
+            title = 'Invalid Accept Header',
+            detail = 'The Accept header provided is of an invalid type: None.',
+            links = {
+                'about': 'http://jsonapi.org/format/#content-negotiation'
+            },
+            status = 403
+        )
+
+        self.assertEqual(JSON.dumpb(error_document(
+            'Invalid Accept Header',
+            'The Accept header provided is of an invalid type: None.',
+            403,
+            links = {
+                'about': 'http://jsonapi.org/format/#content-negotiation'
+            }
+        )), JSON.dumpb({ 'errors': [ error.serialize() ] }))
+
+    def test_encode_error(self):
+
+        body = encode_error('ACL Error', 'Insufficient priviliges.', 403)
+
+        self.assertDictEqual(json.loads(body), {
+            'errors': [
+                {
+                    'title': 'ACL Error',
+                    'detail': 'Insufficient priviliges.',
+                    'status': 403
+                }
+            ]
+        })
@@ -1,10 +1,15 @@
+import asyncio
 import json
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
 
 from sugar_asynctest import AsyncTestCase
 from sugar_document import Document
 from sugar_odm import MongoDBModel, Field
 
-from sugar_api import JSONAPIMixin
+from sugar_api import JSONAPIMixin, TimestampMixin, cursor
+from sugar_api.acl import _acl
+from sugar_api.redis import Redis
 
 
 def decode(response):
@@ -15,6 +20,176 @@ class Mixin(MongoDBModel, JSONAPIMixin):
     field = Field()
 
 
+class StreamMixin(MongoDBModel, JSONAPIMixin):
+    __stream__ = True
+    field = Field()
+
+
+class ReadManyMixin(MongoDBModel, JSONAPIMixin):
+    field = Field()
+
+    @classmethod
+    async def on_read_many(cls, models, token):
+        return [
+            Exception('Hidden.') if model.field == 'hidden' else None
+            for model in models
+        ]
+
+
+class ShortReadManyMixin(MongoDBModel, JSONAPIMixin):
+    field = Field()
+
+    @classmethod
+    async def on_read_many(cls, models, token):
+        return [ None ]
+
+
+class CachedMixin(MongoDBModel, JSONAPIMixin):
+    __cache__ = { 'expire': 60 }
+    field = Field()
+
+
+class CachedReadMixin(MongoDBModel, JSONAPIMixin):
+    __cache__ = { 'expire': 60 }
+    field = Field()
+
+    async def on_read(self, token):
+        pass
+
+
+class CancelledReadMixin(MongoDBModel, JSONAPIMixin):
+    field = Field()
+
+    async def on_read(self, token):
+        if self.field == 'hidden':
+            raise asyncio.CancelledError()
+
+
+class ReadMixin(MongoDBModel, JSONAPIMixin):
+    field = Field()
+
+    async def on_read(self, token):
+        if self.field == 'hidden':
+            raise Exception('Hidden.')
+
+
+class RestrictedMixin(MongoDBModel, JSONAPIMixin):
+    __get__ = {
+        'secret': [ 'administrator', '$owner' ]
+    }
+    owner = Field()
+    secret = Field()
+
+
+class VersionMixin(MongoDBModel, JSONAPIMixin, TimestampMixin):
+    __version__ = 'updated'
+    updated = Field()
+
+
+class VersionReadMixin(MongoDBModel, JSONAPIMixin, TimestampMixin):
+    __version__ = 'updated'
+    updated = Field()
+    field = Field()
+
+    async def on_read(self, token):
+        if self.field == 'hidden':
+            raise Exception('Hidden.')
+
+
+class CountMixin(MongoDBModel, JSONAPIMixin):
+    __count__ = { 'threshold': 2 }
+    field = Field()
+
+    calls = [ ]
+
+    @classmethod
+    async def count(cls, query, limit=0):
+        cls.calls.append(limit)
+        total = 0
+        async for model in cls.find(query, limit=limit):
+            total += 1
+        return total
+
+
+class SetMixin(MongoDBModel, JSONAPIMixin):
+    __set__ = {
+        'field': [ 'administrator' ]
+    }
+    field = Field()
+
+
+class EstimatedCountMixin(CountMixin):
+
+    @classmethod
+    async def estimated_document_count(cls):
+        return 1000000
+
+
+class QueryMixin(MongoDBModel, JSONAPIMixin):
+    __query__ = {
+        'filter': {
+            'field': [ '$eq' ]
+        }
+    }
+    field = Field()
+
+
+class OwnedMixin(MongoDBModel, JSONAPIMixin):
+    __acl__ = {
+        '$owner': [ 'read' ]
+    }
+    owner = Field()
+    field = Field()
+
+
+class AuthorMixin(MongoDBModel, JSONAPIMixin):
+    name = Field()
+
+
+class BookMixin(MongoDBModel, JSONAPIMixin):
+    __relationships__ = {
+        'author': {
+            'field': 'author',
+            'model': AuthorMixin
+        }
+    }
+    title = Field()
+    author = Field()
+
+
+class VersionBookMixin(MongoDBModel, JSONAPIMixin, TimestampMixin):
+    __version__ = 'updated'
+    __relationships__ = {
+        'author': {
+            'field': 'author',
+            'model': AuthorMixin
+        }
+    }
+    updated = Field()
+    author = Field()
+
+
+class Store(object):
+
+    def __init__(self):
+        self.values = { }
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, expire=None):
+        self.values[key] = str(value).encode()
+
+
+class StreamWriter(object):
+
+    def __init__(self):
+        self.chunks = [ ]
+
+    async def write(self, data):
+        self.chunks.append(data)
+
+
 class JSONAPIMixinTest(AsyncTestCase):
 
     default_loop = True
@@ -130,6 +305,94 @@ class JSONAPIMixinTest(AsyncTestCase):
 
         await Mixin.drop()
 
+    async def test_read_by_id_not_modified(self):
+
+        test = VersionMixin({
+            'updated': '2020-01-01T00:00:00'
+        })
+
+        await test.save()
+
+        response = await VersionMixin._read(Document({
+            'args': { },
+            'headers': { }
+        }), test.id)
+
+        self.assertEqual(response.status, 200)
+
+        tag = response.headers.get('ETag')
+
+        self.assertIsNotNone(tag)
+
+        response = await VersionMixin._read(Document({
+            'args': { },
+            'headers': {
+                'If-None-Match': tag
+            }
+        }), test.id)
+
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.body, b'')
+
+        await VersionMixin.drop()
+
+    async def test_read_by_id_not_modified_read_check(self):
+
+        test = VersionReadMixin({
+            'updated': '2020-01-01T00:00:00',
+            'field': 'hidden'
+        })
+
+        await test.save()
+
+        tag = VersionReadMixin._version_etag(Document({ 'query_string': '' }),
+            test, 'updated', None)
+
+        response = await VersionReadMixin._read(Document({
+            'args': { },
+            'headers': {
+                'If-None-Match': tag
+            }
+        }), test.id)
+
+        self.assertEqual(response.status, 403)
+
+        await VersionReadMixin.drop()
+
+    async def test_read_by_id_include_no_version_etag(self):
+
+        author = AuthorMixin({ 'name': 'Alpha' })
+
+        await author.save()
+
+        test = VersionBookMixin({
+            'updated': '2020-01-01T00:00:00',
+            'author': author.id
+        })
+
+        await test.save()
+
+        tag = VersionBookMixin._version_etag(Document({
+            'query_string': 'include=author'
+        }), test, 'updated', None)
+
+        response = await VersionBookMixin._read(Document({
+            'args': {
+                'include': 'author'
+            },
+            'query_string': 'include=author',
+            'headers': {
+                'If-None-Match': tag
+            }
+        }), test.id)
+
+        self.assertEqual(response.status, 200)
+        self.assertIsNone(response.headers.get('ETag'))
+        self.assertEqual(decode(response).included[0].id, author.id)
+
+        await VersionBookMixin.drop()
+        await AuthorMixin.drop()
+
     async def test_read_by_id_no_data_found(self):
 
         response = await Mixin._read(Document({
@@ -200,6 +463,309 @@ class JSONAPIMixinTest(AsyncTestCase):
 
         await Mixin.drop()
 
+    async def test_read_multiple_keyset(self):
+
+        await Mixin.add([
+            { 'field': '1' },
+            { 'field': '2' },
+            { 'field': '3' }
+        ])
+
+        response = await Mixin._read(Document({
+            'path': '/mixins',
+            'query_args': [ ('sort', 'field'), ('page[size]', '2') ],
+            'args': {
+                'sort': 'field',
+                'page[size]': 2
+            }
+        }))
+
+        response = decode(response)
+
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(response.data[1].attributes.field, '2')
+
+        query = parse_qs(urlparse(response.links.next).query)
+
+        response = await Mixin._read(Document({
+            'path': '/mixins',
+            'args': {
+                'sort': 'field',
+                'page[size]': 2,
+                'page[after]': query['page[after]'][0]
+            }
+        }))
+
+        response = decode(response)
+
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0].attributes.field, '3')
+        self.assertIsNone(response.links)
+
+        await Mixin.drop()
+
+    async def test_read_multiple_keyset_invalid_cursor(self):
+
+        response = await Mixin._read(Document({
+            'args': {
+                'page[after]': 'invalid'
+            }
+        }))
+
+        self.assertEqual(response.status, 400)
+
+        response = decode(response)
+
+        self.assertEqual(response.errors[0].detail, 'Invalid cursor.')
+
+    async def test_read_multiple_keyset_cursor_operator(self):
+
+        after = cursor.encode([ { '$ne': None }, { '$regex': '.*' } ])
+
+        response = await Mixin._read(Document({
+            'args': {
+                'sort': 'field',
+                'page[after]': after
+            }
+        }))
+
+        self.assertEqual(response.status, 400)
+
+        response = decode(response)
+
+        self.assertEqual(response.errors[0].detail, 'Invalid cursor.')
+
+    async def test_read_multiple_stream(self):
+
+        await StreamMixin.add([
+            { 'field': '1' },
+            { 'field': '2' },
+            { 'field': '3' }
+        ])
+
+        response = await StreamMixin._read(Document({
+            'args': {
+                'sort': 'field'
+            }
+        }))
+
+        writer = StreamWriter()
+
+        await response.streaming_fn(writer)
+
+        response = Document(json.loads(''.join(writer.chunks)))
+
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(response.data[2].attributes.field, '3')
+        self.assertEqual(response.meta.limit, 100)
+
+        await StreamMixin.drop()
+
+    async def test_read_multiple_on_read_many(self):
+
+        await ReadManyMixin.add([
+            { 'field': 'visible' },
+            { 'field': 'hidden' },
+            { 'field': 'visible' }
+        ])
+
+        response = await ReadManyMixin._read(Document({
+            'args': { }
+        }))
+
+        response = decode(response)
+
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(response.errors[0].detail, 'Hidden.')
+
+        await ReadManyMixin.drop()
+
+    async def test_read_multiple_on_read_concurrent(self):
+
+        await ReadMixin.add([
+            { 'field': 'visible' },
+            { 'field': 'hidden' },
+            { 'field': 'visible' }
+        ])
+
+        response = await ReadMixin._read(Document({
+            'args': { }
+        }))
+
+        response = decode(response)
+
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(response.errors[0].detail, 'Hidden.')
+
+        await ReadMixin.drop()
+
+    async def test_on_read_many_length(self):
+
+        errors = [ ]
+
+        models = await ShortReadManyMixin._on_read([
+            ShortReadManyMixin({ 'field': 'alpha' }),
+            ShortReadManyMixin({ 'field': 'beta' })
+        ], None, errors)
+
+        self.assertEqual(models, [ ])
+        self.assertEqual(len(errors), 2)
+
+    async def test_on_read_cancelled(self):
+
+        errors = [ ]
+
+        models = await CancelledReadMixin._on_read([
+            CancelledReadMixin({ 'field': 'visible' }),
+            CancelledReadMixin({ 'field': 'hidden' })
+        ], None, errors)
+
+        self.assertEqual(len(models), 1)
+        self.assertEqual(models[0].field, 'visible')
+        self.assertEqual(len(errors), 1)
+
+    async def test_render_restrictions(self):
+
+        model = RestrictedMixin({
+            'owner': 'abcd',
+            'secret': 'value'
+        })
+
+        await model.save()
+
+        data = model.render(None)
+
+        self.assertIsNone(data['attributes'].get('secret'))
+
+        data = model.render({
+            'data': {
+                'id': 'abcd',
+                'groups': [ 'user' ]
+            }
+        })
+
+        self.assertEqual(data['attributes'].get('secret'), 'value')
+
+        data = model.render({
+            'data': {
+                'id': 'efgh',
+                'groups': [ 'administrator' ]
+            }
+        })
+
+        self.assertEqual(data['attributes'].get('secret'), 'value')
+
+        await RestrictedMixin.drop()
+
+    async def test_cache_audience(self):
+
+        audience = RestrictedMixin._cache_audience(None, 'abcd')
+
+        self.assertEqual(audience, 'unauthorized:unauthorized')
+
+        audience = RestrictedMixin._cache_audience({
+            'data': {
+                'id': 'abcd',
+                'groups': [ 'user', 'administrator' ]
+            }
+        }, 'abcd')
+
+        self.assertEqual(audience, 'administrator,user:self')
+
+        audience = RestrictedMixin._cache_audience({
+            'data': {
+                'id': 'efgh',
+                'groups': [ 'user' ]
+            }
+        }, 'abcd')
+
+        self.assertEqual(audience, 'user:efgh')
+
+        audience = Mixin._cache_audience({
+            'data': {
+                'id': 'efgh',
+                'groups': [ 'user' ]
+            }
+        }, 'abcd')
+
+        self.assertEqual(audience, 'user')
+
+    async def test_acl_rules(self):
+
+        rules = OwnedMixin._acl_rules()
+
+        self.assertIs(OwnedMixin._acl_rules(), rules)
+        self.assertEqual(rules.specific, ((('owner',), frozenset([ 'read' ])),))
+        self.assertIsNone(Mixin._acl_rules())
+
+    async def test_set_rules(self):
+
+        rules = SetMixin._set_rules()
+
+        self.assertIs(SetMixin._set_rules(), rules)
+        self.assertEqual(rules, (('field', 'field',
+            frozenset([ 'administrator' ]), ( ), None), ))
+
+    async def test_cacheable(self):
+
+        self.assertTrue(CachedMixin._cacheable())
+        self.assertFalse(CachedReadMixin._cacheable())
+        self.assertFalse(Mixin._cacheable())
+
+    async def count(self, query, model=CountMixin):
+        connect = Redis.connect
+        store = Store()
+        async def fake(**kargs):
+            return store
+        Redis.connect = fake
+        try:
+            return (await model._count(query), await model._count(query))
+        finally:
+            Redis.connect = connect
+
+    async def test_count_below_threshold(self):
+
+        await CountMixin.add([ { 'field': 'a' }, { 'field': 'a' }, { 'field': 'b' } ])
+
+        CountMixin.calls.clear()
+
+        total, cached = await self.count({ 'field': 'a' })
+
+        self.assertEqual(total, { 'total': 2, 'estimated': False })
+        self.assertEqual(cached, total)
+        self.assertEqual(CountMixin.calls, [ 3 ])
+
+        await CountMixin.drop()
+
+    async def test_count_above_threshold(self):
+
+        await CountMixin.add([ { 'field': 'a' }, { 'field': 'a' }, { 'field': 'a' } ])
+
+        CountMixin.calls.clear()
+
+        total, cached = await self.count({ 'field': 'a' })
+
+        self.assertEqual(total, { 'minimum': 3 })
+        self.assertEqual(cached, total)
+        self.assertEqual(CountMixin.calls, [ 3 ])
+
+        await CountMixin.drop()
+
+    async def test_count_unfiltered(self):
+
+        await CountMixin.add([ { 'field': 'a' }, { 'field': 'a' }, { 'field': 'a' } ])
+
+        total, cached = await self.count({ })
+
+        self.assertEqual(total, { 'minimum': 3 })
+
+        total, cached = await self.count({ }, EstimatedCountMixin)
+
+        self.assertEqual(total, { 'total': 1000000, 'estimated': True })
+        self.assertEqual(cached, total)
+
+        await CountMixin.drop()
+
     async def test_read_multiple_no_data_found(self):
 
         response = await Mixin._read(Document({
@@ -228,6 +794,297 @@ class JSONAPIMixinTest(AsyncTestCase):
 
         await Mixin.drop()
 
+    async def test_read_multiple_query_not_allowed(self):
+
+        response = await QueryMixin._read(Document({
+            'args': {
+                'query': '{ "field": { "$regex": ".*" } }'
+            }
+        }))
+
+        self.assertEqual(response.status, 400)
+
+        response = decode(response)
+
+        self.assertEqual(response.errors[0].detail, 'Operator $regex is not allowed on field.')
+
+    async def test_read_multiple_sparse_fields(self):
+
+        await RestrictedMixin.add({
+            'owner': 'abcd',
+            'secret': 'value'
+        })
+
+        response = await RestrictedMixin._read(Document({
+            'args': {
+                'fields[restricted_mixins]': 'owner'
+            }
+        }))
+
+        response = decode(response)
+
+        self.assertDictEqual(response.data[0].attributes, {
+            'owner': 'abcd'
+        })
+
+        await RestrictedMixin.drop()
+
+    async def test_read_multiple_projection_needed(self):
+
+        await RestrictedMixin.add({
+            'owner': 'abcd',
+            'secret': 'value'
+        })
+
+        response = await RestrictedMixin._read(Document({
+            'args': {
+                'fields': json.dumps({ 'secret': 1 })
+            }
+        }), token={ 'data': { 'id': 'abcd', 'groups': [ ] } })
+
+        response = decode(response)
+
+        self.assertDictEqual(response.data[0].attributes, {
+            'secret': 'value'
+        })
+
+        await RestrictedMixin.drop()
+
+    async def test_read_multiple_sparse_fields_invalid(self):
+
+        response = await Mixin._read(Document({
+            'args': {
+                'fields[mixins]': 'field,undefined'
+            }
+        }))
+
+        self.assertEqual(response.status, 400)
+
+        response = decode(response)
+
+        self.assertEqual(response.errors[0].detail, 'Invalid field: undefined.')
+
+    async def test_read_multiple_include(self):
+
+        author = AuthorMixin({ 'name': 'Alpha' })
+
+        await author.save()
+
+        await BookMixin.add([
+            { 'title': 'One', 'author': author.id },
+            { 'title': 'Two', 'author': author.id }
+        ])
+
+        response = await BookMixin._read(Document({
+            'args': {
+                'include': 'author'
+            }
+        }))
+
+        response = decode(response)
+
+        self.assertEqual(response.data[0].relationships.author.data, {
+            'type': 'author_mixins',
+            'id': author.id
+        })
+
+        self.assertEqual(len(response.included), 1)
+        self.assertEqual(response.included[0].id, author.id)
+        self.assertEqual(response.included[0].attributes.name, 'Alpha')
+
+        await BookMixin.drop()
+        await AuthorMixin.drop()
+
+    async def test_read_multiple_include_invalid(self):
+
+        response = await BookMixin._read(Document({
+            'args': {
+                'include': 'publisher'
+            }
+        }))
+
+        self.assertEqual(response.status, 400)
+
+        response = decode(response)
+
+        self.assertEqual(response.errors[0].detail, 'Invalid include: publisher.')
+
+    async def test_read_multiple_include_fields_invalid(self):
+
+        response = await BookMixin._read(Document({
+            'args': {
+                'include': 'author',
+                'fields[author_mixins]': 'name,undefined'
+            }
+        }))
+
+        self.assertEqual(response.status, 400)
+
+        response = decode(response)
+
+        self.assertEqual(response.errors[0].detail, 'Invalid field: undefined.')
+
+        response = await BookMixin._read(Document({
+            'args': {
+                'fields[publishers]': 'name'
+            }
+        }))
+
+        self.assertEqual(response.status, 400)
+
+        response = decode(response)
+
+        self.assertEqual(response.errors[0].detail, 'Invalid fields type: publishers.')
+
+    async def test_read_multiple_acl_query(self):
+
+        await OwnedMixin.add({ 'owner': 'alpha', 'field': 'alpha' })
+        await OwnedMixin.add({ 'owner': 'beta', 'field': 'beta' })
+        await OwnedMixin.add({ 'owner': 'alpha', 'field': 'gamma' })
+
+        stage = _acl('read_all', OwnedMixin.__acl__, OwnedMixin, query='read')
+
+        token = { 'data': { 'id': 'alpha' } }
+
+        request = SimpleNamespace(ctx=SimpleNamespace(), args={
+            'query': '{ "field": { "$in": [ "alpha", "beta" ] } }'
+        })
+
+        self.assertIsNone(await stage(request, { 'token': token }))
+
+        response = decode(await OwnedMixin._read(request, token=token))
+
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0].attributes.field, 'alpha')
+
+        request = SimpleNamespace(ctx=SimpleNamespace(), args={ })
+
+        response = await stage(request, { 'token': None })
+
+        self.assertEqual(response.status, 403)
+
+        await OwnedMixin.drop()
+
+    async def test_bulk(self):
+
+        alpha = Mixin({ 'field': 'alpha' })
+        beta = Mixin({ 'field': 'beta' })
+
+        await alpha.save()
+        await beta.save()
+
+        response = await Mixin._bulk(Document({
+            'json': {
+                'atomic:operations': [
+                    {
+                        'op': 'add',
+                        'data': {
+                            'type': 'mixins',
+                            'attributes': { 'field': 'gamma' }
+                        }
+                    },
+                    {
+                        'op': 'update',
+                        'data': {
+                            'type': 'mixins',
+                            'id': alpha.id,
+                            'attributes': { 'field': 'delta' }
+                        }
+                    },
+                    {
+                        'op': 'remove',
+                        'ref': {
+                            'type': 'mixins',
+                            'id': beta.id
+                        }
+                    }
+                ]
+            }
+        }))
+
+        response = decode(response)
+
+        results = response['atomic:results']
+
+        self.assertEqual(results[0].data.attributes.field, 'gamma')
+        self.assertEqual(results[1].data.attributes.field, 'delta')
+        self.assertEqual(results[2].data.id, beta.id)
+
+        self.assertEqual((await Mixin.find_by_id(alpha.id)).field, 'delta')
+        self.assertFalse(await Mixin.exists(beta.id))
+
+        await Mixin.drop()
+
+    async def test_bulk_errors(self):
+
+        alpha = Mixin({ 'field': 'alpha' })
+
+        await alpha.save()
+
+        response = await Mixin._bulk(Document({
+            'json': {
+                'atomic:operations': [
+                    {
+                        'op': 'replace',
+                        'data': {
+                            'type': 'mixins'
+                        }
+                    },
+                    {
+                        'op': 'update',
+                        'data': {
+                            'type': 'mixins',
+                            'id': '5f0000000000000000000000',
+                            'attributes': { 'field': 'beta' }
+                        }
+                    },
+                    {
+                        'op': 'remove',
+                        'ref': {
+                            'type': 'mixins',
+                            'id': alpha.id
+                        }
+                    }
+                ]
+            }
+        }))
+
+        response = decode(response)
+
+        results = response['atomic:results']
+
+        self.assertEqual(results[0].errors[0].detail, 'Invalid operation: replace.')
+        self.assertEqual(results[0].errors[0].source.pointer, '/atomic:operations/0')
+        self.assertEqual(results[1].errors[0].status, 404)
+        self.assertEqual(results[1].errors[0].source.pointer, '/atomic:operations/1')
+        self.assertEqual(results[2].data.id, alpha.id)
+
+        await Mixin.drop()
+
+    async def test_bulk_token_invalid(self):
+
+        response = await SetMixin._bulk(Document({
+            'json': {
+                'atomic:operations': [
+                    {
+                        'op': 'add',
+                        'data': {
+                            'type': 'set_mixins',
+                            'attributes': { 'field': 'alpha' }
+                        }
+                    }
+                ]
+            }
+        }), token={ 'data': { 'id': 'alpha', 'groups': 'administrator' } })
+
+        self.assertEqual(response.status, 403)
+
+        response = decode(response)
+
+        self.assertEqual(response.errors[0].detail, 'Token data groups attribute is not a list.')
+
+        await SetMixin.drop()
+
     async def test_read_multiple_sort_ascending(self):
 
         await Mixin.add([
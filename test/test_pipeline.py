@@ -0,0 +1,72 @@
+from sugar_asynctest import AsyncTestCase
+
+from sugar_api.pipeline import pipeline, wrap
+
+
+class PipelineTest(AsyncTestCase):
+
+    default_loop = True
+
+    async def test_pipeline_order(self):
+
+        calls = [ ]
+
+        def first(request, kargs):
+            calls.append('first')
+            kargs['token'] = 'token'
+
+        async def second(request, kargs):
+            calls.append('second')
+
+        async def handler(request, token=None):
+            calls.append(token)
+            return 'response'
+
+        def after(request, kargs, response):
+            calls.append('after')
+            return response.upper()
+
+        run = pipeline(handler, [ first, None, second ], after=[ after ])
+
+        self.assertEqual(await run(None), 'RESPONSE')
+        self.assertListEqual(calls, [ 'first', 'second', 'token', 'after' ])
+
+    async def test_pipeline_early_response(self):
+
+        calls = [ ]
+
+        async def reject(request, kargs):
+            return 'rejected'
+
+        async def handler(request):
+            calls.append('handler')
+
+        def after(request, kargs, response):
+            calls.append('after')
+            return response
+
+        run = pipeline(handler, [ reject ], after=[ after ])
+
+        self.assertEqual(await run(None), 'rejected')
+        self.assertListEqual(calls, [ ])
+
+    async def test_wrap_disabled(self):
+
+        async def handler(request):
+            pass
+
+        self.assertIs(wrap(None)(handler), handler)
+
+    async def test_wrap(self):
+
+        def reject(request, kargs):
+            if kargs.get('id') == 'bad':
+                return 'rejected'
+
+        async def handler(request, id=None):
+            return id
+
+        decorated = wrap(reject)(handler)
+
+        self.assertEqual(await decorated(None, id='bad'), 'rejected')
+        self.assertEqual(await decorated(None, id='good'), 'good')
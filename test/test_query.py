@@ -0,0 +1,94 @@
+from sugar_asynctest import AsyncTestCase
+
+from sugar_api.query import _check_query, _check_sort, _check_index
+
+
+spec = {
+    'filter': {
+        'name': [ '$eq', '$in' ],
+        'created': [ '$gt', '$lt' ],
+        'title': [ '$regex' ]
+    },
+    'sort': [ 'created' ]
+}
+
+
+class QueryTest(AsyncTestCase):
+
+    default_loop = True
+
+    def test_check_query_allowed(self):
+
+        message = _check_query({
+            'name': 'value',
+            'created': { '$gt': 1, '$lt': 2 }
+        }, spec)
+
+        self.assertIsNone(message)
+
+    def test_check_query_field(self):
+
+        message = _check_query({
+            'undefined': 'value'
+        }, spec)
+
+        self.assertEqual(message, 'Filtering on undefined is not allowed.')
+
+    def test_check_query_operator(self):
+
+        message = _check_query({
+            'name': { '$regex': '.*' }
+        }, spec)
+
+        self.assertEqual(message, 'Operator $regex is not allowed on name.')
+
+    def test_check_query_regex_options(self):
+
+        message = _check_query({
+            'title': { '$regex': '^a', '$options': 'i' }
+        }, spec)
+
+        self.assertIsNone(message)
+
+    def test_check_query_logical(self):
+
+        message = _check_query({
+            '$or': [
+                { 'name': 'value' },
+                { 'undefined': 'value' }
+            ]
+        }, spec)
+
+        self.assertEqual(message, 'Filtering on undefined is not allowed.')
+
+    def test_check_query_where(self):
+
+        message = _check_query({
+            '$where': 'sleep(1000)'
+        }, spec)
+
+        self.assertEqual(message, 'Operator $where is not allowed.')
+
+    def test_check_sort(self):
+
+        self.assertIsNone(_check_sort([ [ 'created', -1 ] ], spec))
+        self.assertIsNone(_check_sort(None, spec))
+
+        message = _check_sort([ [ 'name', 1 ] ], spec)
+
+        self.assertEqual(message, 'Sorting on name is not allowed.')
+
+    def test_check_index(self):
+
+        indexes = [ [ 'name', 'created' ] ]
+
+        self.assertTrue(_check_index({ }, None, indexes))
+        self.assertTrue(_check_index({ 'name': 'value' }, None, indexes))
+        self.assertTrue(_check_index({
+            '$or': [ { 'name': 'a' }, { 'name': 'b' } ]
+        }, None, indexes))
+        self.assertFalse(_check_index({
+            '$or': [ { 'name': 'a' }, { 'created': 1 } ]
+        }, None, indexes))
+        self.assertFalse(_check_index({ 'created': 1 }, None, indexes))
+        self.assertFalse(_check_index({ }, [ [ 'created', 1 ] ], indexes))
@@ -0,0 +1,457 @@
+import json
+from importlib import import_module
+from types import SimpleNamespace
+from unittest import TestCase, skipIf
+
+from aioredis import ReplyError
+from sugar_asynctest import AsyncTestCase
+
+from sugar_api.rate import _rate, _rate_headers, _rate_options, socketrate, \
+    TokenBucket, __fixed_window__, __sliding_window__, __gcra__
+from sugar_api.redis import Redis, Script
+
+# XXX: The module, sugar_api.rate is the decorator.
+
+rate = import_module('sugar_api.rate')
+
+try:
+    from lupa import lua51
+except ImportError:
+    lua51 = None
+
+
+class FixedWindow(object):
+
+    '''
+    Stands in for Redis, running the fixed window script in Python.
+    '''
+
+    def __init__(self):
+        self.counts = { }
+        self.scripts = set()
+        self.calls = 0
+        self.args = None
+
+    async def evalsha(self, digest, keys=[ ], args=[ ]):
+        self.calls += 1
+        if not digest in self.scripts:
+            raise ReplyError('NOSCRIPT No matching script.')
+        key = keys[0]
+        limit = args[1]
+        self.args = args
+        count = self.counts[key] = self.counts.get(key, 0) + \
+            (args[2] if digest == __fixed_window__.digest and len(args) > 2 else 1)
+        return [ int(count <= limit), max(limit - count, 0), args[0] ]
+
+    async def eval(self, script, keys=[ ], args=[ ]):
+        self.scripts.add(Script(script).digest)
+        return await self.evalsha(Script(script).digest, keys, args)
+
+
+class Lua(object):
+
+    '''
+    Runs the rate limit scripts in Lua 5.1, as Redis does, against an in
+    memory store with a clock set by the test.
+    '''
+
+    def __init__(self):
+        self.runtime = lua51.LuaRuntime()
+        self.store = { }
+        self.expiry = { }
+        self.clock = 1000000000
+        self.runtime.globals().redis = self.runtime.table_from({
+            'call': self.call
+        })
+
+    def call(self, command, *args):
+        key = args[0] if args else None
+        if key in self.expiry and self.expiry[key] <= self.clock:
+            del self.store[key]
+            del self.expiry[key]
+        command = command.upper()
+        if command == 'TIME':
+            return self.runtime.table(str(self.clock // 1000),
+                str(self.clock % 1000 * 1000))
+        if command == 'INCRBY':
+            self.store[key] = int(self.store.get(key, 0)) + int(args[1])
+            return self.store[key]
+        if command == 'PTTL':
+            if not key in self.store:
+                return -2
+            if not key in self.expiry:
+                return -1
+            return self.expiry[key] - self.clock
+        if command == 'PEXPIRE':
+            self.expiry[key] = self.clock + int(args[1])
+            return 1
+        if command == 'GET':
+            return self.store.get(key, False)
+        if command == 'SET':
+            self.store[key] = str(args[1])
+            if args[2:3] == ( 'PX', ):
+                self.expiry[key] = self.clock + int(args[3])
+            return 'OK'
+        if command == 'HMGET':
+            fields = self.store.get(key, { })
+            return self.runtime.table(*map(lambda field: \
+                fields.get(field, False), args[1:]))
+        if command == 'HSET':
+            fields = self.store.setdefault(key, { })
+            for index in range(1, len(args), 2):
+                fields[args[index]] = str(args[index + 1])
+            return 1
+        raise Exception(f'Unsupported command: {command}')
+
+    def run(self, script, args):
+        function = self.runtime.eval(f'function(KEYS, ARGV) {script.source} end')
+        result = function(self.runtime.table('key'),
+            self.runtime.table(*map(str, args)))
+        return [ int(result[1]), int(result[2]), int(result[3]) ]
+
+
+@skipIf(not lua51, 'lupa is not installed')
+class ScriptTest(TestCase):
+
+    def setUp(self):
+        self.lua = Lua()
+
+    def test_fixed_window(self):
+
+        results = list(map(lambda index: \
+            self.lua.run(__fixed_window__, [ 1000, 3 ]), range(4)))
+
+        self.assertEqual(results, [
+            [ 1, 2, 1000 ], [ 1, 1, 1000 ], [ 1, 0, 1000 ], [ 0, 0, 1000 ]
+        ])
+
+        self.lua.clock += 1000
+
+        self.assertEqual(self.lua.run(__fixed_window__, [ 1000, 3 ]), [ 1, 2, 1000 ])
+
+    def test_sliding_window(self):
+
+        self.lua.clock = 5000000500
+
+        results = list(map(lambda index: \
+            self.lua.run(__sliding_window__, [ 1000, 4 ]), range(5)))
+
+        self.assertEqual(list(map(lambda result: result[0], results)),
+            [ 1, 1, 1, 1, 0 ])
+        self.assertEqual(results[3], [ 1, 0, 500 ])
+        self.assertEqual(results[4], [ 0, 0, 500 ])
+
+        # XXX: 100ms into the next window, 90% of the previous window's
+        # XXX: four hits still count.
+
+        self.lua.clock += 600
+
+        self.assertEqual(self.lua.run(__sliding_window__, [ 1000, 4 ]), [ 0, 0, 150 ])
+
+        self.lua.clock += 150
+
+        self.assertEqual(self.lua.run(__sliding_window__, [ 1000, 4 ])[0], 1)
+
+        self.lua.clock += 3000
+
+        self.assertEqual(self.lua.run(__sliding_window__, [ 1000, 4 ]), [ 1, 3, 750 ])
+
+    def test_gcra(self):
+
+        results = list(map(lambda index: \
+            self.lua.run(__gcra__, [ 1000, 10, 3 ]), range(4)))
+
+        self.assertEqual(results, [
+            [ 1, 2, 100 ], [ 1, 1, 200 ], [ 1, 0, 300 ], [ 0, 0, 100 ]
+        ])
+
+        self.lua.clock += 100
+
+        self.assertEqual(self.lua.run(__gcra__, [ 1000, 10, 3 ]), [ 1, 0, 300 ])
+
+        self.lua.clock += 1000
+
+        self.assertEqual(self.lua.run(__gcra__, [ 1000, 10, 3 ]), [ 1, 2, 100 ])
+
+
+class RateTest(AsyncTestCase):
+
+    default_loop = True
+
+    def setUp(self):
+        self.redis = FixedWindow()
+        self.connect = Redis.connect
+        async def connect(**kargs):
+            return self.redis
+        Redis.connect = connect
+
+    def tearDown(self):
+        Redis.connect = self.connect
+
+    def request(self):
+        return SimpleNamespace(ctx=SimpleNamespace(), ip='127.0.0.1',
+            path='/v1/endpoint')
+
+    async def test_rate_none(self):
+
+        self.assertIsNone(_rate(1, 'none'))
+
+    async def test_rate_invalid(self):
+
+        with self.assertRaises(Exception):
+            _rate(1, 'fortnightly')
+
+    async def test_rate_invalid_algorithm(self):
+
+        with self.assertRaises(Exception):
+            _rate(1, 'secondly', algorithm='leaky')
+
+    async def test_rate_invalid_interval(self):
+
+        with self.assertRaises(Exception):
+            _rate(1, -1)
+
+    async def test_rate_options(self):
+
+        self.assertEqual(_rate_options(None), { 'limit': 0, 'interval': 'none' })
+        self.assertEqual(_rate_options((1, 'secondly')),
+            { 'limit': 1, 'interval': 'secondly' })
+        self.assertEqual(_rate_options({ 'limit': 5, 'interval': 30, 'algorithm': 'gcra' }),
+            { 'limit': 5, 'interval': 30, 'algorithm': 'gcra' })
+        self.assertEqual(_rate_options({ 'limit': 5, 'interval': 30, 'ceiling': True }),
+            { 'limit': 5, 'interval': 30 })
+        self.assertEqual(_rate_options({ 'limit': 5, 'interval': 30, 'ceiling': True }, socket=True),
+            { 'limit': 5, 'interval': 30, 'ceiling': True })
+
+    async def test_rate_gcra(self):
+
+        stage = _rate(10, 2.5, algorithm='gcra', burst=20)
+
+        self.assertIsNone(await stage(self.request(), { }))
+        self.assertIn(__gcra__.digest, self.redis.scripts)
+        self.assertEqual(self.redis.args, [ 2500, 10, 20 ])
+
+    async def test_rate_interval_seconds(self):
+
+        stage = _rate(1, 30)
+
+        await stage(self.request(), { })
+
+        response = await stage(self.request(), { })
+
+        self.assertEqual(response.status, 429)
+        self.assertIn('per 30 seconds', json.loads(response.body)['errors'][0]['detail'])
+
+    async def test_rate_local_invalid(self):
+
+        with self.assertRaises(Exception):
+            _rate(1, 'secondly', algorithm='gcra', local=0.5)
+
+    async def test_rate_local_range(self):
+
+        with self.assertRaises(Exception):
+            _rate(1, 'secondly', local=0)
+
+        with self.assertRaises(Exception):
+            _rate(1, 'secondly', local=1.5)
+
+    async def test_rate_local_window_ended(self):
+
+        stage = _rate(100, 'minutely', local=0.5, batch=10)
+
+        for index in range(3):
+            self.assertIsNone(await stage(self.request(), { }))
+
+        monotonic = rate.monotonic
+        rate.monotonic = lambda: monotonic() + 61
+
+        try:
+            self.assertIsNone(await stage(self.request(), { }))
+        finally:
+            rate.monotonic = monotonic
+
+        self.assertEqual(self.redis.counts, { 'fixed:127.0.0.1:/v1/endpoint': 4 })
+
+    async def test_rate_local_keys(self):
+
+        local_keys = rate.__local_keys__
+        rate.__local_keys__ = 2
+
+        stage = _rate(100, 'minutely', local=0.5, batch=10)
+
+        def request(path):
+            return SimpleNamespace(ctx=SimpleNamespace(), ip='127.0.0.1',
+                path=path)
+
+        try:
+            for path in ( '/alpha', '/alpha', '/beta', '/gamma' ):
+                self.assertIsNone(await stage(request(path), { }))
+        finally:
+            rate.__local_keys__ = local_keys
+
+        self.assertEqual(self.redis.counts, {
+            'fixed:127.0.0.1:/alpha': 2,
+            'fixed:127.0.0.1:/beta': 1,
+            'fixed:127.0.0.1:/gamma': 1
+        })
+
+    async def test_rate_local_batch(self):
+
+        stage = _rate(100, 'minutely', local=0.5, batch=10)
+
+        for index in range(25):
+            self.assertIsNone(await stage(self.request(), { }))
+
+        # XXX: One call to load the script and one per batch.
+
+        self.assertEqual(self.redis.calls, 4)
+        self.assertEqual(self.redis.counts, { 'fixed:127.0.0.1:/v1/endpoint': 21 })
+
+    async def test_rate_local_limit(self):
+
+        stage = _rate(4, 'minutely', local=0.5)
+
+        for index in range(4):
+            self.assertIsNone(await stage(self.request(), { }))
+
+        response = await stage(self.request(), { })
+
+        self.assertEqual(response.status, 429)
+
+        calls = self.redis.calls
+
+        response = await stage(self.request(), { })
+
+        self.assertEqual(response.status, 429)
+        self.assertEqual(self.redis.calls, calls)
+
+    async def test_rate_allowed(self):
+
+        stage = _rate(2, 'minutely')
+
+        request = self.request()
+
+        self.assertIsNone(await stage(request, { }))
+
+        response = _rate_headers(request, { }, SimpleNamespace(headers={ }))
+
+        self.assertEqual(response.headers['X-RateLimit-Limit'], '2')
+        self.assertEqual(response.headers['X-RateLimit-Remaining'], '1')
+        self.assertEqual(response.headers['X-RateLimit-Reset'], '60')
+
+    async def test_rate_exceeded(self):
+
+        stage = _rate(1, 'minutely')
+
+        self.assertIsNone(await stage(self.request(), { }))
+
+        response = await stage(self.request(), { })
+
+        self.assertEqual(response.status, 429)
+        self.assertEqual(response.headers['X-RateLimit-Remaining'], '0')
+        self.assertEqual(response.headers['Retry-After'], '60')
+        self.assertEqual(json.loads(response.body)['errors'][0]['status'], 429)
+
+    async def test_rate_single_round_trip(self):
+
+        stage = _rate(10, 'minutely')
+
+        for index in range(3):
+            await stage(self.request(), { })
+
+        # XXX: The first call loads the script.
+
+        self.assertEqual(self.redis.calls, 4)
+        self.assertIn(__fixed_window__.digest, self.redis.scripts)
+
+    async def test_rate_token(self):
+
+        stage = _rate(1, 'minutely', namespace='items')
+
+        await stage(self.request(), { 'token': { 'data': { 'id': 'alpha' } } })
+
+        self.assertEqual(self.redis.counts, { 'fixed:alpha:items': 1 })
+
+    def socket(self, sent):
+
+        async def send(message):
+            sent.append(json.loads(message))
+
+        return SimpleNamespace(token=None, request=self.request(),
+            socket=SimpleNamespace(send=send))
+
+    async def test_socketrate(self):
+
+        sent = [ ]
+
+        @socketrate(1, 'secondly')
+        async def handler(state, doc):
+            return 'handled'
+
+        state = self.socket(sent)
+
+        self.assertEqual(await handler(state, None), 'handled')
+        self.assertIsNone(await handler(state, None))
+        self.assertEqual(sent[0]['action'], 'rate-limit')
+        self.assertEqual(self.redis.calls, 0)
+
+    async def test_socketrate_connection(self):
+
+        sent = [ ]
+
+        @socketrate(1, 'minutely')
+        async def handler(state, doc):
+            return 'handled'
+
+        self.assertEqual(await handler(self.socket(sent), None), 'handled')
+        self.assertEqual(await handler(self.socket(sent), None), 'handled')
+
+    async def test_socketrate_ceiling(self):
+
+        sent = [ ]
+
+        @socketrate(1, 'minutely', ceiling=True)
+        async def handler(state, doc):
+            return 'handled'
+
+        self.assertEqual(await handler(self.socket(sent), None), 'handled')
+        self.assertIsNone(await handler(self.socket(sent), None))
+        self.assertEqual(sent[0]['action'], 'rate-limit')
+
+    async def test_socketrate_ceiling_bucket(self):
+
+        sent = [ ]
+
+        @socketrate(2, 'minutely', ceiling=True)
+        async def handler(state, doc):
+            return 'handled'
+
+        state = self.socket(sent)
+
+        self.redis.counts['fixed:127.0.0.1:/v1/endpoint'] = 2
+
+        self.assertIsNone(await handler(state, None))
+        self.assertEqual(state.buckets['/v1/endpoint'].tokens, 2)
+
+    async def test_token_bucket(self):
+
+        bucket = TokenBucket(2, 1000, 2)
+
+        self.assertEqual(bucket.take()[:2], (True, 1))
+        self.assertEqual(bucket.take()[:2], (True, 0))
+
+        (allowed, remaining, reset) = bucket.take()
+
+        self.assertFalse(allowed)
+        self.assertTrue(0 < reset <= 500)
+
+        bucket.time -= 500
+
+        self.assertTrue(bucket.take()[0])
+
+    async def test_token_bucket_check(self):
+
+        bucket = TokenBucket(2, 1000, 2)
+
+        self.assertEqual(bucket.check()[:2], (True, 1))
+        self.assertEqual(bucket.tokens, 2)
@@ -0,0 +1,179 @@
+import asyncio
+
+import aioredis
+from sugar_asynctest import AsyncTestCase
+
+from sugar_api import redis
+from sugar_api.redis import Redis
+
+
+class Pool(object):
+
+    '''
+    Stands in for an aioredis pool.
+    '''
+
+    def __init__(self, host, **kargs):
+        self.host = host
+        self.kargs = kargs
+        self.closed = False
+        self.waited = False
+        self.fail = False
+        self.size = 4
+        self.freesize = 1
+        self.maxsize = kargs.get('maxsize')
+
+    async def execute(self, *args):
+        if self.fail:
+            raise ConnectionError('Connection lost.')
+        return b'PONG'
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        self.waited = True
+
+
+class RedisTest(AsyncTestCase):
+
+    default_loop = True
+
+    def setUp(self):
+        self.pools = [ ]
+        self.create_pool = aioredis.create_pool
+        self.create_redis_pool = aioredis.create_redis_pool
+        self.fail = False
+        async def create(host, **kargs):
+            await asyncio.sleep(0)
+            if self.fail:
+                raise ConnectionError('Connection refused.')
+            pool = Pool(host, **kargs)
+            self.pools.append(pool)
+            return pool
+        aioredis.create_pool = create
+        aioredis.create_redis_pool = create
+        self.state = (Redis.loop, Redis.connections, Redis.options, Redis.health,
+            Redis.locks, Redis.reconnecting, Redis.default, Redis.lowlevel,
+            Redis.backoff_base, Redis.default_host, Redis.default_minsize,
+            Redis.default_maxsize)
+        Redis.loop = object()
+        Redis.connections = { }
+        Redis.options = { }
+        Redis.health = { }
+        Redis.locks = { }
+        Redis.reconnecting = { }
+        Redis.default = None
+        Redis.lowlevel = None
+        Redis.backoff_base = 0
+        Redis.default_connection(host='redis://redis')
+
+    def tearDown(self):
+        aioredis.create_pool = self.create_pool
+        aioredis.create_redis_pool = self.create_redis_pool
+        for task in Redis.reconnecting.values():
+            task.cancel()
+        (Redis.loop, Redis.connections, Redis.options, Redis.health,
+            Redis.locks, Redis.reconnecting, Redis.default, Redis.lowlevel,
+            Redis.backoff_base, Redis.default_host, Redis.default_minsize,
+            Redis.default_maxsize) = self.state
+
+    async def test_connect_default(self):
+
+        connection = await Redis.connect()
+
+        self.assertIs(Redis.default, connection)
+        self.assertEqual(connection.host, 'redis://redis')
+        self.assertEqual(connection.kargs['maxsize'], 10)
+
+        serialize = redis.serialize
+        redis.serialize = None
+
+        try:
+            self.assertIs(await Redis.connect(), connection)
+        finally:
+            redis.serialize = serialize
+
+    async def test_connect_lowlevel(self):
+
+        connection = await Redis.connect(lowlevel=True)
+
+        self.assertIs(Redis.lowlevel, connection)
+        self.assertIsNot(await Redis.connect(), connection)
+        self.assertNotIn('lowlevel', connection.kargs)
+
+    async def test_connect_options(self):
+
+        connection = await Redis.connect(maxsize=20)
+
+        self.assertIs(await Redis.connect(maxsize=20), connection)
+        self.assertEqual(connection.kargs['maxsize'], 20)
+        self.assertIsNone(Redis.default)
+
+    async def test_connect_closed(self):
+
+        connection = await Redis.connect()
+        connection.close()
+
+        self.assertIsNot(await Redis.connect(), connection)
+        self.assertEqual(len(self.pools), 2)
+        self.assertTrue(connection.waited)
+
+    async def test_connect_concurrent(self):
+
+        connections = await asyncio.gather(Redis.connect(), Redis.connect())
+
+        self.assertIs(connections[0], connections[1])
+        self.assertEqual(len(self.pools), 1)
+
+    async def test_check(self):
+
+        connection = await Redis.connect()
+
+        self.assertTrue(await Redis.check(redis.__default_key__))
+
+        connection.fail = True
+
+        self.assertFalse(await Redis.check(redis.__default_key__))
+
+        await Redis.reconnecting[redis.__default_key__]
+
+        self.assertTrue(connection.closed)
+        self.assertTrue(connection.waited)
+        self.assertIsNot(Redis.default, connection)
+
+        stats = Redis.stats()['default']
+
+        self.assertTrue(stats['healthy'])
+        self.assertEqual(stats['failures'], 1)
+        self.assertEqual(stats['reconnects'], 1)
+
+    async def test_check_unreachable(self):
+
+        connection = await Redis.connect()
+        await Redis.connect(lowlevel=True)
+
+        connection.fail = True
+        self.fail = True
+
+        self.assertFalse(await Redis.check(redis.__default_key__))
+
+        for index in range(10):
+            await asyncio.sleep(0)
+
+        # XXX: The reconnect keeps retrying without blocking other checks.
+
+        self.assertFalse(Redis.reconnecting[redis.__default_key__].done())
+        self.assertFalse(await Redis.check(redis.__default_key__))
+        self.assertTrue(await Redis.check(redis.__lowlevel_key__))
+        self.assertFalse(Redis.stats()['default']['healthy'])
+
+    async def test_stats(self):
+
+        await Redis.connect()
+
+        stats = Redis.stats()['default']
+
+        self.assertEqual(stats['size'], 4)
+        self.assertEqual(stats['free'], 1)
+        self.assertEqual(stats['utilization'], 0.3)
@@ -1,6 +1,21 @@
+from copy import deepcopy
+from types import SimpleNamespace
+
 from sugar_asynctest import AsyncTestCase
 
-from sugar_api.restrictions import _apply_restrictions, _get_value
+from sugar_api.restrictions import _apply_restrictions, _get_value, \
+    _compile_plan, _evaluate_plan, _apply_plan, _projection, \
+    _compile_restrictions, _has_fields, _set, _check_rule
+
+
+class Model(object):
+
+    loads = 0
+
+    @classmethod
+    async def find_by_id(cls, id):
+        cls.loads += 1
+        return SimpleNamespace(serialize=lambda: { 'owner': 'abcd' })
 
 
 class RestrictionsTest(AsyncTestCase):
@@ -238,3 +253,243 @@ class RestrictionsTest(AsyncTestCase):
         }, 'abcd')
 
         self.assertIsNone(attributes.get('test'))
+
+    def test_plan_matches_restrictions(self):
+
+        restrictions = {
+            'public': [ 'unauthorized', 'user' ],
+            'private': [ 'administrator' ],
+            'owned': [ 'administrator', '$owner' ],
+            'shared': [ '#members' ],
+            'nested': {
+                'public': [ 'user' ],
+                'private': [ 'administrator' ]
+            },
+            'empty': {
+                'private': [ 'administrator' ]
+            }
+        }
+
+        model_data = {
+            'owner': 'abcd',
+            'members': [ 'abcd', 'efgh' ]
+        }
+
+        for groups in ([ ], [ 'user' ], [ 'administrator' ]):
+
+            for token_id in ('abcd', 'efgh', 'ijkl'):
+
+                attributes = {
+                    'public': 'value',
+                    'private': 'value',
+                    'owned': 'value',
+                    'shared': 'value',
+                    'nested': {
+                        'public': 'value',
+                        'private': 'value'
+                    },
+                    'empty': {
+                        'private': 'value'
+                    }
+                }
+
+                expected = deepcopy(attributes)
+
+                _apply_restrictions(expected, restrictions, groups, [ ], [ ], model_data, token_id)
+
+                plan = _compile_plan(restrictions, frozenset(groups))
+                results = _evaluate_plan(plan, model_data, token_id)
+                _apply_plan(attributes, plan, results)
+
+                self.assertDictEqual(attributes, expected)
+
+    def test_plan_static(self):
+
+        plan = _compile_plan({
+            'test': [ 'group' ],
+            'owned': [ '$owner' ]
+        }, frozenset([ 'group' ]))
+
+        self.assertEqual(len(plan[1]), 1)
+
+        attributes = {
+            'test': 'value',
+            'owned': 'value'
+        }
+
+        _apply_plan(attributes, plan, _evaluate_plan(plan, { }, 'abcd'))
+
+        self.assertDictEqual(attributes, {
+            'test': 'value'
+        })
+
+    def test_plan_denied(self):
+
+        plan = _compile_plan({
+            'test': [ 'group' ],
+            'nested': {
+                'test': [ 'group' ]
+            },
+            'owned': [ '$owner' ]
+        }, frozenset([ ]))
+
+        self.assertEqual(plan[2], ( 'test', 'nested.test' ))
+
+    def test_projection_exclusive(self):
+
+        projection = _projection(None, [ 'secret', 'owner' ], [ 'owner' ], '_id')
+
+        self.assertDictEqual(projection, {
+            'secret': 0
+        })
+
+    def test_projection_empty(self):
+
+        projection = _projection({ 'field': 1 }, [ ], [ ], '_id')
+
+        self.assertDictEqual(projection, {
+            'field': 1
+        })
+
+    def test_projection_inclusive(self):
+
+        projection = _projection({
+            'field': 1,
+            'secret': 1,
+            'owned': 1
+        }, [ 'secret' ], [ 'owner.id' ], '_id')
+
+        self.assertDictEqual(projection, {
+            'field': 1,
+            'owned': 1,
+            'owner.id': 1
+        })
+
+    def test_projection_inclusive_denied(self):
+
+        projection = _projection({
+            'secret': 1
+        }, [ 'secret' ], [ ], '_id')
+
+        self.assertDictEqual(projection, {
+            '_id': 1
+        })
+
+    def test_compile_restrictions(self):
+
+        restrictions = {
+            'field': [ 'administrator', '$owner' ],
+            'nested': {
+                'field': [ '#gamma.members' ]
+            }
+        }
+
+        nodes = _compile_restrictions(restrictions)
+
+        self.assertEqual(nodes[0], ('field', 'field',
+            frozenset([ 'administrator' ]), (('$', ('owner', )), ), None))
+        self.assertEqual(nodes[1][4], (('field', 'nested.field',
+            frozenset(), (('#', ('gamma', 'members')), ), None), ))
+        self.assertTrue(_has_fields(nodes))
+        self.assertFalse(_has_fields(_compile_restrictions({
+            'field': [ 'administrator' ]
+        })))
+
+    def test_restrictions_nested_replaced(self):
+
+        attributes = {
+            'nested': 'value'
+        }
+
+        errors = [ ]
+
+        _apply_restrictions(attributes, {
+            'nested': {
+                'private': [ 'administrator' ]
+            }
+        }, [ ], errors, [ ], None, '')
+
+        self.assertIsNone(attributes.get('nested'))
+        self.assertEqual(errors[0].detail, 'Cannot set attribute: nested')
+
+    def test_restrictions_grouped_missing(self):
+
+        attributes = {
+            'test': 'ing'
+        }
+
+        _apply_restrictions(attributes, {
+            'test': [ '#members' ]
+        }, [ ], [ ], [ ], { }, 'abcd')
+
+        self.assertIsNone(attributes.get('test'))
+
+    async def test_set_groups_only(self):
+
+        Model.loads = 0
+
+        stage = _set({ 'field': [ 'administrator' ] }, Model)
+
+        request = SimpleNamespace(ctx=SimpleNamespace(), json={
+            'data': { 'attributes': { 'field': 'value' } }
+        })
+
+        kargs = {
+            'id': 'efgh',
+            'token': { 'data': { 'id': 'abcd', 'groups': [ 'user' ] } }
+        }
+
+        await stage(request, kargs)
+
+        self.assertEqual(request.json['data']['attributes'], { })
+        self.assertEqual(len(kargs['errors']), 1)
+        self.assertEqual(Model.loads, 0)
+
+    async def test_set_fields(self):
+
+        Model.loads = 0
+
+        stage = _set({ 'field': [ 'administrator', '$owner' ] }, Model)
+
+        request = SimpleNamespace(ctx=SimpleNamespace(), json={
+            'data': { 'attributes': { 'field': 'value' } }
+        })
+
+        kargs = {
+            'id': 'efgh',
+            'token': { 'data': { 'id': 'abcd', 'groups': [ 'user' ] } }
+        }
+
+        await stage(request, kargs)
+
+        self.assertEqual(request.json['data']['attributes'], { 'field': 'value' })
+        self.assertEqual(Model.loads, 1)
+
+    async def test_check_rule_missing_value(self):
+
+        fields = ( ('$', ('owner',)), )
+
+        self.assertFalse(_check_rule(frozenset(), frozenset(), fields, { }, None))
+        self.assertFalse(_check_rule(frozenset(), frozenset(), fields, None, None))
+        self.assertTrue(_check_rule(frozenset(), frozenset(), fields,
+            { 'owner': 'abcd' }, 'abcd'))
+
+    async def test_evaluate_plan_missing_value(self):
+
+        plan = _compile_plan({ 'secret': [ '$owner' ] }, frozenset())
+
+        self.assertEqual(_evaluate_plan(plan, { }, None), [ False ])
+
+    async def test_set_groups_not_list(self):
+
+        stage = _set({ 'field': [ 'administrator' ] }, Model)
+
+        request = SimpleNamespace(ctx=SimpleNamespace(), json={
+            'data': { 'attributes': { 'field': 'value' } }
+        })
+
+        response = await stage(request, {
+            'token': { 'data': { 'id': 'abcd', 'groups': 'administrator' } }
+        })
+
+        self.assertEqual(response.status, 403)